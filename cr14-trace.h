@@ -0,0 +1,181 @@
+/* SPDX-License-Identifier: GPL-2.0-only */
+/*
+ * CR14 RFID Reader Driver tracepoints
+ *
+ * Copyright (c) 2020 Paul Guyot <pguyot@kallisys.net>
+ */
+
+#undef TRACE_SYSTEM
+#define TRACE_SYSTEM cr14
+
+#if !defined(_CR14_TRACE_H) || defined(TRACE_HEADER_MULTI_READ)
+#define _CR14_TRACE_H
+
+#include <linux/tracepoint.h>
+#include <linux/i2c.h>
+
+// Events are tagged with the I2C bus and address of the CR14, like
+// i2c-1-50, as several readers can be connected.
+
+#define show_cr14_command(command)                      \
+    __print_symbolic(command,                           \
+        { 0x06, "INITIATE" },                           \
+        { 0x08, "READ_BLOCK" },                         \
+        { 0x09, "WRITE_BLOCK" },                        \
+        { 0x0B, "GET_UID" },                            \
+        { 0x0C, "RESET_TO_INVENTORY" },                 \
+        { 0x0E, "SELECT" },                             \
+        { 0x0F, "COMPLETION" })
+
+TRACE_EVENT(cr14_round_start,
+    TP_PROTO(const struct i2c_client *i2c, int mode),
+    TP_ARGS(i2c, mode),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(int, mode)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->mode = mode;
+    ),
+    TP_printk("i2c-%d-%02x mode=%d", __entry->adapter, __entry->addr, __entry->mode)
+);
+
+TRACE_EVENT(cr14_round_end,
+    TP_PROTO(const struct i2c_client *i2c, int chips_found, int slot_markers, int collided_slots),
+    TP_ARGS(i2c, chips_found, slot_markers, collided_slots),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(int, chips_found)
+        __field(int, slot_markers)
+        __field(int, collided_slots)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->chips_found = chips_found;
+        __entry->slot_markers = slot_markers;
+        __entry->collided_slots = collided_slots;
+    ),
+    TP_printk("i2c-%d-%02x chips_found=%d slot_markers=%d collided_slots=%d",
+        __entry->adapter, __entry->addr,
+        __entry->chips_found, __entry->slot_markers, __entry->collided_slots)
+);
+
+TRACE_EVENT(cr14_rf,
+    TP_PROTO(const struct i2c_client *i2c, int on, int result),
+    TP_ARGS(i2c, on, result),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(int, on)
+        __field(int, result)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->on = on;
+        __entry->result = result;
+    ),
+    TP_printk("i2c-%d-%02x %s result=%d", __entry->adapter, __entry->addr,
+        __entry->on ? "on" : "off", __entry->result)
+);
+
+// A command written to the frame register: buffer is the length followed by
+// the command and its parameters (chip id or block address).
+TRACE_EVENT(cr14_frame_write,
+    TP_PROTO(const struct i2c_client *i2c, const u8 *buffer, int result),
+    TP_ARGS(i2c, buffer, result),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(u8, command)
+        __field(u8, param)
+        __field(int, result)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->command = buffer[1];
+        __entry->param = buffer[0] > 1 ? buffer[2] : 0;
+        __entry->result = result;
+    ),
+    TP_printk("i2c-%d-%02x %s param=%u result=%d", __entry->adapter, __entry->addr,
+        show_cr14_command(__entry->command), __entry->param, __entry->result)
+);
+
+// The frame register was read: count is the number of bytes returned by the
+// chip (0 if it did not answer, 255 on collision or CRC mismatch).
+TRACE_EVENT(cr14_frame_read,
+    TP_PROTO(const struct i2c_client *i2c, int count, int retries, int result),
+    TP_ARGS(i2c, count, retries, result),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(int, count)
+        __field(int, retries)
+        __field(int, result)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->count = count;
+        __entry->retries = retries;
+        __entry->result = result;
+    ),
+    TP_printk("i2c-%d-%02x count=%d retries=%d result=%d", __entry->adapter, __entry->addr,
+        __entry->count, __entry->retries, __entry->result)
+);
+
+TRACE_EVENT(cr14_slot_marker,
+    TP_PROTO(const struct i2c_client *i2c, int result),
+    TP_ARGS(i2c, result),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(int, result)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->result = result;
+    ),
+    TP_printk("i2c-%d-%02x result=%d", __entry->adapter, __entry->addr, __entry->result)
+);
+
+// A frame written to the read buffer, header is the message header (of the
+// wrapped message for timestamped frames).
+TRACE_EVENT(cr14_enqueue,
+    TP_PROTO(const struct i2c_client *i2c, u8 header, int timestamped, int len, int dropped),
+    TP_ARGS(i2c, header, timestamped, len, dropped),
+    TP_STRUCT__entry(
+        __field(int, adapter)
+        __field(u16, addr)
+        __field(u8, header)
+        __field(int, timestamped)
+        __field(int, len)
+        __field(int, dropped)
+    ),
+    TP_fast_assign(
+        __entry->adapter = i2c->adapter->nr;
+        __entry->addr = i2c->addr;
+        __entry->header = header;
+        __entry->timestamped = timestamped;
+        __entry->len = len;
+        __entry->dropped = dropped;
+    ),
+    TP_printk("i2c-%d-%02x header=%c timestamped=%d len=%d%s", __entry->adapter, __entry->addr,
+        __entry->header, __entry->timestamped, __entry->len, __entry->dropped ? " dropped" : "")
+);
+
+#endif /* _CR14_TRACE_H */
+
+// This part must be outside protection.
+#undef TRACE_INCLUDE_PATH
+#define TRACE_INCLUDE_PATH .
+#undef TRACE_INCLUDE_FILE
+#define TRACE_INCLUDE_FILE cr14-trace
+#include <trace/define_trace.h>
@@ -20,6 +20,15 @@
 #include <linux/delay.h>
 #include <linux/i2c.h>
 #include <linux/circ_buf.h>
+#include <linux/mutex.h>
+#include <linux/ktime.h>
+#include <linux/hrtimer.h>
+#include <linux/workqueue.h>
+#include <linux/idr.h>
+#include <linux/kref.h>
+
+#define CREATE_TRACE_POINTS
+#include "cr14-trace.h"
 
 // ========================================================================== //
 // PROTOCOL
@@ -33,6 +42,20 @@
 // uids of chips. The UIDs will be written as UID messages.
 // If the device is opened for reading and writing, it will be configured in
 // idle mode (awaiting commands).
+// A new mode replaces the previous one. It can be written while a polling
+// round is running: that round completes with the previous mode, and the new
+// one is used by the next round.
+// Read and write commands are queued, up to COMMAND_QUEUE_SIZE - 1 of them,
+// and are processed in order: the command at the front of the queue is run
+// as soon as a chip with its uid is found, followed by the next ones if they
+// target the same chip. Responses are therefore written in the order of the
+// commands. The mode is independent of the queue: UID and inventory messages
+// are still written while commands are pending.
+// Writing a command blocks while the queue is full.
+// The device can be opened with O_NONBLOCK: read and write then fail with
+// EAGAIN instead of waiting, and poll() reports when they can proceed.
+// If the reader is removed while the device is opened, read and write fail
+// with ENODEV and poll() reports POLLERR | POLLHUP.
 
 // ---- UID message ----
 // driver => client
@@ -58,17 +81,60 @@
 // 'P'
 #define MESSAGE_POLL_REPEAT_MODE_HEADER 'P'
 
+// An inventory message transitions the device in inventory mode. It polls
+// repeatedly like poll repeat mode, but instead of a UID message for each
+// chip, it writes a single inventory message at the end of each round, even
+// if no chip was found. Rounds are numbered from 0 when the device is opened
+// and the timestamp (ktime_get_ns) is taken when the round starts.
+// The statistics are the number of slot marker commands sent during the
+// round and the number of slots where chips collided (they are found in a
+// following slot marker pass of the same round).
+// No inventory message is written for a round aborted on an I2C error, but the
+// round number is still incremented, so clients can detect the gap.
+
+// ---- Inventory messages ----
+// client => driver
+// 'I'
+// driver => client
+// 'I' <round number (4 bytes, little endian)> <timestamp in ns (8 bytes, little endian)> <slot markers (1 byte)> <collided slots (1 byte)> <number of uids (1 byte)> <uids in little endian (8 bytes each)>
+#define MESSAGE_INVENTORY_MODE_HEADER 'I'
+
+// A presence message transitions the device in presence mode. It polls
+// repeatedly like poll repeat mode, and keeps a table of the chips in the
+// field. Instead of a UID message each time a chip is found, it writes an
+// arrived message when a chip enters the field, and a departed message when
+// it was not found for absence_ms (see sysfs). Rounds aborted on an I2C error
+// do not age the chips. The table is emptied when entering presence mode, so
+// chips already in the field are reported as arrived, and when leaving it, with
+// a departed message for each chip still in the field.
+
+// ---- Presence messages ----
+// client => driver
+// 'T'
+// driver => client
+// 'a' <uid in little endian (8 bytes)>
+// 'd' <uid in little endian (8 bytes)>
+#define MESSAGE_PRESENCE_MODE_HEADER 'T'
+#define MESSAGE_ARRIVED_HEADER 'a'
+#define MESSAGE_DEPARTED_HEADER 'd'
+
 //
-// An idle message transitions the device in idle mode.
+// An idle message transitions the device in idle mode. It also discards
+// pending commands, and is accepted even if the queue is full. No response is
+// written for discarded commands once the idle message is written, including
+// the command running at that time: the responses which can still be read are
+// already in the read buffer when write() returns, so a client reading until
+// EAGAIN before sending new commands gets every response it will ever get for
+// the discarded commands.
 
 // ---- Idle message ----
 // client => driver
 // 'i'
 #define MESSAGE_IDLE_HEADER 'i'
 
-// A read single block command will transition the device in read single mode.
-// It will poll repeatedly and once a chip with the matching uid is found, it
-// will read the proper block and write the result to the device.
+// A read single block command is queued. The device will poll repeatedly and
+// once a chip with the matching uid is found, it will read the proper block
+// and write the result to the device.
 
 // ---- Read single block messages (request and response) ----
 // client => driver
@@ -77,9 +143,9 @@
 // 'r' <data in little endian (4 bytes)>
 #define MESSAGE_READ_SINGLE_BLOCK_HEADER 'r'
 
-// A write single block command will transition the dvice in write single mode.
-// It will poll repeatedly and once a chip with the matching uid is found, it
-// will write the proper block, read it back and write the result to the device.
+// A write single block command is queued. The device will poll repeatedly and
+// once a chip with the matching uid is found, it will write the proper block,
+// read it back and write the result to the device.
 
 // ---- Write single block messages (request and response) ----
 // client => driver
@@ -88,9 +154,9 @@
 // 'w' <data in little endian (4 bytes)>
 #define MESSAGE_WRITE_SINGLE_BLOCK_HEADER 'w'
 
-// A read multiple blocks command will transition the device in read multiple
-// mode. It will poll repeatedly and once a chip with the matching uid is found,
-// it will read the proper blocks and write the result to the device.
+// A read multiple blocks command is queued. The device will poll repeatedly
+// and once a chip with the matching uid is found, it will read the proper
+// blocks and write the result to the device.
 
 // ---- Read multiple block messages (request and response) ----
 // client => driver
@@ -99,10 +165,9 @@
 // 'R' <number of addresses (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
 #define MESSAGE_READ_MULTIPLE_BLOCKS_HEADER 'R'
 
-// A write multiple blocks command will transition the device in write multiple
-// mode. It will poll repeatedly and once a chip with the matching uid is found,
-// it will write the proper blocks, read them back and write the result to the
-// device.
+// A write multiple blocks command is queued. The device will poll repeatedly
+// and once a chip with the matching uid is found, it will write the proper
+// blocks, read them back and write the result to the device.
 
 // ---- Write multiple block messages (request and response) ----
 // client => driver
@@ -111,6 +176,102 @@
 // 'W' <number of addresses (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
 #define MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER 'W'
 
+// A read multiple tags command is queued. The device will poll repeatedly and
+// read the proper blocks from every chip with one of the uids (up to 16, as
+// many as anticollision slots) as they are found, so a batch of chips in the
+// field is served within the same polling round. A response is written for
+// each chip, in the order chips are found. The command is complete once all
+// chips have been read. The write fails with EINVAL if there are no uids,
+// more than 16 or if a uid is listed twice.
+
+// ---- Read multiple tags messages (request and responses) ----
+// client => driver
+// 'M' <number of uids (1 byte)> <number of addresses (1 byte)> <uids in little endian (8 bytes each)> <addresses (1-255 bytes)>
+// driver => client
+// 'M' <uid in little endian (8 bytes)> <number of addresses (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
+#define MESSAGE_READ_MULTIPLE_TAGS_HEADER 'M'
+
+// Timestamps are off when the device is opened. A timestamps on message
+// enables them until a timestamps off message is sent or the device is
+// closed. While enabled, UID, arrived, departed and command response messages
+// are prefixed with the ktime_get_ns value taken when the chip answered (when
+// the round started for departed messages), as a single timestamped message.
+// Inventory messages already carry a timestamp and are not prefixed.
+
+// ---- Timestamps messages ----
+// client => driver
+// 'X' (on)
+// 'x' (off)
+// driver => client
+// 'E' <timestamp in ns (8 bytes, little endian)> <message>
+#define MESSAGE_TIMESTAMPS_ON_HEADER 'X'
+#define MESSAGE_TIMESTAMPS_OFF_HEADER 'x'
+#define MESSAGE_TIMESTAMPED_HEADER 'E'
+
+// A session command is queued. Once a chip with the matching uid is found, the
+// device writes the response and keeps RF on and the chip selected: commands
+// for this chip then run as soon as they are queued, without polling again.
+// The session is closed when the client sends a session release message, when
+// no command was queued for session_ms (see sysfs), when the next command
+// targets another chip, when a command fails or with a new mode. Commands
+// queued before the release message still run within the session. Polling is
+// suspended while a session is open.
+
+// ---- Session messages ----
+// client => driver
+// 'S' <uid in little endian (8 bytes)>
+// 's' (release)
+// driver => client
+// 'S' <uid in little endian (8 bytes)>
+#define MESSAGE_SESSION_HEADER 'S'
+#define MESSAGE_SESSION_RELEASE_HEADER 's'
+
+// A dump command is queued. The chip model is identified from the uid, and
+// the write fails with EINVAL if it is unknown. Once the chip is found, the
+// device reads all its blocks followed by the system block (255) and writes
+// them to the device.
+
+// ---- Dump messages (request and response) ----
+// client => driver
+// 'D' <uid in little endian (8 bytes)>
+// driver => client
+// 'D' <number of blocks (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)> <system block in little endian (4 bytes)>
+#define MESSAGE_DUMP_HEADER 'D'
+
+// Read range and write range commands are queued like read and write multiple
+// blocks commands, but blocks are addressed by the first address, a number of
+// blocks and a stride (the difference between consecutive addresses, 1 for
+// contiguous blocks) instead of a list of addresses, so requests have the same
+// size whatever the number of blocks. A write range command writes the same
+// data to every block, e.g. to erase them, then reads them back. The write
+// fails with EINVAL if count or stride is 0 or if the last address is over
+// 255.
+
+// ---- Range messages (request and response) ----
+// client => driver
+// 'G' <uid in little endian (8 bytes)> <first address (1 byte)> <number of blocks (1 byte)> <stride (1 byte)>
+// 'F' <uid in little endian (8 bytes)> <first address (1 byte)> <number of blocks (1 byte)> <stride (1 byte)> <data in little endian (4 bytes)>
+// driver => client
+// 'G' <number of blocks (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
+// 'F' <number of blocks (1 byte)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
+#define MESSAGE_READ_RANGE_HEADER 'G'
+#define MESSAGE_WRITE_RANGE_HEADER 'F'
+
+// A write and verify command is queued. Once the chip is found, the device
+// writes all the blocks back to back, then reads them back in a single pass
+// and only reports the blocks which do not hold the written data. With the
+// no verify flag, blocks are not read back and the response reports no
+// mismatch. This shortens the time a chip must stay in the field when
+// provisioning many blocks.
+
+// ---- Write and verify messages (request and response) ----
+// client => driver
+// 'V' <uid in little endian (8 bytes)> <flags (1 byte)> <number of addresses (1 byte)> <addresses (1-255 bytes)> <data in little endian (4 bytes)> ... <data in little endian (4 bytes)>
+// driver => client
+// 'V' <number of mismatches (1 byte)> <address (1 byte)> <data read back in little endian (4 bytes)> ... <address (1 byte)> <data read back in little endian (4 bytes)>
+#define MESSAGE_WRITE_AND_VERIFY_HEADER 'V'
+#define WRITE_FLAG_NO_VERIFY 0x01
+
 // ========================================================================== //
 // Definitions and data structures
 // ========================================================================== //
@@ -119,6 +280,8 @@
 
 #define DRV_NAME "cr14"
 #define DEVICE_NAME "rfid"
+// Maximum number of CR14 devices, one minor each.
+#define CR14_MAX_DEVICES 16
 
 #define CRX14_PARAMETER_REGISTER 0x00
 #define CRX14_IO_FRAME_REGISTER 0x01
@@ -144,21 +307,151 @@
 
 #define POLLING_TIMEOUT_SECS_DIV 2
 
+// Polling policy: the CR14 is polled every poll_min_ms while chips are in the
+// field or a command is pending. Once the field has been empty for
+// poll_backoff_rounds rounds, the interval doubles after each empty round, up
+// to poll_max_ms.
+// Defaults can be set as module parameters, and changed at runtime for each
+// device through sysfs (/sys/class/rfid/rfidN/poll_*).
+#define POLL_MIN_MS_DEFAULT 50
+#define POLL_MAX_MS_DEFAULT (1000 / POLLING_TIMEOUT_SECS_DIV)
+#define POLL_BACKOFF_ROUNDS_DEFAULT 10
+
+static unsigned int poll_min_ms = POLL_MIN_MS_DEFAULT;
+module_param(poll_min_ms, uint, 0644);
+MODULE_PARM_DESC(poll_min_ms, "Polling interval (ms) with chips in the field or pending commands");
+
+static unsigned int poll_max_ms = POLL_MAX_MS_DEFAULT;
+module_param(poll_max_ms, uint, 0644);
+MODULE_PARM_DESC(poll_max_ms, "Maximum polling interval (ms) when the field is empty");
+
+static unsigned int poll_backoff_rounds = POLL_BACKOFF_ROUNDS_DEFAULT;
+module_param(poll_backoff_rounds, uint, 0644);
+MODULE_PARM_DESC(poll_backoff_rounds, "Number of empty polling rounds before backing off");
+
+// Presence mode: a chip departs when it was not found for absence_ms. The
+// device is polled every poll_min_ms while chips are present.
+#define ABSENCE_MS_DEFAULT 200
+
+static unsigned int absence_ms = ABSENCE_MS_DEFAULT;
+module_param(absence_ms, uint, 0644);
+MODULE_PARM_DESC(absence_ms, "Delay (ms) after which a chip that was not found departs in presence mode");
+
+#define SESSION_MS_DEFAULT 500
+
+static unsigned int session_ms = SESSION_MS_DEFAULT;
+module_param(session_ms, uint, 0644);
+MODULE_PARM_DESC(session_ms, "Delay (ms) without any command after which a session is closed");
+
 enum cr14_mode {
     mode_idle,
     mode_poll_once,
     mode_poll_repeat,
+    mode_inventory,
+    mode_presence,
     mode_read_single_block,
     mode_write_single_block,
     mode_read_multiple_blocks,
-    mode_write_multiple_blocks
+    mode_write_multiple_blocks,
+    mode_read_multiple_tags,
+    mode_session,
+    mode_dump,
+    mode_read_range,
+    mode_write_range,
+    mode_write_and_verify
 };
 
-#define MAX_PACKET_SIZE 1285
+// Largest message: 'V' with 255 blocks.
+#define MAX_PACKET_SIZE 1286
+// Largest command response: 'V' with 255 mismatches.
+#define MAX_RESPONSE_SIZE (2 + (255 * 5))
+#define MAX_MULTIPLE_TAGS_UIDS 16
+#define INVENTORY_HEADER_SIZE 16
+#define INVENTORY_MAX_UIDS 64
+#define PRESENCE_MAX_TAGS 64
 #define CIRCULAR_BUFFER_SIZE 8192
+// Size of the command queue (a power of two). It holds at most
+// COMMAND_QUEUE_SIZE - 1 commands.
+#define COMMAND_QUEUE_SIZE 8
 
 #define IO_FRAME_REGISTER_MAX_RETRIES 200
 
+// Frame exchanges timing.
+// The CR14 does not acknowledge reads of the frame register until the frame
+// exchange with the PICC is complete. Instead of sleeping the worst case
+// duration, the driver sleeps a learned duration and then polls the frame
+// register. The learned duration starts from the time needed to transmit the
+// frames (1 ETU = 9.44 usec) and converges to the time when the exchange is
+// usually complete: it is shortened when the first read succeeds and moved
+// towards the measured duration otherwise.
+enum cr14_exchange {
+    exchange_initiate,      // 2 bytes, 1 byte answer
+    exchange_select,        // 2 bytes, 1 byte answer
+    exchange_get_uid,       // 1 byte, 8 bytes answer
+    exchange_read_block,    // 2 bytes, 4 bytes answer
+    exchange_write_block,   // 6 bytes, no answer
+    exchange_slot_marker,   // 16 slots, 1 byte answer in each
+    exchange_no_answer,     // 1 byte, no answer (completion, reset to inventory)
+    exchanges_count
+};
+
+struct cr14_exchange_timing {
+    const char *name;
+    unsigned int min_us;    // transmission time
+    unsigned int max_us;    // worst case, including watchdog timeouts
+};
+
+static const struct cr14_exchange_timing cr14_exchange_timings[exchanges_count] = {
+    [exchange_initiate] = { "initiate", 750, 2000 },
+    [exchange_select] = { "select", 750, 2000 },
+    [exchange_get_uid] = { "get_uid", 1200, 5000 },
+    [exchange_read_block] = { "read_block", 750, 2000 },
+    [exchange_write_block] = { "write_block", 800, 2000 },
+    [exchange_slot_marker] = { "slot_marker", 8000, 20000 },
+    [exchange_no_answer] = { "no_answer", 650, 2000 },
+};
+
+// Slack given to usleep_range, and delay between two reads of the frame
+// register.
+#define EXCHANGE_SLACK_US 100
+#define EXCHANGE_POLL_US 50
+
+// The PICC programs its EEPROM once it received a write block command,
+// which the CR14 does not wait for. Binary counters take longer.
+#define EEPROM_PROGRAMMING_US 5000
+#define COUNTER_PROGRAMMING_US 7000
+
+// Bucket n of statistics histograms counts durations below
+// STATS_HISTOGRAM_MIN_US << n, and the last bucket longer durations.
+#define STATS_HISTOGRAM_BUCKETS 16
+#define STATS_HISTOGRAM_MIN_US 128
+
+// Chip models, identified by uid byte 5 when bytes 7 and 6 are UID_MSB and
+// MANUFACTURER_ST (see the datasheets in README.md).
+#define UID_MSB 0xD0
+#define MANUFACTURER_ST 0x02
+#define SYSTEM_BLOCK 0xFF
+
+struct cr14_chip_model {
+    u8 id_bits;         // number of bits of the model id in uid byte 5
+    u8 model_id;
+    u8 blocks_count;
+};
+
+// 8 bits ids first: each of them starts with the 6 bits id of an older chip,
+// and the most specific id wins (same order as MODELS in models.py).
+static const struct cr14_chip_model cr14_chip_models[] = {
+    { 8, 0x1B, 16 },    // ST25TB512-AC
+    { 8, 0x1F, 128 },   // ST25TB04K
+    { 8, 0x33, 16 },    // ST25TB512-AT
+    { 8, 0x3F, 64 },    // ST25TB02K
+    { 6, 0x03, 128 },   // SRIX4K
+    { 6, 0x06, 16 },    // SRI512
+    { 6, 0x0C, 16 },    // SRT512
+    { 6, 0x07, 128 },   // SRI4K
+    { 6, 0x0F, 64 },    // SRI2K
+};
+
 // Data structures
 
 struct cr14_read_single_block_command_params {
@@ -180,45 +473,144 @@ struct cr14_read_multiple_blocks_command_params {
 
 struct cr14_write_multiple_blocks_command_params {
     u8 chip_uid[8];
+    u8 flags;               // WRITE_FLAG_* (write and verify only)
     u8 addresses_count;
     u8 addr[255];
     u8 data[1020];
 };
 
+struct cr14_read_multiple_tags_command_params {
+    u8 uids_count;
+    u8 addresses_count;
+    u16 done_mask;          // uids already read
+    u8 chip_uids[MAX_MULTIPLE_TAGS_UIDS][8];
+    u8 addr[255];
+};
+
+struct cr14_session_command_params {
+    u8 chip_uid[8];
+};
+
+struct cr14_dump_command_params {
+    u8 chip_uid[8];
+    u8 blocks_count;        // system block excluded
+};
+
+struct cr14_range_command_params {
+    u8 chip_uid[8];
+    u8 start;
+    u8 count;
+    u8 stride;
+    u8 data[4];             // written to every block (write range only)
+};
+
 union cr14_command_params {
     struct cr14_read_single_block_command_params read_single_block;
     struct cr14_write_single_block_command_params write_single_block;
     struct cr14_read_multiple_blocks_command_params read_multiple_blocks;
     struct cr14_write_multiple_blocks_command_params write_multiple_blocks;
+    struct cr14_read_multiple_tags_command_params read_multiple_tags;
+    struct cr14_session_command_params session;
+    struct cr14_dump_command_params dump;
+    struct cr14_range_command_params range;
+};
+
+struct cr14_command {
+    enum cr14_mode mode;        // one of the command modes
+    unsigned int seq;
+    union cr14_command_params params;
+};
+
+struct cr14_present_tag {
+    u8 uid[8];
+    u64 last_seen;      // ktime_get_ns
+};
+
+// Statistics, exported in the stats sysfs directory.
+struct cr14_stats {
+    atomic64_t rounds;              // polling rounds
+    atomic64_t uids;                // uids read (a chip is counted once per round)
+    atomic64_t slot_markers;        // slot marker commands (collisions on initiate)
+    atomic64_t collided_slots;
+    atomic64_t crc_errors;          // CRC mismatches (followed by a reset to inventory)
+    atomic64_t io_retries;          // retries reading the frame register
+    atomic64_t i2c_errors;          // failed I2C transfers
+    atomic64_t dropped_frames;      // frames not written as the read buffer was full
+    atomic64_t responses;           // command responses written
+    atomic64_t round_us[STATS_HISTOGRAM_BUCKETS];
+    atomic64_t read_block_us[STATS_HISTOGRAM_BUCKETS];
+    atomic64_t write_block_us[STATS_HISTOGRAM_BUCKETS];
+    atomic64_t poll_jitter_us[STATS_HISTOGRAM_BUCKETS];    // delay of round starts
 };
 
 struct cr14_i2c_data {
     struct i2c_client *i2c;
+    int minor;
     dev_t chrdev;
-    struct class *cr14_class;
-    struct cdev cdev;
+    struct cdev *cdev;
     struct device *device;
-	struct timer_list polling_timer;
+    struct kref kref;           // held by the driver and the opened file
+    int gone;                   // set when the device is removed
+	struct hrtimer polling_timer;
+	struct workqueue_struct *polling_wq;    // ordered, high priority
 	struct work_struct polling_work;
+	u64 poll_deadline;          // ktime_get_ns when the next round should start
 	spinlock_t producer_lock;
-	spinlock_t consumer_lock;
+	struct mutex consumer_lock;
 	wait_queue_head_t read_wq;
-	wait_queue_head_t write_wq;
     int read_buffer_head;
     int read_buffer_tail;
 	char read_buffer[CIRCULAR_BUFFER_SIZE];
 	int write_offset;   // current offset in write buffer
 	char write_buffer[MAX_PACKET_SIZE];
-	spinlock_t command_lock;    // locks mode and params
+	struct mutex command_lock;  // locks mode, queue, seqs and write buffer
+	wait_queue_head_t write_wq;
     unsigned opened:1;          // whether the device is opened
-	unsigned running_command:1; // whether we're currently running a command
-	enum cr14_mode mode;
-	union cr14_command_params command_params;
+	enum cr14_mode mode;        // idle, poll once, poll repeat, inventory or presence
+    unsigned int mode_seq;      // incremented with each mode change
+    int reset_presence;         // set when entering presence mode
+    int timestamps;             // whether messages are timestamped
+    int session_release;        // set by the session release message
+    wait_queue_head_t session_wq;
+    unsigned int command_seq;   // incremented with each queued command
+    int command_queue_head;     // commands are added at head
+    int command_queue_tail;     // and processed from tail
+    struct cr14_command command_queue[COMMAND_QUEUE_SIZE];
+    // Snapshots used by the worker.
+    enum cr14_mode running_mode;
+    unsigned int running_mode_seq;
+    struct cr14_command running_command;
+    int running_uid_index;      // index of the chip uid for multiple tags commands
+    int in_session;             // whether the selected chip is in a session
+    unsigned int session_ms;
+    unsigned int poll_min_ms;           // see polling policy above
+    unsigned int poll_max_ms;
+    unsigned int poll_backoff_rounds;
+    unsigned int poll_interval_ms;      // current polling interval
+    unsigned int empty_rounds;          // consecutive rounds without any chip
+    int chips_found;                    // chips found during current round
+    u64 exchange_start;                 // ktime_get_ns after last frame register write
+    unsigned int exchange_us[exchanges_count];  // learned durations, see above
+    u64 round_timestamp;                // ktime_get_ns at start of current round
+    // Inventory mode, see protocol above.
+    u32 inventory_seq;                  // next round number
+    int slot_markers;                   // during current round
+    int collided_slots;                 // during current round
+    int inventory_uids_count;
+    u8 inventory_frame[INVENTORY_HEADER_SIZE + (INVENTORY_MAX_UIDS * 8)];
+    // Multiple blocks command responses are assembled here, so the worker
+    // does not allocate memory.
+    u8 response[MAX_RESPONSE_SIZE];
+    // Presence mode, see protocol above.
+    unsigned int absence_ms;
+    int present_count;
+    struct cr14_present_tag present[PRESENCE_MAX_TAGS];
+    struct cr14_stats stats;
 };
 
 // Prototypes
 
-static void cr14_polling_timer_cb(struct timer_list *t);
+static enum hrtimer_restart cr14_polling_timer_cb(struct hrtimer *timer);
 static void restart_polling_timer(struct cr14_i2c_data *priv);
 
 static int cr14_open(struct inode *inode, struct file *file);
@@ -229,6 +621,15 @@ static unsigned int cr14_poll(struct file *file, poll_table *wait);
 static int cr14_i2c_probe(struct i2c_client *i2c, const struct i2c_device_id *id);
 static int cr14_i2c_remove(struct i2c_client *client);
 
+// Shared by all devices, see cr14_init.
+static struct class *cr14_class;
+static dev_t cr14_chrdev;
+static DEFINE_IDA(cr14_minors);
+// Devices by minor, for open. The data of a device removed while opened is
+// freed on release.
+static DEFINE_MUTEX(cr14_devices_lock);
+static struct cr14_i2c_data *cr14_devices[CR14_MAX_DEVICES];
+
 // ========================================================================== //
 // Polling code
 // ========================================================================== //
@@ -255,54 +656,369 @@ static s32 cr14_write_register_byte_check(struct i2c_client *i2c, u8 reg, u8 val
     return result;
 }
 
-static int cr14_read_io_frame_register(struct i2c_client *i2c, int len, u8* buffer) {
+// Update the learned duration of an exchange which completed elapsed_us after
+// it started.
+static void cr14_learn_exchange(struct cr14_i2c_data *priv, enum cr14_exchange exchange, unsigned int elapsed_us, int retries) {
+    unsigned int wait_us = priv->exchange_us[exchange];
+    if (retries == 0) {
+        // Exchange may have completed earlier.
+        wait_us -= wait_us / 32;
+    } else if (elapsed_us > wait_us) {
+        wait_us += (elapsed_us - wait_us) / 8;
+    }
+    wait_us = clamp(wait_us, cr14_exchange_timings[exchange].min_us, cr14_exchange_timings[exchange].max_us);
+    WRITE_ONCE(priv->exchange_us[exchange], wait_us);
+}
+
+// Wait for the exchange started by the last frame register write to complete
+// and read the frame register.
+static int cr14_read_io_frame_register(struct cr14_i2c_data *priv, enum cr14_exchange exchange, int len, u8* buffer) {
     s32 result;
     int retries = 0;
+    u64 elapsed_us = div_u64(ktime_get_ns() - priv->exchange_start, NSEC_PER_USEC);
+    u64 read_start;
+    if (elapsed_us < priv->exchange_us[exchange]) {
+        unsigned int wait_us = priv->exchange_us[exchange] - elapsed_us;
+        usleep_range(wait_us, wait_us + EXCHANGE_SLACK_US);
+    }
     do {
-        result = i2c_smbus_read_i2c_block_data(i2c, CRX14_IO_FRAME_REGISTER, len, buffer);
+        read_start = ktime_get_ns();
+        result = i2c_smbus_read_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, len, buffer);
         if (result == -EREMOTEIO || result == -ETIMEDOUT) {
             retries++;
+            usleep_range(EXCHANGE_POLL_US, EXCHANGE_POLL_US + EXCHANGE_SLACK_US);
         } else if (result != len) {
-            dev_err(&i2c->dev, "Reading frame register failed (requested %d bytes, got %d)", len, result);
+            dev_err(&priv->i2c->dev, "Reading frame register failed (requested %d bytes, got %d)", len, result);
             result = -1;
         }
     } while ((result == -EREMOTEIO || result == -ETIMEDOUT) && retries < IO_FRAME_REGISTER_MAX_RETRIES);
+    if (result >= 0) {
+        cr14_learn_exchange(priv, exchange, div_u64(read_start - priv->exchange_start, NSEC_PER_USEC), retries);
+    }
+    trace_cr14_frame_read(priv->i2c, result >= 0 ? buffer[0] : -1, retries, result);
+    atomic64_add(retries, &priv->stats.io_retries);
+    if (result < 0) {
+        atomic64_inc(&priv->stats.i2c_errors);
+    }
     return result;
 }
 
-static void cr14_write_to_device(struct cr14_i2c_data *priv, int count, u8* data) {
-    int ix;
+static s32 cr14_write_io_frame_register(struct cr14_i2c_data *priv, int len, const u8* buffer) {
+    s32 result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, len, buffer);
+    priv->exchange_start = ktime_get_ns();
+    trace_cr14_frame_write(priv->i2c, buffer, result);
+    if (result < 0) {
+        dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
+        atomic64_inc(&priv->stats.i2c_errors);
+    }
+    return result;
+}
+
+// CRC mismatch, reset to inventory for next anti-collision sequence.
+static void cr14_reset_to_inventory(struct cr14_i2c_data *priv) {
+    u8 buffer[2];
+    atomic64_inc(&priv->stats.crc_errors);
+    buffer[0] = 1;
+    buffer[1] = COMMAND_RESET_TO_INVENTORY;
+    if (cr14_write_io_frame_register(priv, 2, buffer) >= 0) {
+        cr14_read_io_frame_register(priv, exchange_no_answer, 1, buffer);
+    }
+}
+
+// Add the time elapsed since start (ktime_get_ns) to a histogram.
+static void cr14_stats_record(atomic64_t *histogram, u64 start) {
+    u64 us = div_u64(ktime_get_ns() - start, NSEC_PER_USEC);
+    int bucket = 0;
+    while (bucket < STATS_HISTOGRAM_BUCKETS - 1 && us >= (STATS_HISTOGRAM_MIN_US << bucket)) {
+        bucket++;
+    }
+    atomic64_inc(&histogram[bucket]);
+}
+
+// Copy data at head, which must have enough space, and return the new head.
+static unsigned long cr14_copy_to_read_buffer(struct cr14_i2c_data *priv, unsigned long head, int count, const u8* data) {
+    // Copy up to the end of the buffer, then the wrapped around part.
+    int first_count = min(count, (int) (CIRCULAR_BUFFER_SIZE - head));
+    memcpy(&priv->read_buffer[head], data, first_count);
+    memcpy(&priv->read_buffer[0], data + first_count, count - first_count);
+    return (head + count) & (CIRCULAR_BUFFER_SIZE - 1);
+}
+
+// Write prefix (if any) and data as a single frame.
+static void cr14_write_frame_to_device(struct cr14_i2c_data *priv, int prefix_count, const u8* prefix, int count, const u8* data) {
+    unsigned long head;
+    unsigned long tail;
+    int dropped = 0;
     spin_lock(&priv->producer_lock);
-    for (ix = 0; ix < count; ix++) {
-        unsigned long head = priv->read_buffer_head;
-        /* The spin_unlock() and next spin_lock() provide needed ordering. */
-        unsigned long tail = READ_ONCE(priv->read_buffer_tail);
-        if (CIRC_SPACE(head, tail, CIRCULAR_BUFFER_SIZE) >= count - ix) {
-            priv->read_buffer[head] = data[ix];
-            smp_store_release(&priv->read_buffer_head, (head + 1) & (CIRCULAR_BUFFER_SIZE - 1));
-        } else {
-            dev_err(&priv->i2c->dev, "Not writing to device as circular buffer would overflow");
-            break;
-        }
+    head = priv->read_buffer_head;
+    /* The spin_unlock() and next spin_lock() provide needed ordering. */
+    tail = READ_ONCE(priv->read_buffer_tail);
+    if (CIRC_SPACE(head, tail, CIRCULAR_BUFFER_SIZE) >= prefix_count + count) {
+        head = cr14_copy_to_read_buffer(priv, head, prefix_count, prefix);
+        head = cr14_copy_to_read_buffer(priv, head, count, data);
+        smp_store_release(&priv->read_buffer_head, head);
+    } else {
+        dev_err(&priv->i2c->dev, "Not writing to device as circular buffer would overflow");
+        atomic64_inc(&priv->stats.dropped_frames);
+        dropped = 1;
     }
+    trace_cr14_enqueue(priv->i2c, data[0], prefix_count > 0, prefix_count + count, dropped);
     wake_up_interruptible(&priv->read_wq);
     spin_unlock(&priv->producer_lock);
 }
 
-static void cr14_process_polling(struct cr14_i2c_data *priv, const u8 *uid) {
+static void cr14_write_to_device(struct cr14_i2c_data *priv, int count, const u8* data) {
+    cr14_write_frame_to_device(priv, 0, NULL, count, data);
+}
+
+// Write a frame, wrapped in a timestamped message if the client asked for
+// them.
+static void cr14_write_timestamped_to_device(struct cr14_i2c_data *priv, u64 timestamp, int count, const u8* data) {
+    u8 prefix[9];
+    int ix;
+    if (!READ_ONCE(priv->timestamps)) {
+        cr14_write_to_device(priv, count, data);
+        return;
+    }
+    prefix[0] = MESSAGE_TIMESTAMPED_HEADER;
+    for (ix = 0; ix < 8; ix++) {
+        prefix[1 + ix] = timestamp >> (8 * ix);
+    }
+    cr14_write_frame_to_device(priv, sizeof(prefix), prefix, count, data);
+}
+
+static int cr14_commands_pending(struct cr14_i2c_data *priv) {
+    return READ_ONCE(priv->command_queue_head) != READ_ONCE(priv->command_queue_tail);
+}
+
+static int cr14_command_queue_full(struct cr14_i2c_data *priv) {
+    return CIRC_SPACE(READ_ONCE(priv->command_queue_head), READ_ONCE(priv->command_queue_tail), COMMAND_QUEUE_SIZE) == 0;
+}
+
+// Return the number of blocks of the chip with this uid (system block
+// excluded), or 0 if the model is unknown.
+static int cr14_chip_blocks_count(const u8 *uid) {
+    int ix;
+    if (uid[7] != UID_MSB || uid[6] != MANUFACTURER_ST) {
+        return 0;
+    }
+    for (ix = 0; ix < ARRAY_SIZE(cr14_chip_models); ix++) {
+        const struct cr14_chip_model *model = &cr14_chip_models[ix];
+        if ((uid[5] >> (8 - model->id_bits)) == model->model_id) {
+            return model->blocks_count;
+        }
+    }
+    return 0;
+}
+
+// Return whether the uids (8 bytes each) of a read multiple tags message are
+// all different: a command listing a chip twice would never complete.
+static int cr14_uids_unique(const u8 *uids, int uids_count) {
+    int ix, jx;
+    for (ix = 1; ix < uids_count; ix++) {
+        for (jx = 0; jx < ix; jx++) {
+            if (memcmp(uids + (ix * 8), uids + (jx * 8), 8) == 0) {
+                return 0;
+            }
+        }
+    }
+    return 1;
+}
+
+// Return the index of uid in the command's chip uids, or -1 if the command
+// does not target this chip (or already ran on it).
+static int cr14_command_uid_index(const struct cr14_command *command, const u8 *uid) {
+    const u8 *chip_uid;
+    int ix;
+    switch (command->mode) {
+        case mode_read_single_block:
+            chip_uid = command->params.read_single_block.chip_uid;
+            break;
+        case mode_read_multiple_blocks:
+            chip_uid = command->params.read_multiple_blocks.chip_uid;
+            break;
+        case mode_write_single_block:
+            chip_uid = command->params.write_single_block.chip_uid;
+            break;
+        case mode_write_multiple_blocks:
+        case mode_write_and_verify:
+            chip_uid = command->params.write_multiple_blocks.chip_uid;
+            break;
+        case mode_session:
+            chip_uid = command->params.session.chip_uid;
+            break;
+        case mode_dump:
+            chip_uid = command->params.dump.chip_uid;
+            break;
+        case mode_read_range:
+        case mode_write_range:
+            chip_uid = command->params.range.chip_uid;
+            break;
+        case mode_read_multiple_tags:
+            for (ix = 0; ix < command->params.read_multiple_tags.uids_count; ix++) {
+                if (!(command->params.read_multiple_tags.done_mask & (1 << ix))
+                    && memcmp(command->params.read_multiple_tags.chip_uids[ix], uid, 8) == 0) {
+                    return ix;
+                }
+            }
+            return -1;
+        default:
+            return -1;
+    }
+    return memcmp(chip_uid, uid, 8) == 0 ? 0 : -1;
+}
+
+// Called by the worker when poll once mode is done: the device goes back to
+// idle mode unless the client sent a new mode in the meantime.
+static void cr14_complete_poll_once(struct cr14_i2c_data *priv) {
+    priv->running_mode = mode_idle;
+    mutex_lock(&priv->command_lock);
+    if (priv->mode_seq == priv->running_mode_seq) {
+        priv->mode = mode_idle;
+    }
+    mutex_unlock(&priv->command_lock);
+}
+
+// Copy the command at the front of the queue to running_command if it targets
+// the chip with this uid. The client may queue more commands while it runs.
+static int cr14_fetch_command(struct cr14_i2c_data *priv, const u8 *uid) {
+    int found = 0;
+    mutex_lock(&priv->command_lock);
+    if (priv->command_queue_head != priv->command_queue_tail) {
+        const struct cr14_command *command = &priv->command_queue[priv->command_queue_tail];
+        int uid_index = cr14_command_uid_index(command, uid);
+        if (uid_index >= 0) {
+            memcpy(&priv->running_command, command, sizeof(priv->running_command));
+            priv->running_uid_index = uid_index;
+            found = 1;
+        }
+    }
+    mutex_unlock(&priv->command_lock);
+    return found;
+}
+
+// Called by the worker when running_command is done: write its response and
+// remove it from the queue, unless the client discarded it in the meantime.
+// Both happen under command_lock, so once an idle message is written, no
+// response of a discarded command can follow. Multiple tags commands are
+// only removed once every chip has been read.
+static void cr14_complete_command(struct cr14_i2c_data *priv, int count, const u8 *response) {
+    mutex_lock(&priv->command_lock);
+    if (priv->command_queue_head != priv->command_queue_tail
+        && priv->command_queue[priv->command_queue_tail].seq == priv->running_command.seq) {
+        struct cr14_command *command = &priv->command_queue[priv->command_queue_tail];
+        int pop = 1;
+        atomic64_inc(&priv->stats.responses);
+        cr14_write_timestamped_to_device(priv, ktime_get_ns(), count, response);
+        if (command->mode == mode_read_multiple_tags) {
+            struct cr14_read_multiple_tags_command_params *params = &command->params.read_multiple_tags;
+            params->done_mask |= 1 << priv->running_uid_index;
+            pop = params->done_mask == (1 << params->uids_count) - 1;
+        }
+        if (pop) {
+            priv->command_queue_tail = (priv->command_queue_tail + 1) & (COMMAND_QUEUE_SIZE - 1);
+        }
+    }
+    mutex_unlock(&priv->command_lock);
+    wake_up_interruptible(&priv->write_wq);
+}
+
+static void cr14_process_polling(struct cr14_i2c_data *priv, const u8 *uid, u64 timestamp) {
     u8 buffer[9];
     buffer[0] = MESSAGE_UID_HEADER;
     memcpy(buffer + 1, uid, sizeof(buffer) - 1);
-    cr14_write_to_device(priv, sizeof(buffer), buffer);
+    cr14_write_timestamped_to_device(priv, timestamp, sizeof(buffer), buffer);
     
-    if (priv->mode == mode_poll_once) {
-        priv->mode = mode_idle;
+    if (priv->running_mode == mode_poll_once) {
+        cr14_complete_poll_once(priv);
+    }
+}
+
+static void cr14_record_inventory(struct cr14_i2c_data *priv, const u8 *uid) {
+    u8 *uids = priv->inventory_frame + INVENTORY_HEADER_SIZE;
+    int ix;
+    for (ix = 0; ix < priv->inventory_uids_count; ix++) {
+        if (memcmp(uids + (ix * 8), uid, 8) == 0) {
+            return;
+        }
+    }
+    if (priv->inventory_uids_count < INVENTORY_MAX_UIDS) {
+        memcpy(uids + (priv->inventory_uids_count * 8), uid, 8);
+        priv->inventory_uids_count++;
+    }
+}
+
+static void cr14_write_presence(struct cr14_i2c_data *priv, u8 header, const u8 *uid, u64 timestamp) {
+    u8 buffer[9];
+    buffer[0] = header;
+    memcpy(buffer + 1, uid, sizeof(buffer) - 1);
+    cr14_write_timestamped_to_device(priv, timestamp, sizeof(buffer), buffer);
+}
+
+static void cr14_process_presence(struct cr14_i2c_data *priv, const u8 *uid, u64 timestamp) {
+    int ix;
+    for (ix = 0; ix < priv->present_count; ix++) {
+        if (memcmp(priv->present[ix].uid, uid, 8) == 0) {
+            priv->present[ix].last_seen = priv->round_timestamp;
+            return;
+        }
+    }
+    if (priv->present_count < PRESENCE_MAX_TAGS) {
+        memcpy(priv->present[priv->present_count].uid, uid, 8);
+        priv->present[priv->present_count].last_seen = priv->round_timestamp;
+        priv->present_count++;
+        cr14_write_presence(priv, MESSAGE_ARRIVED_HEADER, uid, timestamp);
+    }
+}
+
+// Called at the end of each round in presence mode.
+static void cr14_process_departures(struct cr14_i2c_data *priv) {
+    u64 absence_ns = (u64) READ_ONCE(priv->absence_ms) * NSEC_PER_MSEC;
+    int ix = 0;
+    while (ix < priv->present_count) {
+        if (priv->round_timestamp - priv->present[ix].last_seen >= absence_ns) {
+            cr14_write_presence(priv, MESSAGE_DEPARTED_HEADER, priv->present[ix].uid, priv->round_timestamp);
+            // Move last tag to this slot.
+            priv->present_count--;
+            priv->present[ix] = priv->present[priv->present_count];
+        } else {
+            ix++;
+        }
+    }
+}
+
+// Empty the table of chips in the field when leaving (or entering again)
+// presence mode, writing a departed message for each of them.
+static void cr14_clear_presence(struct cr14_i2c_data *priv) {
+    u64 timestamp = ktime_get_ns();
+    int ix;
+    for (ix = 0; ix < priv->present_count; ix++) {
+        cr14_write_presence(priv, MESSAGE_DEPARTED_HEADER, priv->present[ix].uid, timestamp);
+    }
+    priv->present_count = 0;
+}
+
+static void cr14_write_inventory(struct cr14_i2c_data *priv, u64 timestamp) {
+    u8 *frame = priv->inventory_frame;
+    int ix;
+    frame[0] = MESSAGE_INVENTORY_MODE_HEADER;
+    for (ix = 0; ix < 4; ix++) {
+        frame[1 + ix] = priv->inventory_seq >> (8 * ix);
+    }
+    for (ix = 0; ix < 8; ix++) {
+        frame[5 + ix] = timestamp >> (8 * ix);
     }
+    frame[13] = min(priv->slot_markers, 255);
+    frame[14] = min(priv->collided_slots, 255);
+    frame[15] = priv->inventory_uids_count;
+    cr14_write_to_device(priv, INVENTORY_HEADER_SIZE + (priv->inventory_uids_count * 8), frame);
+    priv->inventory_seq++;
 }
 
-static int cr14_write_block(struct i2c_client *i2c, u8 addr, const u8 *data) {
+static int cr14_write_block(struct cr14_i2c_data *priv, u8 addr, const u8 *data) {
     s32 result;
     u8 buffer[7];
+    u64 start = ktime_get_ns();
     buffer[0] = 6;
     buffer[1] = COMMAND_WRITE_BLOCK_H;
     buffer[2] = addr;
@@ -310,12 +1026,19 @@ static int cr14_write_block(struct i2c_client *i2c, u8 addr, const u8 *data) {
     buffer[4] = data[1];
     buffer[5] = data[2];
     buffer[6] = data[3];
-    result = i2c_smbus_write_i2c_block_data(i2c, CRX14_IO_FRAME_REGISTER, 7, buffer);
-    if (result < 0) {
-        dev_err(&i2c->dev, "Writing frame register failed (%d)", result);
-    } else {
-        // 6 bytes + 7ms worst case (binary counter decrement)
-        usleep_range(8650, 10000);
+    result = cr14_write_io_frame_register(priv, 7, buffer);
+    if (result >= 0) {
+        result = cr14_read_io_frame_register(priv, exchange_write_block, 1, buffer);
+    }
+    if (result >= 0) {
+        if (addr == 5 || addr == 6) {
+            // Binary counters.
+            usleep_range(COUNTER_PROGRAMMING_US, COUNTER_PROGRAMMING_US + 1000);
+        } else {
+            usleep_range(EEPROM_PROGRAMMING_US, EEPROM_PROGRAMMING_US + 1000);
+        }
+        result = 0;
+        cr14_stats_record(priv->stats.write_block_us, start);
     }
     return result;
 }
@@ -324,31 +1047,20 @@ static int cr14_write_block(struct i2c_client *i2c, u8 addr, const u8 *data) {
 // 1 on collision
 // 2 if chip disappeared
 // negative value on error.
-static int cr14_read_block(struct i2c_client *i2c, u8 addr, u8 *data) {
+static int cr14_read_block(struct cr14_i2c_data *priv, u8 addr, u8 *data) {
     s32 result;
     u8 buffer[5];
+    u64 start = ktime_get_ns();
     buffer[0] = 2;
     buffer[1] = COMMAND_READ_BLOCK_H;
     buffer[2] = addr;
-    result = i2c_smbus_write_i2c_block_data(i2c, CRX14_IO_FRAME_REGISTER, 3, buffer);
-    if (result < 0) {
-        dev_err(&i2c->dev, "Writing frame register failed (%d)", result);
-    } else {
-        // 2 bytes, see below
-        usleep_range(1250, 2000);
-        result = cr14_read_io_frame_register(i2c, 5, buffer);
+    result = cr14_write_io_frame_register(priv, 3, buffer);
+    if (result >= 0) {
+        result = cr14_read_io_frame_register(priv, exchange_read_block, 5, buffer);
         if (result < 0) {
-            dev_err(&i2c->dev, "Reading frame register failed (%d)", result);
+            dev_err(&priv->i2c->dev, "Reading frame register failed (%d)", result);
         } else if (buffer[0] == 255) {
-            // CRC mismatch, reset to inventory for next anti-collision sequence.
-            buffer[0] = 1;
-            buffer[1] = COMMAND_RESET_TO_INVENTORY;
-            result = i2c_smbus_write_i2c_block_data(i2c, CRX14_IO_FRAME_REGISTER, 2, buffer);
-            if (result < 0) {
-                dev_err(&i2c->dev, "Writing frame register failed (%d)", result);
-            }
-            // 1 byte: 651 usec + watchdog-timeout.
-            usleep_range(1200, 2000);
+            cr14_reset_to_inventory(priv);
             result = 1;
         } else if (buffer[0] == 0) {
             // Chip did not reply, leave.
@@ -356,7 +1068,7 @@ static int cr14_read_block(struct i2c_client *i2c, u8 addr, u8 *data) {
         } else if (buffer[0] != 4) {
             // Incoherent number of bytes
             if (result < 0) {
-                dev_err(&i2c->dev, "Expected 4 bytes for read_block, got %d instead", buffer[0]);
+                dev_err(&priv->i2c->dev, "Expected 4 bytes for read_block, got %d instead", buffer[0]);
             }
         } else {
             data[0] = buffer[1];
@@ -364,29 +1076,72 @@ static int cr14_read_block(struct i2c_client *i2c, u8 addr, u8 *data) {
             data[2] = buffer[3];
             data[3] = buffer[4];
             result = 0;
+            cr14_stats_record(priv->stats.read_block_us, start);
         }
     }
     return result;
 }
 
+// Return the address of the ix-th block read by a multiple blocks command.
+static u8 cr14_command_address(const struct cr14_command *command, int ix) {
+    switch (command->mode) {
+        case mode_read_multiple_blocks:
+            return command->params.read_multiple_blocks.addr[ix];
+        case mode_write_multiple_blocks:
+            return command->params.write_multiple_blocks.addr[ix];
+        case mode_read_multiple_tags:
+            return command->params.read_multiple_tags.addr[ix];
+        case mode_dump:
+            // Every block, then the system block.
+            return ix < command->params.dump.blocks_count ? ix : SYSTEM_BLOCK;
+        case mode_read_range:
+        case mode_write_range:
+            return command->params.range.start + (ix * command->params.range.stride);
+        default:
+            return 0;
+    }
+}
+
+// Run running_command on the selected chip.
+// Return 0 on success, 1 on collision, another value if the command should be
+// retried.
 static int cr14_process_command(struct cr14_i2c_data *priv) {
+    struct cr14_command *command = &priv->running_command;
     s32 result;
     int ix;
-    int collision = 0;
     do {
-        if (priv->mode == mode_write_single_block) {
+        if (command->mode == mode_session) {
+            u8 buffer[9];
+            buffer[0] = MESSAGE_SESSION_HEADER;
+            memcpy(buffer + 1, command->params.session.chip_uid, 8);
+            priv->in_session = 1;
+            cr14_complete_command(priv, sizeof(buffer), buffer);
+            result = 0;
+            break;
+        }
+        if (command->mode == mode_write_single_block) {
             result = cr14_write_block(
-                priv->i2c,
-                priv->command_params.write_single_block.addr,
-                priv->command_params.write_single_block.data);
+                priv,
+                command->params.write_single_block.addr,
+                command->params.write_single_block.data);
+            if (result < 0) {
+                break;
+            }
+        } else if (command->mode == mode_write_multiple_blocks || command->mode == mode_write_and_verify) {
+            for (ix = 0; ix < command->params.write_multiple_blocks.addresses_count; ix++) {
+                u8 addr = command->params.write_multiple_blocks.addr[ix];
+                u8* data = command->params.write_multiple_blocks.data + (ix * 4);
+                result = cr14_write_block(priv, addr, data);
+                if (result < 0) {
+                    break;
+                }
+            }
             if (result < 0) {
                 break;
             }
-        } else if (priv->mode == mode_write_multiple_blocks) {
-            for (ix = 0; ix < priv->command_params.write_multiple_blocks.addresses_count; ix++) {
-                u8 addr = priv->command_params.write_multiple_blocks.addr[ix];
-                u8* data = priv->command_params.write_multiple_blocks.data + (ix * 4);
-                result = cr14_write_block(priv->i2c, addr, data);
+        } else if (command->mode == mode_write_range) {
+            for (ix = 0; ix < command->params.range.count; ix++) {
+                result = cr14_write_block(priv, cr14_command_address(command, ix), command->params.range.data);
                 if (result < 0) {
                     break;
                 }
@@ -395,101 +1150,167 @@ static int cr14_process_command(struct cr14_i2c_data *priv) {
                 break;
             }
         }
-        if (priv->mode == mode_read_single_block || priv->mode == mode_write_single_block) {
+        if (command->mode == mode_write_and_verify) {
+            // Single read pass, only mismatching blocks are written to the
+            // response.
+            u8 *response = priv->response;
+            u8 addresses_count = command->params.write_multiple_blocks.addresses_count;
+            u8 mismatches_count = 0;
+            result = 0;
+            if (!(command->params.write_multiple_blocks.flags & WRITE_FLAG_NO_VERIFY)) {
+                for (ix = 0; ix < addresses_count; ix++) {
+                    u8 addr = command->params.write_multiple_blocks.addr[ix];
+                    u8 *entry = response + 2 + (mismatches_count * 5);
+                    result = cr14_read_block(priv, addr, entry + 1);
+                    if (result) {
+                        break;
+                    }
+                    if (memcmp(entry + 1, command->params.write_multiple_blocks.data + (ix * 4), 4)) {
+                        entry[0] = addr;
+                        mismatches_count++;
+                    }
+                }
+            }
+            if (result) {
+                break;
+            }
+            response[0] = MESSAGE_WRITE_AND_VERIFY_HEADER;
+            response[1] = mismatches_count;
+            cr14_complete_command(priv, 2 + (mismatches_count * 5), response);
+        } else if (command->mode == mode_read_single_block || command->mode == mode_write_single_block) {
             u8 addr;
             u8 buffer[5];
-            if (priv->mode == mode_read_single_block) {
-                addr = priv->command_params.read_single_block.addr;
+            if (command->mode == mode_read_single_block) {
+                addr = command->params.read_single_block.addr;
             } else {
-                addr = priv->command_params.write_single_block.addr;
+                addr = command->params.write_single_block.addr;
             }
-            result = cr14_read_block(priv->i2c, addr, buffer + 1);
+            result = cr14_read_block(priv, addr, buffer + 1);
             if (result) {
-                if (result == 1) {
-                    collision = 1;
-                }
                 break;
             }
-            if (priv->mode == mode_read_single_block) {
+            if (command->mode == mode_read_single_block) {
                 buffer[0] = MESSAGE_READ_SINGLE_BLOCK_HEADER;
             } else {
                 buffer[0] = MESSAGE_WRITE_SINGLE_BLOCK_HEADER;
             }
-            cr14_write_to_device(priv, 5, buffer);
-            priv->mode = mode_idle;
+            cr14_complete_command(priv, 5, buffer);
         } else {
-            u8 *read_data;
-            u8 *addresses;
+            u8 *read_data = priv->response;
             u8 addresses_count;
-            if (priv->mode == mode_read_multiple_blocks) {
-                addresses = priv->command_params.read_multiple_blocks.addr;
-                addresses_count = priv->command_params.read_multiple_blocks.addresses_count;
+            int header_len = 2;
+            if (command->mode == mode_read_multiple_blocks) {
+                addresses_count = command->params.read_multiple_blocks.addresses_count;
+            } else if (command->mode == mode_read_multiple_tags) {
+                addresses_count = command->params.read_multiple_tags.addresses_count;
+                header_len = 10;
+            } else if (command->mode == mode_dump) {
+                addresses_count = command->params.dump.blocks_count + 1;
+            } else if (command->mode == mode_read_range || command->mode == mode_write_range) {
+                addresses_count = command->params.range.count;
             } else {
-                addresses = priv->command_params.write_multiple_blocks.addr;
-                addresses_count = priv->command_params.write_multiple_blocks.addresses_count;
-            }
-            read_data = devm_kzalloc(&priv->i2c->dev, 2 + (addresses_count * 4), GFP_KERNEL);
-            if (!read_data) {
-                result = -ENOMEM;
-                break;
+                addresses_count = command->params.write_multiple_blocks.addresses_count;
             }
             result = 0;
             for (ix = 0; ix < addresses_count; ix++) {
-                result = cr14_read_block(priv->i2c, addresses[ix], read_data + 2 + (4*ix));
+                result = cr14_read_block(priv, cr14_command_address(command, ix), read_data + header_len + (4*ix));
                 if (result) {
-                    if (result == 1) {
-                        collision = 1;
-                    }
                     break;
                 }
             }
             if (result) {
-                devm_kfree(&priv->i2c->dev, read_data);
                 break;
             }
-            if (priv->mode == mode_read_multiple_blocks) {
+            if (command->mode == mode_read_multiple_blocks) {
                 read_data[0] = MESSAGE_READ_MULTIPLE_BLOCKS_HEADER;
+                read_data[1] = addresses_count;
+            } else if (command->mode == mode_read_multiple_tags) {
+                read_data[0] = MESSAGE_READ_MULTIPLE_TAGS_HEADER;
+                memcpy(read_data + 1, command->params.read_multiple_tags.chip_uids[priv->running_uid_index], 8);
+                read_data[9] = addresses_count;
+            } else if (command->mode == mode_dump) {
+                read_data[0] = MESSAGE_DUMP_HEADER;
+                read_data[1] = command->params.dump.blocks_count;
+            } else if (command->mode == mode_read_range) {
+                read_data[0] = MESSAGE_READ_RANGE_HEADER;
+                read_data[1] = addresses_count;
+            } else if (command->mode == mode_write_range) {
+                read_data[0] = MESSAGE_WRITE_RANGE_HEADER;
+                read_data[1] = addresses_count;
             } else {
                 read_data[0] = MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER;
+                read_data[1] = addresses_count;
             }
-            read_data[1] = addresses_count;
-            cr14_write_to_device(priv, 2 + (addresses_count * 4), read_data);
-            priv->mode = mode_idle;
-            devm_kfree(&priv->i2c->dev, read_data);
+            cr14_complete_command(priv, header_len + (addresses_count * 4), read_data);
         }
     } while (false);
-    return collision;
+    return result;
+}
+
+// Run queued commands for the selected chip, in order.
+// Return 0 on success, 1 on collision, another value on error.
+static int cr14_process_commands(struct cr14_i2c_data *priv, const u8 *uid) {
+    int result = 0;
+    while (cr14_fetch_command(priv, uid)) {
+        result = cr14_process_command(priv);
+        if (result) {
+            break;
+        }
+    }
+    return result;
+}
+
+static int cr14_session_interrupted(struct cr14_i2c_data *priv) {
+    return READ_ONCE(priv->session_release) || !priv->opened || READ_ONCE(priv->mode_seq) != priv->running_mode_seq;
+}
+
+// Wait for the next command of the session. Return 0 if the session should be
+// closed.
+static int cr14_wait_session(struct cr14_i2c_data *priv) {
+    wait_event_timeout(priv->session_wq,
+        cr14_commands_pending(priv) || cr14_session_interrupted(priv),
+        msecs_to_jiffies(READ_ONCE(priv->session_ms)));
+    // Commands queued before the release message still run in the session.
+    return cr14_commands_pending(priv) && priv->opened && READ_ONCE(priv->mode_seq) == priv->running_mode_seq;
+}
+
+// Keep RF on and the chip selected while the session is open, see protocol
+// above.
+static int cr14_run_session(struct cr14_i2c_data *priv, const u8 *uid) {
+    int result = 0;
+    while (cr14_wait_session(priv)) {
+        if (!cr14_fetch_command(priv, uid)) {
+            // Next command targets another chip.
+            break;
+        }
+        result = cr14_process_command(priv);
+        if (result) {
+            break;
+        }
+    }
+    priv->in_session = 0;
+    return result;
 }
 
 static int cr14_get_uid_and_process_mode(struct cr14_i2c_data *priv, u8 chip_id) {
     u8 buffer[9];
     s32 result;
     int collision = 0;
+    u64 timestamp;
     do {
         buffer[0] = 2;
         buffer[1] = COMMAND_SELECT_H;
         buffer[2] = chip_id;
-        result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 3, buffer);
+        result = cr14_write_io_frame_register(priv, 3, buffer);
         if (result < 0) {
-            dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
             break;
         }
-        // 2 bytes, see below
-        usleep_range(1250, 2000);
-        result = cr14_read_io_frame_register(priv->i2c, 2, buffer);
+        result = cr14_read_io_frame_register(priv, exchange_select, 2, buffer);
         if (result < 0) {
             dev_err(&priv->i2c->dev, "Reading frame register failed (%d)", result);
             break;
         } else if (buffer[0] == 255) {
-            // CRC mismatch, reset to inventory for next anti-collision sequence.
-            buffer[0] = 1;
-            buffer[1] = COMMAND_RESET_TO_INVENTORY;
-            result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 2, buffer);
-            if (result < 0) {
-                dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
-            }
-            // 1 byte: 651 usec + watchdog-timeout.
-            usleep_range(1200, 2000);
+            cr14_reset_to_inventory(priv);
             collision = 1;
             break;
         } else if (buffer[0] == 0) {
@@ -506,32 +1327,21 @@ static int cr14_get_uid_and_process_mode(struct cr14_i2c_data *priv, u8 chip_id)
             // Select succeeded.
             buffer[0] = 1;
             buffer[1] = COMMAND_GET_UID;
-            result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 2, buffer);
+            result = cr14_write_io_frame_register(priv, 2, buffer);
             if (result < 0) {
-                dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
                 break;
             }
             // We expect the PICC to write the result, which is 8 bytes (+ CRC)
-            // Default case is therefore longer than timeout.
             // 10 bytes => 100 ETU
             // SOF & EOF => 26 ETU
-            usleep_range(1900, 5000);
-
-            result = cr14_read_io_frame_register(priv->i2c, 9, buffer);
+            result = cr14_read_io_frame_register(priv, exchange_get_uid, 9, buffer);
             if (result < 0) {
                 dev_err(&priv->i2c->dev, "Reading frame register failed (%d)", result);
                 break;
             }
+            timestamp = ktime_get_ns();
             if (buffer[0] == 255) {
-                // CRC mismatch, reset to inventory for next anti-collision sequence, if any.
-                buffer[0] = 1;
-                buffer[1] = COMMAND_RESET_TO_INVENTORY;
-                result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 2, buffer);
-                if (result < 0) {
-                    dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
-                }
-                // 1 byte: 651 usec + watchdog-timeout.
-                usleep_range(1200, 2000);
+                cr14_reset_to_inventory(priv);
                 collision = 1;
                 break;
             }
@@ -539,97 +1349,121 @@ static int cr14_get_uid_and_process_mode(struct cr14_i2c_data *priv, u8 chip_id)
                 dev_err(&priv->i2c->dev, "UID length mismatch, expected 8 bytes, first byte is %d", buffer[0]);
                 break;
             }
-            
+            priv->chips_found++;
+
             // Process UID depending on mode.
-            if (priv->mode == mode_poll_once || priv->mode == mode_poll_repeat) {
-                cr14_process_polling(priv, buffer + 1);
-            } else if (priv->mode != mode_idle) {
-                // Check if UID matches.
-                const u8* chip_uid;
-                switch (priv->mode) {
-                    case mode_read_single_block:
-                        chip_uid = priv->command_params.read_single_block.chip_uid;
-                        break;
-                    case mode_read_multiple_blocks:
-                        chip_uid = priv->command_params.read_multiple_blocks.chip_uid;
-                        break;
-                    case mode_write_single_block:
-                        chip_uid = priv->command_params.write_single_block.chip_uid;
-                        break;
-                    case mode_write_multiple_blocks:
-                        chip_uid = priv->command_params.write_multiple_blocks.chip_uid;
-                        break;
-                    default:
-                        chip_uid = NULL;
-                }
-                if (memcmp(chip_uid, buffer + 1, 8) == 0) {
-                    if (cr14_process_command(priv)) {
-                        collision = 1;
-                    }
-                }
-            } else {
-                dev_err(&priv->i2c->dev, "Unknown mode (%d)", priv->mode);
+            if (priv->running_mode == mode_poll_once || priv->running_mode == mode_poll_repeat) {
+                cr14_process_polling(priv, buffer + 1, timestamp);
+            } else if (priv->running_mode == mode_inventory) {
+                cr14_record_inventory(priv, buffer + 1);
+            } else if (priv->running_mode == mode_presence) {
+                cr14_process_presence(priv, buffer + 1, timestamp);
+            }
+            // Run queued commands for this chip, in order.
+            result = cr14_process_commands(priv, buffer + 1);
+            if (result == 0 && priv->in_session) {
+                result = cr14_run_session(priv, buffer + 1);
+            }
+            priv->in_session = 0;
+            if (result == 1) {
+                collision = 1;
             }
 
             // Send completion command: chip will no longer participate in
             // anti-collision protocol
             buffer[0] = 1;
             buffer[1] = COMMAND_COMPLETION;
-            result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 2, buffer);
-            if (result < 0) {
-                dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
+            if (cr14_write_io_frame_register(priv, 2, buffer) >= 0) {
+                // 1 byte: 651 usec + watchdog-timeout.
+                cr14_read_io_frame_register(priv, exchange_no_answer, 1, buffer);
             }
-            // 1 byte, see above.
-            usleep_range(1200, 2000);
         }
     } while (0);
     return collision;
 }
 
+static void cr14_update_polling_interval(struct cr14_i2c_data *priv) {
+    unsigned int min_ms = READ_ONCE(priv->poll_min_ms);
+    unsigned int max_ms = READ_ONCE(priv->poll_max_ms);
+    unsigned int interval_ms;
+
+    if (priv->chips_found || priv->present_count || READ_ONCE(priv->mode) == mode_poll_once || cr14_commands_pending(priv)) {
+        // Chips in the field, or waiting for a chip to run a command.
+        priv->empty_rounds = 0;
+        interval_ms = min_ms;
+    } else if (priv->empty_rounds < READ_ONCE(priv->poll_backoff_rounds)) {
+        priv->empty_rounds++;
+        interval_ms = min_ms;
+    } else {
+        interval_ms = max(priv->poll_interval_ms, min_ms) * 2;
+    }
+    priv->poll_interval_ms = clamp(interval_ms, min_ms, max_ms);
+}
+
 static void cr14_do_poll(struct work_struct *work) {
     struct cr14_i2c_data *priv = container_of(work, struct cr14_i2c_data, polling_work);
-    // Copy mode and params to the stack.
     s32 result;
     u8 buffer[36];
     u8 value;
     int collision;
-
-    spin_lock(&priv->command_lock);
-    if (priv->mode == mode_idle) {
-        spin_unlock(&priv->command_lock);
+    int failed = 0;     // the round aborted on an I2C error
+    int reset_presence;
+
+    // Snapshot mode: the client may send a new mode while this round is
+    // running. Commands are fetched from the queue as chips are found.
+    mutex_lock(&priv->command_lock);
+    priv->running_mode = priv->mode;
+    priv->running_mode_seq = priv->mode_seq;
+    reset_presence = priv->reset_presence || priv->running_mode != mode_presence;
+    priv->reset_presence = 0;
+    mutex_unlock(&priv->command_lock);
+    if (reset_presence) {
+        cr14_clear_presence(priv);
+    }
+    if (priv->running_mode == mode_idle && !cr14_commands_pending(priv)) {
         return;
     }
 
+    priv->chips_found = 0;
+    priv->slot_markers = 0;
+    priv->collided_slots = 0;
+    priv->inventory_uids_count = 0;
+    priv->round_timestamp = ktime_get_ns();
+    // A round triggered while the previous one was ending may start before
+    // the deadline set by that round.
+    cr14_stats_record(priv->stats.poll_jitter_us, min(READ_ONCE(priv->poll_deadline), priv->round_timestamp));
+    trace_cr14_round_start(priv->i2c, priv->running_mode);
     do {
         // Turn RF on.
         value = CARRIER_FREQ_RF_OUT_ON | WATCHDOG_TIMEOUT_5US;
         result = cr14_write_register_byte_check(priv->i2c, CRX14_PARAMETER_REGISTER, value);
+        trace_cr14_rf(priv->i2c, 1, result);
         if (result < 0) {
             dev_err(&priv->i2c->dev, "Turning RF on failed (%d)", result);
+            atomic64_inc(&priv->stats.i2c_errors);
+            failed = 1;
             break;
         }
         
         buffer[0] = 2;
         buffer[1] = COMMAND_INITIATE_H;
         buffer[2] = COMMAND_INITIATE_L;
-        result = i2c_smbus_write_i2c_block_data(priv->i2c, CRX14_IO_FRAME_REGISTER, 3, buffer);
+        result = cr14_write_io_frame_register(priv, 3, buffer);
         if (result < 0) {
-            dev_err(&priv->i2c->dev, "Writing frame register failed (%d)", result);
+            failed = 1;
             break;
         }
         // After each write to the frame register, we need to wait for the CR14
         // to send the command and wait for the result.
-        // We will perform busy polling as described in the datasheet.
-        // However, we know we can wait a minium time based on the number of
-        // sent or expected bytes.
+        // We perform busy polling as described in the datasheet, after a
+        // minimum time based on the number of sent or expected bytes (see
+        // exchange timing above).
         // Time to send two bytes is 745 usec (61 ETU + t0 + t1 wait times)
         // Watch-dog timeout is 500 usec.
-        // => wait at least 1250 usec.
-        usleep_range(1250, 2000);
-
-        result = cr14_read_io_frame_register(priv->i2c, 2, buffer);
+        result = cr14_read_io_frame_register(priv, exchange_initiate, 2, buffer);
         if (result < 0) {
             dev_err(&priv->i2c->dev, "Reading frame register failed (%d)", result);
+            failed = 1;
             break;
         }
         if (buffer[0] == 255) {
@@ -638,7 +1472,6 @@ static void cr14_do_poll(struct work_struct *work) {
             collision = 0;
         }
 
-        priv->running_command = 1;  // lock mode & params
         do {
             if (collision) {
                 u16 mask;
@@ -646,26 +1479,29 @@ static void cr14_do_poll(struct work_struct *work) {
 
                 collision = 0;
                 result = i2c_smbus_write_byte(priv->i2c, CRX14_SLOT_MARKER_REGISTER);
+                priv->exchange_start = ktime_get_ns();
+                trace_cr14_slot_marker(priv->i2c, result);
                 if (result < 0) {
                     dev_err(&priv->i2c->dev, "Writing slot marker register failed (%d)", result);
+                    atomic64_inc(&priv->stats.i2c_errors);
+                    failed = 1;
                     break;
                 }
-                // Wait much longer here:
+                // Exchange is much longer here:
                 // 49 bytes => 490 ETU
                 // 16 SOF & 16 EOF => 336 ETU
                 // 16 watch-dog timeouts => 8000 usec
-                // at least 16000 usecs
-                usleep_range(16000, 20000);
-            
-                result = cr14_read_io_frame_register(priv->i2c, 19, buffer);
+                result = cr14_read_io_frame_register(priv, exchange_slot_marker, 19, buffer);
                 if (result < 0) {
                     dev_err(&priv->i2c->dev, "Reading frame register failed (%d)", result);
+                    failed = 1;
                     break;
                 }
                 if (buffer[0] != 18) {
                     dev_err(&priv->i2c->dev, "Slot marker did not return 18 bytes, first byte is %d", buffer[0]);
                     break;
                 }
+                priv->slot_markers++;
                 mask = (buffer[2] << 8) | buffer[1];
                 ix = 0;
                 for (ix = 0; ix < 16; ix++) {
@@ -673,9 +1509,11 @@ static void cr14_do_poll(struct work_struct *work) {
                         u8 chip_id = buffer[ix + 3];
                         if (cr14_get_uid_and_process_mode(priv, chip_id)) {
                             collision = 1;
+                            priv->collided_slots++;
                         }
                     } else if (buffer[ix + 3] == 0xFF) {
                         collision = 1;
+                        priv->collided_slots++;
                     }
                     mask >>= 1;
                 }
@@ -689,41 +1527,67 @@ static void cr14_do_poll(struct work_struct *work) {
         } while (collision != 0);
     } while (0);
 
-    priv->running_command = 0;  // unlock mode & params
-    wake_up_interruptible(&priv->write_wq);
-    spin_unlock(&priv->command_lock);
-
     value = CARRIER_FREQ_RF_OUT_OFF | WATCHDOG_TIMEOUT_5US;
     result = i2c_smbus_write_byte_data(priv->i2c, CRX14_PARAMETER_REGISTER, value);
+    trace_cr14_rf(priv->i2c, 0, result);
     if (result < 0) {
         dev_err(&priv->i2c->dev, "Turning RF off failed (%d)", result);
+        atomic64_inc(&priv->stats.i2c_errors);
+    }
+
+    trace_cr14_round_end(priv->i2c, priv->chips_found, priv->slot_markers, priv->collided_slots);
+    atomic64_inc(&priv->stats.rounds);
+    atomic64_add(priv->chips_found, &priv->stats.uids);
+    atomic64_add(priv->slot_markers, &priv->stats.slot_markers);
+    atomic64_add(priv->collided_slots, &priv->stats.collided_slots);
+    cr14_stats_record(priv->stats.round_us, priv->round_timestamp);
+
+    if (priv->running_mode == mode_inventory) {
+        if (failed) {
+            // The chips of the round are unknown, skip its number.
+            priv->inventory_seq++;
+        } else {
+            cr14_write_inventory(priv, priv->round_timestamp);
+        }
+    } else if (priv->running_mode == mode_presence && !failed) {
+        // Chips of a round aborted on an I2C error were not seen, but may
+        // still be in the field.
+        cr14_process_departures(priv);
     }
 
-    if (priv->mode != mode_idle) {
+    if (READ_ONCE(priv->mode) != mode_idle || cr14_commands_pending(priv)) {
+        cr14_update_polling_interval(priv);
         restart_polling_timer(priv);
     }
 }
 
-static void cr14_polling_timer_cb(struct timer_list *t) {
-    struct cr14_i2c_data *priv = from_timer(priv, t, polling_timer);
+// Rounds run on the device's own ordered, high priority workqueue and are
+// scheduled with an hrtimer, so they start on time even when the system
+// workqueue is busy, and without the granularity of jiffies. The delay between
+// poll_deadline and the start of the round is recorded in poll_jitter_us.
+static enum hrtimer_restart cr14_polling_timer_cb(struct hrtimer *timer) {
+    struct cr14_i2c_data *priv = container_of(timer, struct cr14_i2c_data, polling_timer);
     if (priv->opened) {
-    	schedule_work(&priv->polling_work);
+    	queue_work(priv->polling_wq, &priv->polling_work);
     }
+    return HRTIMER_NORESTART;
 }
 
 static void restart_polling_timer(struct cr14_i2c_data *priv) {
-    del_timer_sync(&priv->polling_timer);
-    mod_timer(&priv->polling_timer, jiffies + HZ / POLLING_TIMEOUT_SECS_DIV);
+    hrtimer_cancel(&priv->polling_timer);
+    WRITE_ONCE(priv->poll_deadline, ktime_get_ns() + ((u64) priv->poll_interval_ms * NSEC_PER_MSEC));
+    hrtimer_start(&priv->polling_timer, ms_to_ktime(priv->poll_interval_ms), HRTIMER_MODE_REL);
 }
 
 static void stop_polling_timer(struct cr14_i2c_data *priv) {
-    del_timer_sync(&priv->polling_timer);
+    hrtimer_cancel(&priv->polling_timer);
 }
 
 static void trigger_polling_work(struct cr14_i2c_data *priv) {
-    del_timer_sync(&priv->polling_timer);
+    hrtimer_cancel(&priv->polling_timer);
     if (priv->opened) {
-    	schedule_work(&priv->polling_work);
+        WRITE_ONCE(priv->poll_deadline, ktime_get_ns());
+    	queue_work(priv->polling_wq, &priv->polling_work);
     }
 }
 
@@ -731,84 +1595,164 @@ static void trigger_polling_work(struct cr14_i2c_data *priv) {
 // File operations & commands
 // ========================================================================== //
 
+static void cr14_free(struct kref *kref) {
+    struct cr14_i2c_data *priv = container_of(kref, struct cr14_i2c_data, kref);
+    destroy_workqueue(priv->polling_wq);
+    kfree(priv);
+}
+
 static int cr14_open(struct inode *inode, struct file *file) {
     struct cr14_i2c_data *priv;
-    priv = container_of(inode->i_cdev, struct cr14_i2c_data, cdev);
+    mutex_lock(&cr14_devices_lock);
+    priv = cr14_devices[iminor(inode)];
+    if (priv) {
+        kref_get(&priv->kref);
+    }
+    mutex_unlock(&cr14_devices_lock);
+    if (!priv) {
+        return -ENODEV;
+    }
     file->private_data = priv;
 
     if (priv->opened) {
+        kref_put(&priv->kref, cr14_free);
         return -EBUSY;
     }
     priv->opened = 1;
-    priv->running_command = 0;
     priv->write_offset = 0;
     priv->read_buffer_head = 0;
     priv->read_buffer_tail = 0;
+    priv->poll_interval_ms = priv->poll_min_ms;
+    priv->empty_rounds = 0;
+    priv->command_queue_head = 0;
+    priv->command_queue_tail = 0;
+    priv->inventory_seq = 0;
+    priv->present_count = 0;
+    priv->reset_presence = 0;
+    priv->timestamps = 0;
+    priv->session_release = 0;
     if (file->f_mode & FMODE_WRITE) {
         priv->mode = mode_idle;
     } else {
         priv->mode = mode_poll_repeat;
     }
-    schedule_work(&priv->polling_work);
+    trigger_polling_work(priv);
     
     return 0;
 }
 
 static int cr14_release(struct inode *inode, struct file *file) {
-    struct cr14_i2c_data *priv;
-    priv = container_of(inode->i_cdev, struct cr14_i2c_data, cdev);
+    struct cr14_i2c_data *priv = (struct cr14_i2c_data *) file->private_data;
     priv->opened = 0;
-    
+    wake_up(&priv->session_wq);
+
     cancel_work_sync(&priv->polling_work);
     stop_polling_timer(priv);
 
+    kref_put(&priv->kref, cr14_free);
     return 0;
 }
 
 static int cr14_read(struct file *file, char __user *buffer, size_t len, loff_t *ppos) {
     struct cr14_i2c_data *priv = (struct cr14_i2c_data *) file->private_data;
-    int read_count = 0;
-    spin_lock(&priv->consumer_lock);
-    if (wait_event_interruptible(priv->read_wq, priv->read_buffer_head != priv->read_buffer_tail)) {
-        spin_unlock(&priv->consumer_lock);
+    unsigned long head;
+    unsigned long tail;
+    int read_count;
+    int first_count;
+    if (READ_ONCE(priv->gone)) {
+        return -ENODEV;
+    }
+    if ((file->f_flags & O_NONBLOCK) && READ_ONCE(priv->read_buffer_head) == priv->read_buffer_tail) {
+        return -EAGAIN;
+    }
+    if (wait_event_interruptible(priv->read_wq, READ_ONCE(priv->read_buffer_head) != priv->read_buffer_tail
+                                 || READ_ONCE(priv->gone))) {
+        return -ERESTARTSYS;
+    }
+    if (READ_ONCE(priv->gone)) {
+        return -ENODEV;
+    }
+    if (mutex_lock_interruptible(&priv->consumer_lock)) {
         return -ERESTARTSYS;
     }
     /* Read index before reading contents at that index. */
-    while (len > 0) {
-        unsigned long head = smp_load_acquire(&priv->read_buffer_head);
-        unsigned long tail = priv->read_buffer_tail;
-        if (CIRC_CNT(head, tail, CIRCULAR_BUFFER_SIZE) >= 1) {
-            if (copy_to_user(buffer, &priv->read_buffer[tail], 1)) {
-                read_count = -EFAULT;
-                break;
-            }
-            buffer++;
-            read_count++;
-            len--;
-            /* Finish reading descriptor before incrementing tail. */
-            smp_store_release(&priv->read_buffer_tail, (tail + 1) & (CIRCULAR_BUFFER_SIZE - 1));
-        } else {
-            // Len was exhausted, exit
-            break;
-        }
+    head = smp_load_acquire(&priv->read_buffer_head);
+    tail = priv->read_buffer_tail;
+    read_count = min_t(size_t, CIRC_CNT(head, tail, CIRCULAR_BUFFER_SIZE), len);
+    // At most two copies: up to the end of the buffer, then from its start.
+    first_count = min(read_count, (int) CIRC_CNT_TO_END(head, tail, CIRCULAR_BUFFER_SIZE));
+    if (copy_to_user(buffer, &priv->read_buffer[tail], first_count)
+        || copy_to_user(buffer + first_count, &priv->read_buffer[0], read_count - first_count)) {
+        read_count = -EFAULT;
+    } else {
+        /* Finish reading descriptor before incrementing tail. */
+        smp_store_release(&priv->read_buffer_tail, (tail + read_count) & (CIRCULAR_BUFFER_SIZE - 1));
     }
-    spin_unlock(&priv->consumer_lock);
+    mutex_unlock(&priv->consumer_lock);
     if (read_count > 0) {
         *ppos += read_count;
     }
     return read_count;
 }
 
+static int cr14_lock_commands(struct file *file, struct cr14_i2c_data *priv) {
+    // The worker only holds command_lock briefly, the client can write the
+    // next command while a polling round is running.
+    if (file->f_flags & O_NONBLOCK) {
+        if (!mutex_trylock(&priv->command_lock)) {
+            return -EAGAIN;
+        }
+    } else if (mutex_lock_interruptible(&priv->command_lock)) {
+        return -ERESTARTSYS;
+    }
+    if (READ_ONCE(priv->gone)) {
+        mutex_unlock(&priv->command_lock);
+        return -ENODEV;
+    }
+    return 0;
+}
+
 static int cr14_write(struct file *file, const char __user *buffer, size_t len, loff_t *ppos) {
     struct cr14_i2c_data *priv = (struct cr14_i2c_data *) file->private_data;
     int written_count = 0;
+    int err;
     if (len <= 0) {
         return 0;
     }
-    spin_lock(&priv->command_lock);
-    if (wait_event_interruptible(priv->write_wq, priv->running_command == 0)) {
-        spin_unlock(&priv->command_lock);
-        return -ERESTARTSYS;
+    err = cr14_lock_commands(file, priv);
+    if (err) {
+        return err;
+    }
+    // Wait for room in the queue before starting a new command. Messages are
+    // consumed one at a time, so the room is still there when the end of the
+    // packet is written. Mode messages are always accepted.
+    while (priv->write_offset == 0 && cr14_command_queue_full(priv)) {
+        char header;
+        if (get_user(header, buffer)) {
+            mutex_unlock(&priv->command_lock);
+            return -EFAULT;
+        }
+        if (header == MESSAGE_IDLE_HEADER
+            || header == MESSAGE_POLL_ONCE_HEADER
+            || header == MESSAGE_POLL_REPEAT_MODE_HEADER
+            || header == MESSAGE_INVENTORY_MODE_HEADER
+            || header == MESSAGE_PRESENCE_MODE_HEADER
+            || header == MESSAGE_TIMESTAMPS_ON_HEADER
+            || header == MESSAGE_TIMESTAMPS_OFF_HEADER
+            || header == MESSAGE_SESSION_RELEASE_HEADER) {
+            break;
+        }
+        mutex_unlock(&priv->command_lock);
+        if (file->f_flags & O_NONBLOCK) {
+            return -EAGAIN;
+        }
+        if (wait_event_interruptible(priv->write_wq, !cr14_command_queue_full(priv) || READ_ONCE(priv->gone))) {
+            return -ERESTARTSYS;
+        }
+        err = cr14_lock_commands(file, priv);
+        if (err) {
+            return err;
+        }
     }
     do {
         int packet_len = 0;
@@ -824,15 +1768,44 @@ static int cr14_write(struct file *file, const char __user *buffer, size_t len,
             mode_header = priv->write_buffer[0];
             if (mode_header == MESSAGE_IDLE_HEADER) {
                 priv->mode = mode_idle;
+                priv->mode_seq++;
+                // Discard pending commands.
+                priv->command_queue_tail = priv->command_queue_head;
+                wake_up_interruptible(&priv->write_wq);
+                // Run the worker once, to report departures when leaving
+                // presence mode.
+                trigger_polling_work(priv);
                 break;
             } else if (mode_header == MESSAGE_POLL_ONCE_HEADER) {
                 priv->mode = mode_poll_once;
+                priv->mode_seq++;
                 trigger_polling_work(priv);
                 break;
             } else if (mode_header == MESSAGE_POLL_REPEAT_MODE_HEADER) {
                 priv->mode = mode_poll_repeat;
+                priv->mode_seq++;
+                trigger_polling_work(priv);
+                break;
+            } else if (mode_header == MESSAGE_INVENTORY_MODE_HEADER) {
+                priv->mode = mode_inventory;
+                priv->mode_seq++;
+                trigger_polling_work(priv);
+                break;
+            } else if (mode_header == MESSAGE_PRESENCE_MODE_HEADER) {
+                priv->mode = mode_presence;
+                priv->mode_seq++;
+                priv->reset_presence = 1;
                 trigger_polling_work(priv);
                 break;
+            } else if (mode_header == MESSAGE_TIMESTAMPS_ON_HEADER) {
+                WRITE_ONCE(priv->timestamps, 1);
+                break;
+            } else if (mode_header == MESSAGE_TIMESTAMPS_OFF_HEADER) {
+                WRITE_ONCE(priv->timestamps, 0);
+                break;
+            } else if (mode_header == MESSAGE_SESSION_RELEASE_HEADER) {
+                WRITE_ONCE(priv->session_release, 1);
+                break;
             }
             priv->write_offset++;
             buffer++;
@@ -847,6 +1820,18 @@ static int cr14_write(struct file *file, const char __user *buffer, size_t len,
             packet_len = 10;
         } else if (mode_header == MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER) {
             packet_len = 10;
+        } else if (mode_header == MESSAGE_READ_MULTIPLE_TAGS_HEADER) {
+            packet_len = 3;
+        } else if (mode_header == MESSAGE_SESSION_HEADER) {
+            packet_len = 9;
+        } else if (mode_header == MESSAGE_DUMP_HEADER) {
+            packet_len = 9;
+        } else if (mode_header == MESSAGE_READ_RANGE_HEADER) {
+            packet_len = 12;
+        } else if (mode_header == MESSAGE_WRITE_RANGE_HEADER) {
+            packet_len = 16;
+        } else if (mode_header == MESSAGE_WRITE_AND_VERIFY_HEADER) {
+            packet_len = 11;
         }
         if (priv->write_offset < packet_len) {
             int attempt_count = packet_len - priv->write_offset;
@@ -868,6 +1853,34 @@ static int cr14_write(struct file *file, const char __user *buffer, size_t len,
                 packet_len = 10 + (priv->write_buffer[9]);
             } else if (mode_header == MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER) {
                 packet_len = 10 + (priv->write_buffer[9] * 5);
+            } else if (mode_header == MESSAGE_WRITE_AND_VERIFY_HEADER) {
+                packet_len = 11 + (priv->write_buffer[10] * 5);
+            } else if (mode_header == MESSAGE_READ_MULTIPLE_TAGS_HEADER) {
+                u8 uids_count = (u8) priv->write_buffer[1];
+                if (uids_count == 0 || uids_count > MAX_MULTIPLE_TAGS_UIDS) {
+                    // Discard the packet.
+                    priv->write_offset = 0;
+                    written_count = -EINVAL;
+                    break;
+                }
+                packet_len = 3 + (uids_count * 8) + (u8) priv->write_buffer[2];
+            } else if (mode_header == MESSAGE_DUMP_HEADER) {
+                if (cr14_chip_blocks_count((const u8 *) priv->write_buffer + 1) == 0) {
+                    // Unknown chip, discard the packet.
+                    priv->write_offset = 0;
+                    written_count = -EINVAL;
+                    break;
+                }
+            } else if (mode_header == MESSAGE_READ_RANGE_HEADER || mode_header == MESSAGE_WRITE_RANGE_HEADER) {
+                u8 start = (u8) priv->write_buffer[9];
+                u8 count = (u8) priv->write_buffer[10];
+                u8 stride = (u8) priv->write_buffer[11];
+                if (count == 0 || stride == 0 || start + ((count - 1) * stride) > 0xFF) {
+                    // Discard the packet.
+                    priv->write_offset = 0;
+                    written_count = -EINVAL;
+                    break;
+                }
             }
         }
         // Read variable-size data
@@ -885,45 +1898,105 @@ static int cr14_write(struct file *file, const char __user *buffer, size_t len,
             priv->write_offset += attempt_count;
             buffer += attempt_count;
         }
+        if (priv->write_offset == packet_len && mode_header == MESSAGE_READ_MULTIPLE_TAGS_HEADER
+            && !cr14_uids_unique((const u8 *) priv->write_buffer + 3, (u8) priv->write_buffer[1])) {
+            // Duplicate uids, discard the packet.
+            priv->write_offset = 0;
+            written_count = -EINVAL;
+            break;
+        }
         if (priv->write_offset == packet_len) {
-            // End of packet.
+            // End of packet, queue the command.
+            struct cr14_command *command = &priv->command_queue[priv->command_queue_head];
             int addr_count;
+            int uids_count;
             switch (priv->write_buffer[0]) {
                 case MESSAGE_READ_SINGLE_BLOCK_HEADER:
-                    priv->mode = mode_read_single_block;
-                    memcpy(priv->command_params.read_single_block.chip_uid, priv->write_buffer + 1, 8);
-                    priv->command_params.read_single_block.addr = priv->write_buffer[9];
+                    command->mode = mode_read_single_block;
+                    memcpy(command->params.read_single_block.chip_uid, priv->write_buffer + 1, 8);
+                    command->params.read_single_block.addr = priv->write_buffer[9];
                     break;
 
                 case MESSAGE_WRITE_SINGLE_BLOCK_HEADER:
-                    priv->mode = mode_write_single_block;
-                    memcpy(priv->command_params.write_single_block.chip_uid, priv->write_buffer + 1, 8);
-                    priv->command_params.write_single_block.addr = priv->write_buffer[9];
-                    memcpy(priv->command_params.write_single_block.data, priv->write_buffer + 10, 4);
+                    command->mode = mode_write_single_block;
+                    memcpy(command->params.write_single_block.chip_uid, priv->write_buffer + 1, 8);
+                    command->params.write_single_block.addr = priv->write_buffer[9];
+                    memcpy(command->params.write_single_block.data, priv->write_buffer + 10, 4);
                     break;
 
                 case MESSAGE_READ_MULTIPLE_BLOCKS_HEADER:
-                    priv->mode = mode_read_multiple_blocks;
-                    memcpy(priv->command_params.read_multiple_blocks.chip_uid, priv->write_buffer + 1, 8);
+                    command->mode = mode_read_multiple_blocks;
+                    memcpy(command->params.read_multiple_blocks.chip_uid, priv->write_buffer + 1, 8);
                     addr_count = priv->write_buffer[9];
-                    priv->command_params.read_multiple_blocks.addresses_count = addr_count;
-                    memcpy(priv->command_params.read_multiple_blocks.addr, priv->write_buffer + 10, addr_count);
+                    command->params.read_multiple_blocks.addresses_count = addr_count;
+                    memcpy(command->params.read_multiple_blocks.addr, priv->write_buffer + 10, addr_count);
                     break;
 
                 case MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER:
-                    priv->mode = mode_write_multiple_blocks;
-                    memcpy(priv->command_params.write_multiple_blocks.chip_uid, priv->write_buffer + 1, 8);
+                    command->mode = mode_write_multiple_blocks;
+                    memcpy(command->params.write_multiple_blocks.chip_uid, priv->write_buffer + 1, 8);
                     addr_count = priv->write_buffer[9];
-                    priv->command_params.write_multiple_blocks.addresses_count = addr_count;
-                    memcpy(priv->command_params.write_multiple_blocks.addr, priv->write_buffer + 10, addr_count);
-                    memcpy(priv->command_params.write_multiple_blocks.data, priv->write_buffer + 10 + addr_count, addr_count * 4);
+                    command->params.write_multiple_blocks.addresses_count = addr_count;
+                    memcpy(command->params.write_multiple_blocks.addr, priv->write_buffer + 10, addr_count);
+                    memcpy(command->params.write_multiple_blocks.data, priv->write_buffer + 10 + addr_count, addr_count * 4);
+                    break;
+
+                case MESSAGE_WRITE_AND_VERIFY_HEADER:
+                    command->mode = mode_write_and_verify;
+                    memcpy(command->params.write_multiple_blocks.chip_uid, priv->write_buffer + 1, 8);
+                    command->params.write_multiple_blocks.flags = priv->write_buffer[9];
+                    addr_count = priv->write_buffer[10];
+                    command->params.write_multiple_blocks.addresses_count = addr_count;
+                    memcpy(command->params.write_multiple_blocks.addr, priv->write_buffer + 11, addr_count);
+                    memcpy(command->params.write_multiple_blocks.data, priv->write_buffer + 11 + addr_count, addr_count * 4);
+                    break;
+
+                case MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+                    command->mode = mode_read_multiple_tags;
+                    uids_count = (u8) priv->write_buffer[1];
+                    command->params.read_multiple_tags.uids_count = uids_count;
+                    addr_count = (u8) priv->write_buffer[2];
+                    command->params.read_multiple_tags.addresses_count = addr_count;
+                    command->params.read_multiple_tags.done_mask = 0;
+                    memcpy(command->params.read_multiple_tags.chip_uids, priv->write_buffer + 3, uids_count * 8);
+                    memcpy(command->params.read_multiple_tags.addr, priv->write_buffer + 3 + (uids_count * 8), addr_count);
+                    break;
+
+                case MESSAGE_SESSION_HEADER:
+                    command->mode = mode_session;
+                    memcpy(command->params.session.chip_uid, priv->write_buffer + 1, 8);
+                    WRITE_ONCE(priv->session_release, 0);
+                    break;
+
+                case MESSAGE_DUMP_HEADER:
+                    command->mode = mode_dump;
+                    memcpy(command->params.dump.chip_uid, priv->write_buffer + 1, 8);
+                    command->params.dump.blocks_count = cr14_chip_blocks_count((const u8 *) priv->write_buffer + 1);
+                    break;
+
+                case MESSAGE_READ_RANGE_HEADER:
+                case MESSAGE_WRITE_RANGE_HEADER:
+                    if (mode_header == MESSAGE_READ_RANGE_HEADER) {
+                        command->mode = mode_read_range;
+                    } else {
+                        command->mode = mode_write_range;
+                        memcpy(command->params.range.data, priv->write_buffer + 12, 4);
+                    }
+                    memcpy(command->params.range.chip_uid, priv->write_buffer + 1, 8);
+                    command->params.range.start = priv->write_buffer[9];
+                    command->params.range.count = priv->write_buffer[10];
+                    command->params.range.stride = priv->write_buffer[11];
                     break;
             }
+            command->seq = ++priv->command_seq;
+            priv->command_queue_head = (priv->command_queue_head + 1) & (COMMAND_QUEUE_SIZE - 1);
             priv->write_offset = 0;
             trigger_polling_work(priv);
         }
     } while (0);
-    spin_unlock(&priv->command_lock);
+    mutex_unlock(&priv->command_lock);
+    // Wake the worker if a session is open.
+    wake_up(&priv->session_wq);
     if (written_count > 0) {
         *ppos += written_count;
     }
@@ -936,12 +2009,13 @@ static unsigned int cr14_poll(struct file *file, poll_table *wait) {
 
     poll_wait(file, &priv->read_wq, wait);
     poll_wait(file, &priv->write_wq, wait);
-    spin_lock(&priv->consumer_lock);
-    if (priv->read_buffer_head != priv->read_buffer_tail) {
+    if (READ_ONCE(priv->gone)) {
+        return POLLERR | POLLHUP;
+    }
+    if (smp_load_acquire(&priv->read_buffer_head) != priv->read_buffer_tail) {
         mask |= POLLIN | POLLRDNORM;
     }
-    spin_unlock(&priv->consumer_lock);
-    if (priv->running_command == 0) {
+    if (!cr14_command_queue_full(priv)) {
         mask |= POLLOUT | POLLWRNORM;
     }
 
@@ -957,6 +2031,227 @@ static struct file_operations cr14_fops = {
     .poll = cr14_poll,
 };
 
+// ========================================================================== //
+// sysfs attributes
+// ========================================================================== //
+
+static ssize_t poll_min_ms_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->poll_min_ms));
+}
+
+static ssize_t poll_min_ms_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    unsigned int value;
+    int err = kstrtouint(buf, 0, &value);
+    if (err) {
+        return err;
+    }
+    if (value == 0 || value > READ_ONCE(priv->poll_max_ms)) {
+        return -EINVAL;
+    }
+    WRITE_ONCE(priv->poll_min_ms, value);
+    return count;
+}
+static DEVICE_ATTR_RW(poll_min_ms);
+
+static ssize_t poll_max_ms_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->poll_max_ms));
+}
+
+static ssize_t poll_max_ms_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    unsigned int value;
+    int err = kstrtouint(buf, 0, &value);
+    if (err) {
+        return err;
+    }
+    if (value < READ_ONCE(priv->poll_min_ms)) {
+        return -EINVAL;
+    }
+    WRITE_ONCE(priv->poll_max_ms, value);
+    return count;
+}
+static DEVICE_ATTR_RW(poll_max_ms);
+
+static ssize_t poll_backoff_rounds_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->poll_backoff_rounds));
+}
+
+static ssize_t poll_backoff_rounds_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    unsigned int value;
+    int err = kstrtouint(buf, 0, &value);
+    if (err) {
+        return err;
+    }
+    WRITE_ONCE(priv->poll_backoff_rounds, value);
+    return count;
+}
+static DEVICE_ATTR_RW(poll_backoff_rounds);
+
+static ssize_t poll_interval_ms_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->poll_interval_ms));
+}
+static DEVICE_ATTR_RO(poll_interval_ms);
+
+static ssize_t absence_ms_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->absence_ms));
+}
+
+static ssize_t absence_ms_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    unsigned int value;
+    int err = kstrtouint(buf, 0, &value);
+    if (err) {
+        return err;
+    }
+    WRITE_ONCE(priv->absence_ms, value);
+    return count;
+}
+static DEVICE_ATTR_RW(absence_ms);
+
+static ssize_t session_ms_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    return sprintf(buf, "%u\n", READ_ONCE(priv->session_ms));
+}
+
+static ssize_t session_ms_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    unsigned int value;
+    int err = kstrtouint(buf, 0, &value);
+    if (err) {
+        return err;
+    }
+    WRITE_ONCE(priv->session_ms, value);
+    return count;
+}
+static DEVICE_ATTR_RW(session_ms);
+
+static ssize_t exchange_us_show(struct device *dev, struct device_attribute *attr, char *buf) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    ssize_t len = 0;
+    int ix;
+    for (ix = 0; ix < exchanges_count; ix++) {
+        len += sprintf(buf + len, "%s %u\n", cr14_exchange_timings[ix].name, READ_ONCE(priv->exchange_us[ix]));
+    }
+    return len;
+}
+static DEVICE_ATTR_RO(exchange_us);
+
+// Statistics, in the stats directory. Counters are read-only, histograms are
+// written as one line per bucket with the bucket upper bound in microseconds
+// and the count. Writing to reset clears them all.
+
+#define CR14_STATS_COUNTER_ATTR(name) \
+static ssize_t name##_show(struct device *dev, struct device_attribute *attr, char *buf) { \
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev); \
+    return sprintf(buf, "%lld\n", (long long) atomic64_read(&priv->stats.name)); \
+} \
+static DEVICE_ATTR_RO(name)
+
+#define CR14_STATS_HISTOGRAM_ATTR(name) \
+static ssize_t name##_show(struct device *dev, struct device_attribute *attr, char *buf) { \
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev); \
+    return cr14_histogram_show(priv->stats.name, buf); \
+} \
+static DEVICE_ATTR_RO(name)
+
+static ssize_t cr14_histogram_show(atomic64_t *histogram, char *buf) {
+    ssize_t len = 0;
+    int ix;
+    for (ix = 0; ix < STATS_HISTOGRAM_BUCKETS - 1; ix++) {
+        len += sprintf(buf + len, "%u %lld\n", STATS_HISTOGRAM_MIN_US << ix, (long long) atomic64_read(&histogram[ix]));
+    }
+    len += sprintf(buf + len, "inf %lld\n", (long long) atomic64_read(&histogram[ix]));
+    return len;
+}
+
+CR14_STATS_COUNTER_ATTR(rounds);
+CR14_STATS_COUNTER_ATTR(uids);
+CR14_STATS_COUNTER_ATTR(slot_markers);
+CR14_STATS_COUNTER_ATTR(collided_slots);
+CR14_STATS_COUNTER_ATTR(crc_errors);
+CR14_STATS_COUNTER_ATTR(io_retries);
+CR14_STATS_COUNTER_ATTR(i2c_errors);
+CR14_STATS_COUNTER_ATTR(dropped_frames);
+CR14_STATS_COUNTER_ATTR(responses);
+CR14_STATS_HISTOGRAM_ATTR(round_us);
+CR14_STATS_HISTOGRAM_ATTR(read_block_us);
+CR14_STATS_HISTOGRAM_ATTR(write_block_us);
+CR14_STATS_HISTOGRAM_ATTR(poll_jitter_us);
+
+static ssize_t reset_store(struct device *dev, struct device_attribute *attr, const char *buf, size_t count) {
+    struct cr14_i2c_data *priv = dev_get_drvdata(dev);
+    struct cr14_stats *stats = &priv->stats;
+    int ix;
+    atomic64_set(&stats->rounds, 0);
+    atomic64_set(&stats->uids, 0);
+    atomic64_set(&stats->slot_markers, 0);
+    atomic64_set(&stats->collided_slots, 0);
+    atomic64_set(&stats->crc_errors, 0);
+    atomic64_set(&stats->io_retries, 0);
+    atomic64_set(&stats->i2c_errors, 0);
+    atomic64_set(&stats->dropped_frames, 0);
+    atomic64_set(&stats->responses, 0);
+    for (ix = 0; ix < STATS_HISTOGRAM_BUCKETS; ix++) {
+        atomic64_set(&stats->round_us[ix], 0);
+        atomic64_set(&stats->read_block_us[ix], 0);
+        atomic64_set(&stats->write_block_us[ix], 0);
+        atomic64_set(&stats->poll_jitter_us[ix], 0);
+    }
+    return count;
+}
+static DEVICE_ATTR_WO(reset);
+
+static struct attribute *cr14_attrs[] = {
+    &dev_attr_poll_min_ms.attr,
+    &dev_attr_poll_max_ms.attr,
+    &dev_attr_poll_backoff_rounds.attr,
+    &dev_attr_poll_interval_ms.attr,
+    &dev_attr_absence_ms.attr,
+    &dev_attr_session_ms.attr,
+    &dev_attr_exchange_us.attr,
+    NULL,
+};
+
+static struct attribute *cr14_stats_attrs[] = {
+    &dev_attr_rounds.attr,
+    &dev_attr_uids.attr,
+    &dev_attr_slot_markers.attr,
+    &dev_attr_collided_slots.attr,
+    &dev_attr_crc_errors.attr,
+    &dev_attr_io_retries.attr,
+    &dev_attr_i2c_errors.attr,
+    &dev_attr_dropped_frames.attr,
+    &dev_attr_responses.attr,
+    &dev_attr_round_us.attr,
+    &dev_attr_read_block_us.attr,
+    &dev_attr_write_block_us.attr,
+    &dev_attr_poll_jitter_us.attr,
+    &dev_attr_reset.attr,
+    NULL,
+};
+
+static const struct attribute_group cr14_group = {
+    .attrs = cr14_attrs,
+};
+
+static const struct attribute_group cr14_stats_group = {
+    .name = "stats",
+    .attrs = cr14_stats_attrs,
+};
+
+static const struct attribute_group *cr14_groups[] = {
+    &cr14_group,
+    &cr14_stats_group,
+    NULL,
+};
+
 // ========================================================================== //
 // Probing, initialization and cleanup
 // ========================================================================== //
@@ -966,66 +2261,105 @@ static int cr14_i2c_probe(struct i2c_client *i2c, const struct i2c_device_id *id
 	struct cr14_i2c_data *priv;
     struct device *dev = &i2c->dev;
     int err;
+    int ix;
     s32 result;
 
-    priv = devm_kzalloc(dev, sizeof(*priv), GFP_KERNEL);
+    // Not device managed: the data outlives the device while it is opened.
+    priv = kzalloc(sizeof(*priv), GFP_KERNEL);
     if (!priv)
         return -ENOMEM;
+    kref_init(&priv->kref);
 
     // Read parameter register to make sure device is connected.
     result = i2c_smbus_read_byte_data(i2c, CRX14_PARAMETER_REGISTER);
     if (result < 0) {
         dev_err(dev, "Could not read parameter register %d", result);
-        return result;
+        err = result;
+        goto err_free;
     }
     
     i2c_set_clientdata(i2c, priv);
     priv->i2c = i2c;
 
-    timer_setup(&priv->polling_timer, cr14_polling_timer_cb, 0);
-    
-    // Register device.
-    err = alloc_chrdev_region(&priv->chrdev, 0, 2, DEVICE_NAME);
-    if (err < 0) {
-        dev_err(dev, "Failed to registering character device: %d", err);
-        cr14_i2c_remove(i2c);
-        return err;
+    priv->poll_min_ms = poll_min_ms ? poll_min_ms : POLL_MIN_MS_DEFAULT;
+    priv->poll_max_ms = max(poll_max_ms, priv->poll_min_ms);
+    priv->poll_backoff_rounds = poll_backoff_rounds;
+    priv->poll_interval_ms = priv->poll_min_ms;
+    priv->absence_ms = absence_ms;
+    priv->session_ms = session_ms;
+    for (ix = 0; ix < exchanges_count; ix++) {
+        priv->exchange_us[ix] = cr14_exchange_timings[ix].min_us;
     }
 
-	// Create device class
-	priv->cr14_class = class_create(THIS_MODULE, DEVICE_NAME);
-	if (IS_ERR(priv->cr14_class)) {
-		err = PTR_ERR(priv->cr14_class);
-        dev_err(dev, "class_create failed: %d", err);
-        cr14_i2c_remove(i2c);
-        return err;
-	}
+    hrtimer_init(&priv->polling_timer, CLOCK_MONOTONIC, HRTIMER_MODE_REL);
+    priv->polling_timer.function = cr14_polling_timer_cb;
+    spin_lock_init(&priv->producer_lock);
+    mutex_init(&priv->consumer_lock);
+    mutex_init(&priv->command_lock);
+    init_waitqueue_head(&priv->read_wq);
+    init_waitqueue_head(&priv->write_wq);
+    init_waitqueue_head(&priv->session_wq);
+	INIT_WORK(&priv->polling_work, cr14_do_poll);
 
-    cdev_init(&priv->cdev, &cr14_fops);
+    priv->polling_wq = alloc_ordered_workqueue("%s", WQ_HIGHPRI, dev_name(dev));
+    if (!priv->polling_wq) {
+        dev_err(dev, "Failed to allocate workqueue");
+        err = -ENOMEM;
+        goto err_free;
+    }
 
-    err = cdev_add(&priv->cdev, priv->chrdev, 1);
+    // Register device with the first free minor.
+    priv->minor = ida_alloc_max(&cr14_minors, CR14_MAX_DEVICES - 1, GFP_KERNEL);
+    if (priv->minor < 0) {
+        err = priv->minor;
+        dev_err(dev, "Failed to allocate minor: %d", err);
+        goto err_destroy_workqueue;
+    }
+    priv->chrdev = MKDEV(MAJOR(cr14_chrdev), priv->minor);
+
+    // The cdev is freed with its last reference, which may be dropped after
+    // the data when the device is removed while opened.
+    priv->cdev = cdev_alloc();
+    if (!priv->cdev) {
+        err = -ENOMEM;
+        goto err_free_minor;
+    }
+    priv->cdev->ops = &cr14_fops;
+    priv->cdev->owner = THIS_MODULE;
+
+    mutex_lock(&cr14_devices_lock);
+    cr14_devices[priv->minor] = priv;
+    mutex_unlock(&cr14_devices_lock);
+
+    err = cdev_add(priv->cdev, priv->chrdev, 1);
     if (err) {
         dev_err(dev, "Failed to add cdev: %d", err);
-        cr14_i2c_remove(i2c);
-        return err;
+        kobject_put(&priv->cdev->kobj);
+        goto err_unpublish;
     }
 
-	priv->device = device_create(priv->cr14_class, dev, priv->chrdev, NULL, /* no additional data */ DEVICE_NAME "%d", MINOR(priv->chrdev));
+	priv->device = device_create_with_groups(cr14_class, dev, priv->chrdev, priv, cr14_groups, DEVICE_NAME "%d", priv->minor);
 	if (IS_ERR(priv->device)) {
 		err = PTR_ERR(priv->device);
         dev_err(dev, "Failed to create device: %d", err);
-        cr14_i2c_remove(i2c);
-        return err;
+        goto err_del_cdev;
     }
 
-    spin_lock_init(&priv->producer_lock);
-    spin_lock_init(&priv->consumer_lock);
-    spin_lock_init(&priv->command_lock);
-    init_waitqueue_head(&priv->read_wq);
-    init_waitqueue_head(&priv->write_wq);
-	INIT_WORK(&priv->polling_work, cr14_do_poll);
-
     return 0;
+
+err_del_cdev:
+    cdev_del(priv->cdev);
+err_unpublish:
+    mutex_lock(&cr14_devices_lock);
+    cr14_devices[priv->minor] = NULL;
+    mutex_unlock(&cr14_devices_lock);
+err_free_minor:
+    ida_free(&cr14_minors, priv->minor);
+err_destroy_workqueue:
+    destroy_workqueue(priv->polling_wq);
+err_free:
+    kfree(priv);
+    return err;
 }
 
 static int cr14_i2c_remove(struct i2c_client *client)
@@ -1033,20 +2367,25 @@ static int cr14_i2c_remove(struct i2c_client *client)
     struct cr14_i2c_data *priv;
     priv = i2c_get_clientdata(client);
 
-    if (priv->chrdev) {
-        if (priv->cr14_class) {
-            if (priv->cdev.ops) {
-                device_destroy(priv->cr14_class, MKDEV(MAJOR(priv->chrdev), MINOR(priv->chrdev)));
-                cdev_del(&priv->cdev);
-            }
-            class_destroy(priv->cr14_class);
-        }
-        unregister_chrdev_region(priv->chrdev, 2);
-    }
+    mutex_lock(&cr14_devices_lock);
+    cr14_devices[priv->minor] = NULL;
+    mutex_unlock(&cr14_devices_lock);
+    device_destroy(cr14_class, priv->chrdev);
+    cdev_del(priv->cdev);
 
-    del_timer_sync(&priv->polling_timer);
+    // The device may still be opened: stop polling, ending any session, and
+    // fail reads and writes with ENODEV. The data is freed on release.
+    WRITE_ONCE(priv->gone, 1);
+    priv->opened = 0;
+    wake_up(&priv->session_wq);
+    wake_up_interruptible(&priv->read_wq);
+    wake_up_interruptible(&priv->write_wq);
 	cancel_work_sync(&priv->polling_work);
-    
+    hrtimer_cancel(&priv->polling_timer);
+
+    ida_free(&cr14_minors, priv->minor);
+    kref_put(&priv->kref, cr14_free);
+
     return 0;
 }
 
@@ -1067,7 +2406,49 @@ static struct i2c_driver cr14_i2c_driver = {
     .remove             = cr14_i2c_remove,
 };
 
-module_i2c_driver(cr14_i2c_driver);
+// The class and the range of minors are shared by all devices, which take the
+// first free minor when probed (/dev/rfid0, /dev/rfid1...).
+static int __init cr14_init(void)
+{
+    int err;
+
+    err = alloc_chrdev_region(&cr14_chrdev, 0, CR14_MAX_DEVICES, DEVICE_NAME);
+    if (err < 0) {
+        pr_err(DRV_NAME ": failed to register character devices: %d", err);
+        return err;
+    }
+
+	cr14_class = class_create(THIS_MODULE, DEVICE_NAME);
+	if (IS_ERR(cr14_class)) {
+		err = PTR_ERR(cr14_class);
+        pr_err(DRV_NAME ": class_create failed: %d", err);
+        goto err_unregister_chrdev;
+	}
+
+    err = i2c_add_driver(&cr14_i2c_driver);
+    if (err) {
+        goto err_destroy_class;
+    }
+
+    return 0;
+
+err_destroy_class:
+    class_destroy(cr14_class);
+err_unregister_chrdev:
+    unregister_chrdev_region(cr14_chrdev, CR14_MAX_DEVICES);
+    return err;
+}
+
+static void __exit cr14_exit(void)
+{
+    i2c_del_driver(&cr14_i2c_driver);
+    class_destroy(cr14_class);
+    unregister_chrdev_region(cr14_chrdev, CR14_MAX_DEVICES);
+    ida_destroy(&cr14_minors);
+}
+
+module_init(cr14_init);
+module_exit(cr14_exit);
 
 MODULE_DESCRIPTION("STMicroelectronics CR14 Driver");
 MODULE_AUTHOR("Paul Guyot <pguyot@kallisys.net>");
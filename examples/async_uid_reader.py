@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+
+import asyncio
+
+import cr14
+
+# Example code demonstrating the asyncio client.
+# Print UIDs as they are detected and the system block of each new chip.
+
+
+async def main():
+    seen = set()
+    async with cr14.AsyncReader() as reader:
+        await reader.poll_repeat()
+        async for uid in reader.uids():
+            print(f"UID: {cr14.format_uid(uid)}")
+            if uid not in seen:
+                seen.add(uid)
+                data = await reader.read_block(uid, 0xFF)
+                data_str = ":".join("{:02x}".format(c) for c in reversed(data))
+                print(f"System block: {data_str}")
+
+try:
+    asyncio.run(main())
+except KeyboardInterrupt:
+    pass
@@ -0,0 +1,2 @@
+# Lets the tests import the cr14 package from this directory, as the example
+# scripts do.
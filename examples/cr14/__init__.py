@@ -0,0 +1,22 @@
+# Python client library for the cr14 driver.
+
+from .protocol import DEFAULT_DEVICE, ProtocolError, format_uid
+from .decoder import (
+    Decoder,
+    UidSeen,
+    InventoryRound,
+    TagArrived,
+    TagDeparted,
+    ReadSingleResult,
+    WriteSingleResult,
+    ReadMultipleResult,
+    WriteMultipleResult,
+    ReadTagResult,
+    SessionOpened,
+    WriteVerifyResult,
+    TagDump,
+)
+from .models import ChipModel, TagMemory, identify
+from .reader import Reader
+from .aio import AsyncReader
+from .pool import PoolEvent, ReaderPool
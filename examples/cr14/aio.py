@@ -0,0 +1,366 @@
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .protocol import (
+    DEFAULT_DEVICE,
+    MESSAGE_POLL_ONCE_HEADER,
+    MESSAGE_POLL_REPEAT_MODE_HEADER,
+    MESSAGE_INVENTORY_MODE_HEADER,
+    MESSAGE_PRESENCE_MODE_HEADER,
+    MESSAGE_TIMESTAMPS_ON_HEADER,
+    MESSAGE_TIMESTAMPS_OFF_HEADER,
+    MESSAGE_IDLE_HEADER,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER,
+    MESSAGE_SESSION_RELEASE_HEADER,
+    ProtocolError,
+    encode_read_single_block,
+    encode_write_single_block,
+    encode_read_multiple_blocks,
+    encode_write_multiple_blocks,
+    encode_write_and_verify,
+    encode_read_multiple_tags,
+    encode_session,
+    encode_dump,
+    encode_read_range,
+    encode_write_range,
+    range_addresses,
+    response_count,
+)
+from .decoder import (
+    DEFAULT_BUFFER_SIZE,
+    RESPONSE_TYPES,
+    Decoder,
+    ReadSingleResult,
+    WriteSingleResult,
+    ReadMultipleResult,
+    WriteMultipleResult,
+    ReadTagResult,
+    SessionOpened,
+    TagDump,
+    WriteVerifyResult,
+)
+from .models import TagMemory, check_dump, check_request
+
+
+class AsyncReader:
+    """asyncio client for /dev/rfidN.
+
+    The device is opened non-blocking and watched with loop.add_reader(), so
+    incoming frames are decoded as soon as the driver reports POLLIN. Writes
+    wait for POLLOUT with loop.add_writer() when the driver is busy.
+
+        async with AsyncReader() as reader:
+            await reader.poll_repeat()
+            async for uid in reader.uids():
+                ...
+
+    Commands can be issued concurrently: they are queued by the driver, which
+    answers them in order, so each response is matched to the oldest command
+    awaiting one. idle() discards pending commands, cancelling the callers of
+    those which were not answered yet.
+    """
+
+    def __init__(self, path=DEFAULT_DEVICE, flags=os.O_RDWR, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.decoder = Decoder(buffer_size)
+        self._pending = deque()     # futures of sent commands, in order
+        self._error = None
+        self._loop = None
+        self._fd = os.open(path, flags | os.O_NONBLOCK)
+
+    def fileno(self):
+        return self._fd
+
+    def start(self):
+        """Start watching the device. Must be called from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._uid_event = asyncio.Event()
+        self._round_event = asyncio.Event()
+        self._presence_event = asyncio.Event()
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def close(self):
+        if self._fd >= 0:
+            if self._loop is not None:
+                self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = -1
+            self._set_error(EOFError("Device was closed"))
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    # ---- Low level I/O ----
+
+    def _set_error(self, error):
+        self._error = error
+        if self._loop is not None:
+            self._uid_event.set()
+            self._round_event.set()
+            self._presence_event.set()
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+
+    def _on_readable(self):
+        try:
+            while True:
+                count = os.readv(self._fd, [self.decoder.get_buffer()])
+                if count == 0:
+                    raise EOFError("Device was closed")
+                self.decoder.commit(count)
+                for event in self.decoder.events():
+                    self._dispatch(event)
+        except BlockingIOError:
+            pass
+        except (OSError, EOFError, ProtocolError) as err:
+            self._loop.remove_reader(self._fd)
+            self._set_error(err)
+        if self.decoder.uids:
+            self._uid_event.set()
+        if self.decoder.rounds:
+            self._round_event.set()
+        if self.decoder.presence:
+            self._presence_event.set()
+
+    def _dispatch(self, event):
+        if not self._pending:
+            raise ProtocolError(f"Unexpected response {event}")
+        future = self._pending.popleft()
+        if not future.done():
+            # Callers may have been cancelled while waiting.
+            future.set_result(event)
+
+    async def _writable(self):
+        future = self._loop.create_future()
+
+        def on_writable():
+            if not future.done():
+                future.set_result(None)
+
+        self._loop.add_writer(self._fd, on_writable)
+        try:
+            await future
+        finally:
+            self._loop.remove_writer(self._fd)
+
+    async def _write(self, message):
+        # The driver consumes at most one message per write() call.
+        view = memoryview(message)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                await self._writable()
+
+    async def _send(self, message):
+        if self._error is not None:
+            raise self._error
+        # The lock keeps messages whole when the driver accepts them in parts.
+        async with self._lock:
+            await self._write(message)
+            futures = [self._loop.create_future() for _ in range(response_count(message))]
+            self._pending.extend(futures)
+        return futures
+
+    def _check_response(self, event, event_type):
+        if type(event) is not event_type:
+            raise ProtocolError(f"Unexpected response {event}, expected {event_type.__name__}")
+        return event
+
+    async def _command(self, message, event_type):
+        future, = await self._send(message)
+        return self._check_response(await future, event_type)
+
+    async def _multiple_tags_command(self, message):
+        futures = await self._send(message)
+        return [self._check_response(event, ReadTagResult) for event in await asyncio.gather(*futures)]
+
+    # ---- Modes ----
+
+    async def idle(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_IDLE_HEADER,)))
+            # The driver writes no response for discarded commands after the
+            # idle message: the ones already written complete their commands,
+            # the other commands are cancelled.
+            if self._error is None:
+                self._on_readable()
+            while self._pending:
+                self._pending.popleft().cancel()
+
+    async def poll_once(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_POLL_ONCE_HEADER,)))
+
+    async def poll_repeat(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_POLL_REPEAT_MODE_HEADER,)))
+
+    async def timestamps(self, enabled=True):
+        """Ask the driver to timestamp UIDs, presence events and responses
+        (see the timestamp field of the events)."""
+        async with self._lock:
+            await self._write(bytes((MESSAGE_TIMESTAMPS_ON_HEADER if enabled else MESSAGE_TIMESTAMPS_OFF_HEADER,)))
+
+    async def read_uid_event(self):
+        """Wait for the next UID message and return it as a UidSeen."""
+        while not self.decoder.uids:
+            if self._error is not None:
+                raise self._error
+            self._uid_event.clear()
+            await self._uid_event.wait()
+        return self.decoder.uids.popleft()
+
+    async def read_uid(self):
+        """Wait for the next UID message and return the UID (little endian)."""
+        return (await self.read_uid_event()).uid
+
+    async def uids(self):
+        """Asynchronously iterate over UIDs as they are reported by the driver."""
+        while True:
+            yield await self.read_uid()
+
+    async def inventory(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_INVENTORY_MODE_HEADER,)))
+
+    async def read_round(self):
+        """Wait for the next inventory message and return it as an
+        InventoryRound."""
+        while not self.decoder.rounds:
+            if self._error is not None:
+                raise self._error
+            self._round_event.clear()
+            await self._round_event.wait()
+        return self.decoder.rounds.popleft()
+
+    async def rounds(self):
+        """Asynchronously iterate over inventory rounds as they are reported
+        by the driver."""
+        while True:
+            yield await self.read_round()
+
+    async def presence(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_PRESENCE_MODE_HEADER,)))
+
+    async def read_presence(self):
+        """Wait for the next TagArrived or TagDeparted event."""
+        while not self.decoder.presence:
+            if self._error is not None:
+                raise self._error
+            self._presence_event.clear()
+            await self._presence_event.wait()
+        return self.decoder.presence.popleft()
+
+    async def presence_events(self):
+        """Asynchronously iterate over TagArrived and TagDeparted events."""
+        while True:
+            yield await self.read_presence()
+
+    # ---- Commands ----
+
+    def _request(self, request):
+        if request[0] == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            return self._multiple_tags_command(request)
+        return self._command(request, RESPONSE_TYPES[request[0]])
+
+    async def execute(self, requests):
+        """Send several commands built with the protocol.encode_* functions
+        and return their response events, in the same order (a list of events
+        for read multiple tags commands)."""
+        return await asyncio.gather(*(self._request(request) for request in requests))
+
+    async def read_block(self, uid, addr):
+        check_request(uid, (addr,))
+        event = await self._command(encode_read_single_block(uid, addr), ReadSingleResult)
+        return event.data
+
+    async def write_block(self, uid, addr, data):
+        """Write a block and return the data read back by the driver."""
+        check_request(uid, (addr,))
+        event = await self._command(encode_write_single_block(uid, addr, data), WriteSingleResult)
+        return event.data
+
+    def _blocks(self, event, count):
+        if len(event.blocks) != count:
+            raise ProtocolError(f"Unexpected block count, got {len(event.blocks)}, expected {count}")
+        return list(event.blocks)
+
+    async def read_blocks(self, uid, addresses):
+        check_request(uid, addresses)
+        event = await self._command(encode_read_multiple_blocks(uid, addresses), ReadMultipleResult)
+        return self._blocks(event, len(addresses))
+
+    async def write_blocks(self, uid, addresses, blocks):
+        """Write blocks and return the data read back by the driver."""
+        check_request(uid, addresses)
+        event = await self._command(encode_write_multiple_blocks(uid, addresses, blocks), WriteMultipleResult)
+        return self._blocks(event, len(addresses))
+
+    async def write_and_verify(self, uid, addresses, blocks, verify=True):
+        """Write blocks back to back and read them back in a single pass, or
+        not at all if verify is False. Return a dict of the data read back by
+        address, for blocks which do not hold the written data."""
+        check_request(uid, addresses)
+        event = await self._command(encode_write_and_verify(uid, addresses, blocks, verify), WriteVerifyResult)
+        return event.mismatches
+
+    async def read_range(self, uid, start, count, stride=1):
+        """Read count blocks from start, every stride blocks."""
+        check_request(uid, range_addresses(start, count, stride))
+        event = await self._command(encode_read_range(uid, start, count, stride), ReadMultipleResult)
+        return self._blocks(event, count)
+
+    async def write_range(self, uid, start, count, data, stride=1):
+        """Write data to count blocks from start, every stride blocks, and
+        return the data read back by the driver."""
+        check_request(uid, range_addresses(start, count, stride))
+        event = await self._command(encode_write_range(uid, start, count, data, stride), WriteMultipleResult)
+        return self._blocks(event, count)
+
+    async def read_tags(self, uids, addresses):
+        """Read the same blocks from several chips, in a single polling round
+        when they are all in the field. Return a dict of blocks by UID."""
+        for uid in uids:
+            check_request(uid, addresses)
+        events = await self._multiple_tags_command(encode_read_multiple_tags(uids, addresses))
+        return {event.uid: self._blocks(event, len(addresses)) for event in events}
+
+    async def dump(self, uid):
+        """Read every block of the chip and its system block with a single
+        command. Return a TagMemory."""
+        model = check_dump(uid)
+        event = await self._command(encode_dump(uid), TagDump)
+        memory = TagMemory(model)
+        memory.load(event.blocks, event.system_block)
+        return memory
+
+    async def open_session(self, uid):
+        """Wait for the chip and keep it selected with RF on, so that the next
+        commands for it run without polling again. The driver closes the
+        session after session_ms without any command."""
+        await self._command(encode_session(uid), SessionOpened)
+
+    async def release_session(self):
+        async with self._lock:
+            await self._write(bytes((MESSAGE_SESSION_RELEASE_HEADER,)))
+
+    @asynccontextmanager
+    async def session(self, uid):
+        """Open a session with the chip for the duration of an async with
+        block."""
+        await self.open_session(uid)
+        try:
+            yield self
+        finally:
+            await self.release_session()
@@ -0,0 +1,216 @@
+# Throughput and latency benchmark of the reader pipeline.
+#
+# Runs against a real device (--device /dev/rfid0, a tag must stay on the
+# reader) or against the simulator (--simulate), and writes the results as
+# JSON so they can be compared between releases:
+#
+#     python3 -m cr14.benchmark --simulate --output results.json
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+from .protocol import DEFAULT_DEVICE, MAX_ADDRESSES, ProtocolError
+from .models import FIRST_EEPROM_BLOCK, MODELS_BY_NAME, identify
+from .reader import Reader
+from .pool import ReaderPool
+from .simulator import Simulator, SimulatedTag
+
+READ_SIZES = (1, 16, 128, MAX_ADDRESSES)
+WRITE_SIZE = 8
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_samples:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+def summarize(samples):
+    """Return count, mean, p50, p99, p999 and max of samples (in seconds)."""
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean": sum(samples) / len(samples) if samples else None,
+        "p50": percentile(samples, 0.50),
+        "p99": percentile(samples, 0.99),
+        "p999": percentile(samples, 0.999),
+        "max": samples[-1] if samples else None,
+    }
+
+
+def bench_uid_rate(reader, duration):
+    """UID events per second in poll repeat mode, and delay between the chip
+    answering (driver timestamp) and the event being read."""
+    intervals = []
+    delivery = []
+    reader.timestamps()
+    reader.poll_repeat()
+    start = last = time.monotonic()
+    count = 0
+    while last - start < duration:
+        # Without a chip in the field, no event comes.
+        event = reader.read_uid_event(timeout=start + duration - last)
+        now = time.monotonic()
+        if event is None:
+            last = now
+            break
+        if event.timestamp is not None:
+            delivery.append((time.monotonic_ns() - event.timestamp) / 1e9)
+        if count:
+            intervals.append(now - last)
+        last = now
+        count += 1
+    reader.idle()
+    reader.timestamps(False)
+    elapsed = last - start
+    return {
+        "duration": elapsed,
+        "events": count,
+        "rate": count / elapsed if elapsed else None,
+        "interval": summarize(intervals),
+        "delivery_latency": summarize(delivery),
+    }
+
+
+def bench_detection_latency(reader, simulator, iterations, dwell):
+    """Delay between a tag entering the field and its UID being read."""
+    latencies = []
+    reader.poll_repeat()
+    for _ in range(iterations):
+        now = simulator.now()
+        tag = simulator.add_tag(SimulatedTag(enter=now, leave=now + dwell))
+        while reader.read_uid() != tag.uid:
+            pass
+        latencies.append(simulator.now() - now)
+        # Wait for the tag to leave before the next one enters.
+        time.sleep(max(0.0, tag.leave - simulator.now()))
+    reader.idle()
+    return summarize(latencies)
+
+
+def _addresses(model, count):
+    # Repeat valid addresses to reach count.
+    return [ix % model.blocks_count for ix in range(count)]
+
+
+def bench_read(reader, uid, model, iterations):
+    """Latency of 'R' commands of increasing sizes."""
+    results = {}
+    for size in READ_SIZES:
+        addresses = _addresses(model, size)
+        latencies = []
+        for _ in range(iterations):
+            start = time.monotonic()
+            reader.read_blocks(uid, addresses)
+            latencies.append(time.monotonic() - start)
+        results[str(size)] = summarize(latencies)
+    return results
+
+
+def bench_write(reader, uid, model, iterations):
+    """Throughput of 'W' commands on EEPROM blocks (data is written back)."""
+    addresses = [FIRST_EEPROM_BLOCK + (ix % (model.blocks_count - FIRST_EEPROM_BLOCK)) for ix in range(WRITE_SIZE)]
+    blocks = reader.read_blocks(uid, addresses)
+    latencies = []
+    for _ in range(iterations):
+        start = time.monotonic()
+        reader.write_blocks(uid, addresses, blocks)
+        latencies.append(time.monotonic() - start)
+    total = sum(latencies)
+    return {
+        "blocks": len(addresses),
+        "throughput": len(addresses) * iterations / total if total else None,
+        "latency": summarize(latencies),
+    }
+
+
+def bench_pool_read_tags(model, time_scale, iterations):
+    """Latency of 'M' commands for tags on two simulated readers, which the
+    pool splits into one command per reader."""
+    tags = [SimulatedTag(model=model) for _ in range(3)]
+    addresses = _addresses(model, WRITE_SIZE)
+    latencies = []
+    with Simulator(tags[:2], time_scale=time_scale) as first, Simulator(tags[2:], time_scale=time_scale) as second:
+        with ReaderPool([first.path, second.path]) as pool:
+            pool.poll_repeat()
+            while any(pool.locate(tag.uid) is None for tag in tags):
+                pool.read_event()
+            pool.idle()
+            for _ in range(iterations):
+                start = time.monotonic()
+                blocks = pool.read_tags([tag.uid for tag in tags], addresses)
+                latencies.append(time.monotonic() - start)
+                for tag in tags:
+                    if blocks[tag.uid] != [tag.memory.read_block(addr) for addr in addresses]:
+                        raise ProtocolError(f"Unexpected blocks for {tag.uid.hex()}")
+    return summarize(latencies)
+
+
+def run(reader, args, simulator=None, uid=None):
+    results = {
+        "device": "simulator" if simulator else args.device,
+        "time": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+    }
+    if simulator is not None:
+        results["time_scale"] = simulator.time_scale
+    results["uid_rate"] = bench_uid_rate(reader, args.duration)
+    if simulator is not None:
+        results["detection_latency"] = bench_detection_latency(reader, simulator, args.iterations, args.dwell)
+    if uid is None:
+        reader.decoder.uids.clear()
+        reader.poll_once()
+        uid = reader.read_uid()
+    model = identify(uid) or MODELS_BY_NAME['SRI512']
+    results["model"] = model.name
+    results["read"] = bench_read(reader, uid, model, args.iterations)
+    if simulator is not None or args.write:
+        results["write"] = bench_write(reader, uid, model, args.iterations)
+    if simulator is not None:
+        results["pool_read_tags"] = bench_pool_read_tags(model, simulator.time_scale, args.iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cr14 reader pipeline.")
+    parser.add_argument("--device", default=DEFAULT_DEVICE)
+    parser.add_argument("--simulate", action="store_true", help="use the simulator instead of a device")
+    parser.add_argument("--model", choices=sorted(MODELS_BY_NAME), default='SRIX4K',
+                        help="chip model of the simulated tag")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulator time scale")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds of poll repeat mode")
+    parser.add_argument("--iterations", type=int, default=20, help="samples per measurement")
+    parser.add_argument("--dwell", type=float, default=0.6, help="seconds simulated tags stay in the field")
+    parser.add_argument("--write", action="store_true",
+                        help="also benchmark writes on a real tag (blocks are written back unchanged)")
+    parser.add_argument("--output", help="JSON output file (default: stdout)")
+    args = parser.parse_args()
+
+    if args.simulate:
+        tag = SimulatedTag(model=MODELS_BY_NAME[args.model])
+        with Simulator([tag], time_scale=args.time_scale) as simulator:
+            with Reader(simulator.path) as reader:
+                results = run(reader, args, simulator, tag.uid)
+    else:
+        with Reader(args.device, os.O_RDWR) as reader:
+            results = run(reader, args)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+            output.write("\n")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
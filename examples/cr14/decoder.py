@@ -0,0 +1,192 @@
+from collections import deque, namedtuple
+
+from .protocol import (
+    BLOCK_SIZE,
+    MAX_FRAME_SIZE,
+    MESSAGE_UID_HEADER,
+    MESSAGE_INVENTORY_MODE_HEADER,
+    MESSAGE_TIMESTAMPED_HEADER,
+    MESSAGE_ARRIVED_HEADER,
+    MESSAGE_DEPARTED_HEADER,
+    MESSAGE_READ_SINGLE_BLOCK_HEADER,
+    MESSAGE_WRITE_SINGLE_BLOCK_HEADER,
+    MESSAGE_READ_MULTIPLE_BLOCKS_HEADER,
+    MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER,
+    MESSAGE_SESSION_HEADER,
+    MESSAGE_DUMP_HEADER,
+    MESSAGE_READ_RANGE_HEADER,
+    MESSAGE_WRITE_RANGE_HEADER,
+    MESSAGE_WRITE_AND_VERIFY_HEADER,
+    UID_SIZE,
+    INVENTORY_HEADER_SIZE,
+    TIMESTAMP_PREFIX_SIZE,
+    ProtocolError,
+    frame_size,
+)
+
+# Same size as the driver's circular buffer, so a single read() can drain it.
+DEFAULT_BUFFER_SIZE = 8192
+
+# ---- Events ----
+# uid and data are little endian bytes, as sent by the driver.
+# timestamp is the driver's ktime_get_ns() when the chip answered, comparable
+# with time.monotonic_ns(). It is None unless timestamps were enabled.
+UidSeen = namedtuple('UidSeen', ['uid', 'timestamp'], defaults=(None,))
+TagArrived = namedtuple('TagArrived', ['uid', 'timestamp'], defaults=(None,))
+TagDeparted = namedtuple('TagDeparted', ['uid', 'timestamp'], defaults=(None,))
+# Inventory timestamps are always set, and taken at the start of the round.
+InventoryRound = namedtuple('InventoryRound', ['seq', 'timestamp', 'slot_markers', 'collided_slots', 'uids'])
+ReadSingleResult = namedtuple('ReadSingleResult', ['data', 'timestamp'], defaults=(None,))
+WriteSingleResult = namedtuple('WriteSingleResult', ['data', 'timestamp'], defaults=(None,))
+ReadMultipleResult = namedtuple('ReadMultipleResult', ['blocks', 'timestamp'], defaults=(None,))
+WriteMultipleResult = namedtuple('WriteMultipleResult', ['blocks', 'timestamp'], defaults=(None,))
+ReadTagResult = namedtuple('ReadTagResult', ['uid', 'blocks', 'timestamp'], defaults=(None,))
+SessionOpened = namedtuple('SessionOpened', ['uid', 'timestamp'], defaults=(None,))
+# mismatches maps addresses to the data read back, for blocks which do not hold
+# the written data.
+WriteVerifyResult = namedtuple('WriteVerifyResult', ['mismatches', 'timestamp'], defaults=(None,))
+TagDump = namedtuple('TagDump', ['blocks', 'system_block', 'timestamp'], defaults=(None,))
+
+# Response event of each command, by header.
+RESPONSE_TYPES = {
+    MESSAGE_READ_SINGLE_BLOCK_HEADER: ReadSingleResult,
+    MESSAGE_WRITE_SINGLE_BLOCK_HEADER: WriteSingleResult,
+    MESSAGE_READ_MULTIPLE_BLOCKS_HEADER: ReadMultipleResult,
+    MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER: WriteMultipleResult,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER: ReadTagResult,
+    MESSAGE_SESSION_HEADER: SessionOpened,
+    MESSAGE_DUMP_HEADER: TagDump,
+    MESSAGE_READ_RANGE_HEADER: ReadMultipleResult,
+    MESSAGE_WRITE_RANGE_HEADER: WriteMultipleResult,
+    MESSAGE_WRITE_AND_VERIFY_HEADER: WriteVerifyResult,
+}
+
+
+def _split_blocks(frame, offset=2):
+    data = bytes(frame[offset:])
+    return tuple(data[ix:ix + BLOCK_SIZE] for ix in range(0, len(data), BLOCK_SIZE))
+
+
+def decode_frame(frame):
+    """Decode a complete frame into an event."""
+    header = frame[0]
+    if header == MESSAGE_TIMESTAMPED_HEADER:
+        event = decode_frame(frame[TIMESTAMP_PREFIX_SIZE:])
+        return event._replace(timestamp=int.from_bytes(frame[1:TIMESTAMP_PREFIX_SIZE], byteorder='little'))
+    if header == MESSAGE_UID_HEADER:
+        return UidSeen(bytes(frame[1:]))
+    if header == MESSAGE_ARRIVED_HEADER:
+        return TagArrived(bytes(frame[1:]))
+    if header == MESSAGE_DEPARTED_HEADER:
+        return TagDeparted(bytes(frame[1:]))
+    if header == MESSAGE_INVENTORY_MODE_HEADER:
+        uids = bytes(frame[INVENTORY_HEADER_SIZE:])
+        return InventoryRound(
+            int.from_bytes(frame[1:5], byteorder='little'),
+            int.from_bytes(frame[5:13], byteorder='little'),
+            frame[13],
+            frame[14],
+            tuple(uids[ix:ix + UID_SIZE] for ix in range(0, len(uids), UID_SIZE)))
+    if header == MESSAGE_READ_SINGLE_BLOCK_HEADER:
+        return ReadSingleResult(bytes(frame[1:]))
+    if header == MESSAGE_WRITE_SINGLE_BLOCK_HEADER:
+        return WriteSingleResult(bytes(frame[1:]))
+    if header == MESSAGE_READ_MULTIPLE_BLOCKS_HEADER or header == MESSAGE_READ_RANGE_HEADER:
+        return ReadMultipleResult(_split_blocks(frame))
+    if header == MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER or header == MESSAGE_WRITE_RANGE_HEADER:
+        return WriteMultipleResult(_split_blocks(frame))
+    if header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+        return ReadTagResult(bytes(frame[1:1 + UID_SIZE]), _split_blocks(frame, 2 + UID_SIZE))
+    if header == MESSAGE_SESSION_HEADER:
+        return SessionOpened(bytes(frame[1:]))
+    if header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+        data = bytes(frame[2:])
+        step = 1 + BLOCK_SIZE
+        return WriteVerifyResult({data[ix]: data[ix + 1:ix + step] for ix in range(0, len(data), step)})
+    if header == MESSAGE_DUMP_HEADER:
+        blocks = _split_blocks(frame)
+        return TagDump(blocks[:-1], blocks[-1])
+    raise ProtocolError(f"Unexpected packet header {header}")
+
+
+class Decoder:
+    """Incremental decoder for the driver => client byte stream.
+
+    Bytes can be fed in arbitrary chunks, either by copying them with feed()
+    or by reading directly into the buffer returned by get_buffer() and then
+    calling commit(). Frames split across chunks are kept until complete.
+
+    UidSeen, InventoryRound and TagArrived/TagDeparted events are appended to
+    the uids, rounds and presence queues unless route_uids is False, in which
+    case they are returned inline with the command responses.
+    """
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, route_uids=True):
+        if buffer_size < 2 * MAX_FRAME_SIZE:
+            raise ValueError(f"buffer_size must be at least {2 * MAX_FRAME_SIZE}")
+        self.uids = deque()
+        self.rounds = deque()
+        self.presence = deque()
+        self.route_uids = route_uids
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def pending(self):
+        """Number of buffered bytes not yet decoded (partial frame)."""
+        return self._end - self._start
+
+    def get_buffer(self):
+        """Return a writable view of the free space at the end of the buffer.
+        It can always hold the largest frame."""
+        if self._start and len(self._buffer) - self._start < 2 * MAX_FRAME_SIZE:
+            remaining = self._end - self._start
+            self._buffer[:remaining] = bytes(self._view[self._start:self._end])
+            self._start = 0
+            self._end = remaining
+        return self._view[self._end:]
+
+    def commit(self, count):
+        """Account for count bytes written into the view from get_buffer()."""
+        self._end += count
+
+    def events(self):
+        """Decode every complete frame in the buffer."""
+        while True:
+            try:
+                size = frame_size(self._buffer, self._start, self._end)
+            except ProtocolError:
+                # Drop the offending byte so next call can resynchronize.
+                self._start += 1
+                raise
+            if size == 0 or self._end - self._start < size:
+                break
+            frame = self._view[self._start:self._start + size]
+            self._start += size
+            event = decode_frame(frame)
+            if self.route_uids and type(event) is UidSeen:
+                self.uids.append(event)
+            elif self.route_uids and type(event) is InventoryRound:
+                self.rounds.append(event)
+            elif self.route_uids and type(event) in (TagArrived, TagDeparted):
+                self.presence.append(event)
+            else:
+                yield event
+        if self._start == self._end:
+            self._start = 0
+            self._end = 0
+
+    def feed(self, data):
+        """Copy data into the buffer and return the list of decoded events."""
+        result = []
+        data = memoryview(data)
+        while data:
+            buffer = self.get_buffer()
+            count = min(len(buffer), len(data))
+            buffer[:count] = data[:count]
+            self.commit(count)
+            data = data[count:]
+            result.extend(self.events())
+        return result
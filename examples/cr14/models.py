@@ -0,0 +1,202 @@
+# Memory model of the ISO 14443-2 type B PICCs supported by the CR14.
+#
+# All these chips share the same layout:
+# - blocks 0 to 4: resettable OTP area (bits can only be cleared, and the whole
+#   area is reset to 1s when the counter in block 6 is decremented)
+# - blocks 5 and 6: 32 bits binary counters, which can only be decremented and
+#   are protected against tearing
+# - blocks 7 to blocks_count - 1: EEPROM
+# - block 255: system OTP block, bits 24 to 31 are the OTP_Lock_Reg. A cleared
+#   bit write-protects a group of EEPROM blocks.
+# See the datasheets linked in README.md.
+
+from .protocol import BLOCK_SIZE, UID_SIZE
+
+SYSTEM_BLOCK = 0xFF
+OTP_BLOCKS = range(0, 5)
+COUNTER_BLOCKS = (5, 6)
+RELOAD_COUNTER_BLOCK = 6
+FIRST_EEPROM_BLOCK = 7
+
+UID_MSB = 0xD0
+MANUFACTURER_ST = 0x02
+
+MANUFACTURERS = {
+   0x01: "Motorola",
+   0x02: "ST Microelectronics",
+   0x03: "Hitachi",
+   0x04: "NXP Semiconductors",
+   0x05: "Infineon Technologies",
+   0x06: "Cylinc",
+   0x07: "Texas Instruments Tag-it",
+   0x08: "Fujitsu Limited",
+   0x09: "Matsushita Electric Industrial",
+   0x0A: "NEC",
+   0x0B: "Oki Electric",
+   0x0C: "Toshiba",
+   0x0D: "Mitsubishi Electric",
+   0x0E: "Samsung Electronics",
+   0x0F: "Hyundai Electronics",
+   0x10: "LG Semiconductors",
+   0x16: "EM Microelectronic-Marin",
+   0x1F: "Melexis",
+   0x2B: "Maxim",
+   0x33: "AMIC",
+   0x44: "GenTag, Inc (USA)",
+   0x45: "Invengo Information Technology Co.Ltd",
+}
+
+# OTP_Lock_Reg layouts: (bit, first block, last block)
+LOCK_BITS_512 = ((24, 7, 8),) + tuple((24 + n, 8 + n, 8 + n) for n in range(1, 8))
+LOCK_BITS_2K = ((24, 7, 15),) + tuple((24 + n, 16 * n, 16 * n + 15) for n in range(1, 4))
+LOCK_BITS_4K = ((24, 7, 15),) + tuple((24 + n, 16 * n, 16 * n + 15) for n in range(1, 8))
+
+
+class ChipModel:
+    """Memory layout of a chip family."""
+
+    def __init__(self, name, id_bits, model_id, blocks_count, lock_bits):
+        self.name = name
+        self.id_bits = id_bits      # number of bits of the model id in UID byte 5
+        self.model_id = model_id
+        self.blocks_count = blocks_count
+        self.lock_bits = lock_bits
+        self._lock_map = bytearray(b'\xFF' * blocks_count)
+        for bit, first, last in lock_bits:
+            self._lock_map[first:last + 1] = bytes((bit,)) * (last - first + 1)
+
+    def __repr__(self):
+        return f"ChipModel({self.name})"
+
+    def matches(self, model_byte):
+        if self.id_bits < 8:
+            model_byte >>= 8 - self.id_bits
+        return model_byte == self.model_id
+
+    def is_valid_address(self, addr):
+        return 0 <= addr < self.blocks_count or addr == SYSTEM_BLOCK
+
+    def check_addresses(self, addresses):
+        """Raise ValueError if an address does not exist on this chip: the chip
+        would not answer and the driver would retry forever."""
+        for addr in addresses:
+            if not self.is_valid_address(addr):
+                raise ValueError(f"Block {addr} does not exist on {self.name}")
+
+    def lock_bit(self, addr):
+        """Return the OTP_Lock_Reg bit protecting addr, or None."""
+        if 0 <= addr < self.blocks_count and self._lock_map[addr] != 0xFF:
+            return self._lock_map[addr]
+        return None
+
+    def is_locked(self, addr, system_block):
+        """Tell if addr is write-protected given the system block data."""
+        bit = self.lock_bit(addr)
+        if bit is None:
+            return False
+        return not (int.from_bytes(system_block, byteorder='little') >> bit) & 1
+
+    def check_write(self, addr, data, current=None, system_block=None):
+        """Raise ValueError if writing data to addr would be ignored by the
+        chip. current and system_block are checked when known."""
+        self.check_addresses((addr,))
+        if system_block is not None and self.is_locked(addr, system_block):
+            raise ValueError(f"Block {addr} is write-protected")
+        if current is not None and addr in COUNTER_BLOCKS:
+            if int.from_bytes(data, byteorder='little') >= int.from_bytes(current, byteorder='little'):
+                raise ValueError(f"Counter block {addr} can only be decremented")
+
+
+# 8 bits ids first: each of them starts with the 6 bits id of an older chip,
+# and the most specific id wins (same order as cr14_chip_models in cr14.c).
+MODELS = (
+    ChipModel('ST25TB512-AC', 8, 0x1B, 16, LOCK_BITS_512),
+    ChipModel('ST25TB04K', 8, 0x1F, 128, LOCK_BITS_4K),
+    ChipModel('ST25TB512-AT', 8, 0x33, 16, LOCK_BITS_512),
+    ChipModel('ST25TB02K', 8, 0x3F, 64, LOCK_BITS_2K),
+    ChipModel('SRIX4K', 6, 0b000011, 128, LOCK_BITS_4K),
+    ChipModel('SRI512', 6, 0b000110, 16, LOCK_BITS_512),
+    ChipModel('SRT512', 6, 0b001100, 16, LOCK_BITS_512),
+    ChipModel('SRI4K', 6, 0b000111, 128, LOCK_BITS_4K),
+    ChipModel('SRI2K', 6, 0b001111, 64, LOCK_BITS_2K),
+)
+MODELS_BY_NAME = {model.name: model for model in MODELS}
+
+
+def identify(uid):
+    """Return the ChipModel of a UID (little endian), or None if unknown."""
+    if len(uid) != UID_SIZE or uid[7] != UID_MSB or uid[6] != MANUFACTURER_ST:
+        return None
+    for model in MODELS:
+        if model.matches(uid[5]):
+            return model
+    return None
+
+
+def check_dump(uid):
+    """Return the ChipModel of uid, raising ValueError if the driver cannot
+    dump it because the model is unknown."""
+    model = identify(uid)
+    if model is None:
+        raise ValueError("Cannot dump a chip of unknown model")
+    return model
+
+
+def check_request(uid, addresses):
+    """Validate addresses against the chip identified by uid, if known."""
+    model = identify(uid)
+    if model is not None:
+        model.check_addresses(addresses)
+
+
+class TagMemory:
+    """EEPROM contents of a tag, enforcing the write rules of its model."""
+
+    def __init__(self, model):
+        self.model = model
+        self.blocks = bytearray(b'\xFF' * (model.blocks_count * BLOCK_SIZE))
+        self.system_block = bytearray(b'\xFF' * BLOCK_SIZE)
+
+    def load(self, blocks, system_block):
+        """Set the contents from blocks read from a tag, e.g. by a dump."""
+        if len(blocks) != self.model.blocks_count:
+            raise ValueError(f"Expected {self.model.blocks_count} blocks, got {len(blocks)}")
+        self.blocks[:] = b''.join(blocks)
+        self.system_block[:] = system_block
+
+    def read_block(self, addr):
+        """Return the block data, or None if the chip would not answer."""
+        if addr == SYSTEM_BLOCK:
+            return bytes(self.system_block)
+        if not self.model.is_valid_address(addr):
+            return None
+        return bytes(self.blocks[addr * BLOCK_SIZE:(addr + 1) * BLOCK_SIZE])
+
+    def write_block(self, addr, data, torn=False):
+        """Write a block as the chip would. torn means the RF field was lost
+        during the EEPROM cycle. Return whether the block was modified."""
+        if not self.model.is_valid_address(addr):
+            return False
+        if addr == SYSTEM_BLOCK:
+            if not torn:
+                self.system_block[:] = bytes(a & b for a, b in zip(self.system_block, data))
+            return not torn
+        if self.model.is_locked(addr, self.system_block):
+            return False
+        offset = addr * BLOCK_SIZE
+        current = self.blocks[offset:offset + BLOCK_SIZE]
+        if addr in COUNTER_BLOCKS:
+            # Anti-tearing: a torn counter write leaves the previous value.
+            if torn or int.from_bytes(data, byteorder='little') >= int.from_bytes(current, byteorder='little'):
+                return False
+            self.blocks[offset:offset + BLOCK_SIZE] = data
+            if addr == RELOAD_COUNTER_BLOCK:
+                self.blocks[0:len(OTP_BLOCKS) * BLOCK_SIZE] = b'\xFF' * (len(OTP_BLOCKS) * BLOCK_SIZE)
+            return True
+        if addr in OTP_BLOCKS:
+            data = bytes(a & b for a, b in zip(current, data))
+        if torn:
+            # Content is undefined, model it as the erased state.
+            data = b'\xFF' * BLOCK_SIZE
+        self.blocks[offset:offset + BLOCK_SIZE] = data
+        return True
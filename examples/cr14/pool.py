@@ -0,0 +1,382 @@
+# Aggregation of several readers (/dev/rfid0, /dev/rfid1...) in a single
+# thread.
+#
+#     with ReaderPool() as pool:
+#         pool.poll_repeat()
+#         for reader, event in pool.events():
+#             ...
+
+import glob
+import heapq
+import itertools
+import os
+import select
+import time
+from collections import deque, namedtuple
+
+from .protocol import (
+    MESSAGE_POLL_ONCE_HEADER,
+    MESSAGE_POLL_REPEAT_MODE_HEADER,
+    MESSAGE_INVENTORY_MODE_HEADER,
+    MESSAGE_PRESENCE_MODE_HEADER,
+    MESSAGE_TIMESTAMPS_ON_HEADER,
+    MESSAGE_TIMESTAMPS_OFF_HEADER,
+    MESSAGE_IDLE_HEADER,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER,
+    UID_SIZE,
+    ProtocolError,
+    encode_read_single_block,
+    encode_write_single_block,
+    encode_read_multiple_blocks,
+    encode_write_multiple_blocks,
+    encode_read_multiple_tags,
+    response_count,
+)
+from .decoder import (
+    DEFAULT_BUFFER_SIZE,
+    RESPONSE_TYPES,
+    Decoder,
+    UidSeen,
+    InventoryRound,
+    TagArrived,
+    TagDeparted,
+    ReadTagResult,
+    SessionOpened,
+)
+from .models import check_request
+
+DEVICES_PATTERN = "/dev/rfid[0-9]*"
+# Longest expected delay (seconds) between the driver timestamp of an event and
+# the event being written: inventory and departed messages carry the start of
+# their polling round.
+REORDER_WINDOW = 0.1
+
+# Event of the merged stream, reader is the index of the device in paths.
+PoolEvent = namedtuple('PoolEvent', ['reader', 'event'])
+
+
+class _Device:
+    # State of one reader of the pool.
+
+    def __init__(self, index, path, flags, buffer_size):
+        self.index = index
+        self.path = path
+        # Every event is returned inline, the pool routes them.
+        self.decoder = Decoder(buffer_size, route_uids=False)
+        self.responses = deque()
+        self.outstanding = 0        # responses not received yet
+        self.drained = 0            # time (ns) when everything written before was read
+        self.fd = os.open(path, flags | os.O_NONBLOCK)
+
+
+class ReaderPool:
+    """Client for several /dev/rfidN devices, multiplexed with epoll.
+
+    UidSeen, InventoryRound and TagArrived/TagDeparted events of every reader
+    are merged into a single stream of PoolEvents, returned by read_event()
+    and events(), in driver timestamp order when timestamps are enabled (in
+    arrival order otherwise). Events are held until every reader was read past
+    their timestamp, plus reorder_window seconds for timestamped events, as
+    the driver writes some of them at the end of a polling round: an event
+    written later than that after its timestamp can still be returned after
+    newer ones.
+
+    Commands are sent to the reader which last reported the target UID, or to
+    the least busy reader if no reader reported it. Read multiple tags
+    commands are split into one command per reader. As the driver runs a
+    command once the tag is in its own field, UIDs should be polled before
+    sending commands when tags can be on any antenna.
+    """
+
+    def __init__(self, paths=None, flags=os.O_RDWR, buffer_size=DEFAULT_BUFFER_SIZE,
+                 reorder_window=REORDER_WINDOW):
+        if paths is None:
+            paths = sorted(glob.glob(DEVICES_PATTERN))
+        if not paths:
+            raise ValueError("No reader")
+        self.paths = list(paths)
+        self.reorder_window = reorder_window
+        self._timestamps = False
+        self._events = deque()      # events ready to be returned
+        self._held = []             # heap of (timestamp, order, event)
+        self._order = itertools.count()
+        self._locations = {}        # reader index by UID
+        self._epoll = select.epoll()
+        self._devices = []
+        self._by_fd = {}
+        try:
+            for index, path in enumerate(self.paths):
+                device = _Device(index, path, flags, buffer_size)
+                self._devices.append(device)
+                self._by_fd[device.fd] = device
+                self._epoll.register(device.fd, select.EPOLLIN)
+        except OSError:
+            self.close()
+            raise
+
+    def fileno(self):
+        """The epoll file descriptor, readable when a reader is."""
+        return self._epoll.fileno()
+
+    def close(self):
+        for device in self._devices:
+            if device.fd >= 0:
+                os.close(device.fd)
+                device.fd = -1
+        self._epoll.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self._devices)
+
+    # ---- Low level I/O ----
+
+    def _fill(self, device):
+        try:
+            while True:
+                start = time.monotonic_ns()
+                count = os.readv(device.fd, [device.decoder.get_buffer()])
+                if count == 0:
+                    raise EOFError(f"Device {device.path} was closed")
+                device.decoder.commit(count)
+                received = time.monotonic_ns()
+                for event in device.decoder.events():
+                    self._dispatch(device, event, received)
+        except BlockingIOError:
+            device.drained = start
+
+    def _dispatch(self, device, event, received):
+        if type(event) in (UidSeen, TagArrived, TagDeparted, InventoryRound):
+            self._locate(device, event)
+            timestamp = received if event.timestamp is None else event.timestamp
+            heapq.heappush(self._held, (timestamp, next(self._order), PoolEvent(device.index, event)))
+            return
+        if type(event) in (ReadTagResult, SessionOpened):
+            self._locations[event.uid] = device.index
+        device.outstanding -= 1
+        device.responses.append(event)
+
+    def _locate(self, device, event):
+        if type(event) is InventoryRound:
+            for uid in event.uids:
+                self._locations[uid] = device.index
+        elif type(event) is TagDeparted:
+            if self._locations.get(event.uid) == device.index:
+                del self._locations[event.uid]
+        else:
+            self._locations[event.uid] = device.index
+
+    def _poll(self, timeout=None):
+        start = time.monotonic_ns()
+        ready = self._epoll.poll(-1 if timeout is None else timeout)
+        filled = set()
+        for fd, mask in ready:
+            if mask & (select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP):
+                self._fill(self._by_fd[fd])
+                filled.add(fd)
+        # Readers which were not readable had nothing written before start.
+        for device in self._devices:
+            if device.fd not in filled:
+                device.drained = start
+        self._release()
+        return ready
+
+    def _lag(self):
+        # Driver timestamps can be older than the time they are written at.
+        return int(self.reorder_window * 1e9) if self._timestamps else 0
+
+    def _release(self):
+        # Events older than what every reader was read up to cannot be
+        # preceded by an event read later.
+        watermark = min(device.drained for device in self._devices) - self._lag()
+        while self._held and self._held[0][0] <= watermark:
+            self._events.append(heapq.heappop(self._held)[2])
+
+    def poll(self, timeout=None):
+        """Wait for data from any reader (up to timeout seconds) and decode
+        it. Return whether there was any."""
+        return bool(self._poll(timeout))
+
+    def _write(self, device, message):
+        # The driver consumes at most one message per write() call, and fails
+        # with EAGAIN while its queue is full: wait for POLLOUT while reading
+        # responses, which free the queue.
+        view = memoryview(message)
+        while view:
+            try:
+                written = os.write(device.fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                self._epoll.modify(device.fd, select.EPOLLIN | select.EPOLLOUT)
+                try:
+                    while not any(fd == device.fd and mask & select.EPOLLOUT for fd, mask in self._poll()):
+                        pass
+                finally:
+                    self._epoll.modify(device.fd, select.EPOLLIN)
+
+    def _broadcast(self, header):
+        for device in self._devices:
+            self._write(device, bytes((header,)))
+
+    # ---- Modes (sent to every reader) ----
+
+    def idle(self):
+        """Go idle, discarding pending commands of every reader, and their
+        responses not read yet."""
+        self._broadcast(MESSAGE_IDLE_HEADER)
+        # The driver writes no response for discarded commands after the idle
+        # message: read the ones already written, so that none of them is
+        # taken for the response of a later command.
+        for device in self._devices:
+            self._fill(device)
+            device.responses.clear()
+            device.outstanding = 0
+        self._release()
+
+    def poll_once(self):
+        self._broadcast(MESSAGE_POLL_ONCE_HEADER)
+
+    def poll_repeat(self):
+        self._broadcast(MESSAGE_POLL_REPEAT_MODE_HEADER)
+
+    def inventory(self):
+        self._broadcast(MESSAGE_INVENTORY_MODE_HEADER)
+
+    def presence(self):
+        self._broadcast(MESSAGE_PRESENCE_MODE_HEADER)
+
+    def timestamps(self, enabled=True):
+        """Ask every driver to timestamp events, which are then merged in
+        timestamp order."""
+        self._broadcast(MESSAGE_TIMESTAMPS_ON_HEADER if enabled else MESSAGE_TIMESTAMPS_OFF_HEADER)
+        self._timestamps = enabled
+
+    def read_event(self):
+        """Wait for the next UidSeen, InventoryRound, TagArrived or
+        TagDeparted event of any reader and return it as a PoolEvent."""
+        while not self._events:
+            timeout = None
+            if self._held:
+                # Wake up when the oldest held event can be released.
+                timeout = max(0.0, (self._held[0][0] + self._lag() - time.monotonic_ns()) / 1e9)
+            self._poll(timeout)
+        return self._events.popleft()
+
+    def events(self):
+        """Iterate over the merged event stream."""
+        while True:
+            yield self.read_event()
+
+    # ---- Commands ----
+
+    def locate(self, uid):
+        """Return the index of the reader which last reported uid, or None."""
+        return self._locations.get(bytes(uid))
+
+    def _least_busy(self):
+        return min(self._devices, key=lambda device: device.outstanding)
+
+    def _split(self, request):
+        # Return the (device, request) pairs to send for a request: a read
+        # multiple tags command is split by reader, as each driver only runs it
+        # once all its UIDs were found in its own field.
+        if request[0] != MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            index = self._locations.get(bytes(request[1:1 + UID_SIZE]))
+            return [(self._least_busy() if index is None else self._devices[index], request)]
+        uids = _request_uids(request)
+        start = 3 + len(uids) * UID_SIZE
+        addresses = request[start:start + request[2]]
+        unknown = self._least_busy()
+        groups = {}
+        for uid in uids:
+            index = self._locations.get(uid)
+            device = unknown if index is None else self._devices[index]
+            groups.setdefault(device, []).append(uid)
+        return [(device, encode_read_multiple_tags(group, addresses)) for device, group in groups.items()]
+
+    def _send(self, request, reader=None):
+        parts = self._split(request) if reader is None else [(self._devices[reader], request)]
+        for device, part in parts:
+            self._write(device, part)
+            device.outstanding += response_count(part)
+        return parts
+
+    def send(self, request, reader=None):
+        """Queue a command built with the protocol.encode_* functions on
+        reader, or on the reader chosen for its UID, without waiting for its
+        response. Return the index of the reader, or a list of indexes for
+        read multiple tags commands, which are split by reader."""
+        parts = self._send(request, reader)
+        if request[0] == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            return [device.index for device, _ in parts]
+        return parts[0][0].index
+
+    def read_response(self, reader):
+        """Return the next command response event of a reader."""
+        device = self._devices[reader]
+        while not device.responses:
+            self.poll()
+        return device.responses.popleft()
+
+    def _read_response(self, reader, event_type):
+        event = self.read_response(reader)
+        if type(event) is not event_type:
+            raise ProtocolError(f"Unexpected response {event}, expected {event_type.__name__}")
+        return event
+
+    def _read_responses(self, request, parts):
+        event_type = RESPONSE_TYPES[request[0]]
+        if request[0] != MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            (device, _), = parts
+            return self._read_response(device.index, event_type)
+        # Merge the responses of every reader, in the order of the UIDs.
+        events = {}
+        for device, part in parts:
+            for _ in range(response_count(part)):
+                event = self._read_response(device.index, event_type)
+                events[event.uid] = event
+        return [events[uid] for uid in _request_uids(request)]
+
+    def execute(self, requests):
+        """Send several commands, each to the reader chosen for its UID, and
+        return their response events in the same order (a list of events for
+        read multiple tags commands, in the order of their UIDs). Readers run
+        their commands in parallel."""
+        sent = [self._send(request) for request in requests]
+        return [self._read_responses(request, parts) for request, parts in zip(requests, sent)]
+
+    def read_block(self, uid, addr):
+        check_request(uid, (addr,))
+        return self.execute([encode_read_single_block(uid, addr)])[0].data
+
+    def write_block(self, uid, addr, data):
+        """Write a block and return the data read back by the driver."""
+        check_request(uid, (addr,))
+        return self.execute([encode_write_single_block(uid, addr, data)])[0].data
+
+    def read_blocks(self, uid, addresses):
+        check_request(uid, addresses)
+        return list(self.execute([encode_read_multiple_blocks(uid, addresses)])[0].blocks)
+
+    def write_blocks(self, uid, addresses, blocks):
+        """Write blocks and return the data read back by the driver."""
+        check_request(uid, addresses)
+        return list(self.execute([encode_write_multiple_blocks(uid, addresses, blocks)])[0].blocks)
+
+    def read_tags(self, uids, addresses):
+        """Read the same blocks from several chips, each on the reader which
+        last reported it. Return a dict of blocks by UID."""
+        for uid in uids:
+            check_request(uid, addresses)
+        events = self.execute([encode_read_multiple_tags(uids, addresses)])[0]
+        return {event.uid: list(event.blocks) for event in events}
+
+
+def _request_uids(request):
+    # UIDs of an encoded read multiple tags command.
+    return [bytes(request[ix:ix + UID_SIZE]) for ix in range(3, 3 + request[1] * UID_SIZE, UID_SIZE)]
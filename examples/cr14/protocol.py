@@ -0,0 +1,237 @@
+# Byte protocol spoken by the cr14 driver on /dev/rfidN.
+# See the PROTOCOL section at the top of cr14.c for the reference description.
+
+DEFAULT_DEVICE = "/dev/rfid0"
+
+# ---- Message headers (same names as in cr14.c) ----
+MESSAGE_UID_HEADER = ord('u')
+MESSAGE_POLL_ONCE_HEADER = ord('p')
+MESSAGE_POLL_REPEAT_MODE_HEADER = ord('P')
+MESSAGE_INVENTORY_MODE_HEADER = ord('I')
+MESSAGE_PRESENCE_MODE_HEADER = ord('T')
+MESSAGE_ARRIVED_HEADER = ord('a')
+MESSAGE_DEPARTED_HEADER = ord('d')
+MESSAGE_TIMESTAMPS_ON_HEADER = ord('X')
+MESSAGE_TIMESTAMPS_OFF_HEADER = ord('x')
+MESSAGE_TIMESTAMPED_HEADER = ord('E')
+MESSAGE_IDLE_HEADER = ord('i')
+MESSAGE_READ_SINGLE_BLOCK_HEADER = ord('r')
+MESSAGE_WRITE_SINGLE_BLOCK_HEADER = ord('w')
+MESSAGE_READ_MULTIPLE_BLOCKS_HEADER = ord('R')
+MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER = ord('W')
+MESSAGE_READ_MULTIPLE_TAGS_HEADER = ord('M')
+MESSAGE_SESSION_HEADER = ord('S')
+MESSAGE_SESSION_RELEASE_HEADER = ord('s')
+MESSAGE_DUMP_HEADER = ord('D')
+MESSAGE_READ_RANGE_HEADER = ord('G')
+MESSAGE_WRITE_RANGE_HEADER = ord('F')
+MESSAGE_WRITE_AND_VERIFY_HEADER = ord('V')
+
+WRITE_FLAG_NO_VERIFY = 0x01
+
+UID_SIZE = 8
+BLOCK_SIZE = 4
+MAX_ADDRESSES = 255
+MAX_MULTIPLE_TAGS_UIDS = 16
+INVENTORY_MAX_UIDS = 64
+
+UID_FRAME_SIZE = 1 + UID_SIZE
+SINGLE_BLOCK_FRAME_SIZE = 1 + BLOCK_SIZE
+# 'I', round number, timestamp, slot markers, collided slots, uids count
+INVENTORY_HEADER_SIZE = 16
+# 'E' and timestamp, followed by the timestamped frame
+TIMESTAMP_PREFIX_SIZE = 9
+# Largest frame the driver can emit: timestamped 'V' with 255 mismatches.
+MAX_FRAME_SIZE = TIMESTAMP_PREFIX_SIZE + 2 + MAX_ADDRESSES * (1 + BLOCK_SIZE)
+
+# Same values as cr14.c: the driver queues up to COMMAND_QUEUE_SIZE - 1
+# commands, and drops frames which do not fit in its read buffer.
+COMMAND_QUEUE_SIZE = 8
+CIRCULAR_BUFFER_SIZE = 8192
+
+
+class ProtocolError(Exception):
+    """Raised when the driver sends an unexpected or malformed frame."""
+
+
+def format_uid(uid):
+    """Format a little endian UID as printed by the examples (MSB first)."""
+    return ":".join("{:02x}".format(c) for c in reversed(uid))
+
+
+def frame_size(buffer, start, end):
+    """Return the size of the frame starting at buffer[start], or 0 if more
+    bytes are needed to know it. Raise ProtocolError on unknown headers."""
+    if end <= start:
+        return 0
+    header = buffer[start]
+    if header == MESSAGE_TIMESTAMPED_HEADER:
+        size = frame_size(buffer, start + TIMESTAMP_PREFIX_SIZE, end)
+        return TIMESTAMP_PREFIX_SIZE + size if size else 0
+    if header in (MESSAGE_UID_HEADER, MESSAGE_ARRIVED_HEADER, MESSAGE_DEPARTED_HEADER, MESSAGE_SESSION_HEADER):
+        return UID_FRAME_SIZE
+    if header == MESSAGE_READ_SINGLE_BLOCK_HEADER or header == MESSAGE_WRITE_SINGLE_BLOCK_HEADER:
+        return SINGLE_BLOCK_FRAME_SIZE
+    if header in (MESSAGE_READ_MULTIPLE_BLOCKS_HEADER, MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER,
+                  MESSAGE_READ_RANGE_HEADER, MESSAGE_WRITE_RANGE_HEADER):
+        if end - start < 2:
+            return 0
+        return 2 + buffer[start + 1] * BLOCK_SIZE
+    if header == MESSAGE_INVENTORY_MODE_HEADER:
+        if end - start < INVENTORY_HEADER_SIZE:
+            return 0
+        return INVENTORY_HEADER_SIZE + buffer[start + INVENTORY_HEADER_SIZE - 1] * UID_SIZE
+    if header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+        if end - start < 2 + UID_SIZE:
+            return 0
+        return 2 + UID_SIZE + buffer[start + 1 + UID_SIZE] * BLOCK_SIZE
+    if header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+        if end - start < 2:
+            return 0
+        # Address and data of each mismatch.
+        return 2 + buffer[start + 1] * (1 + BLOCK_SIZE)
+    if header == MESSAGE_DUMP_HEADER:
+        if end - start < 2:
+            return 0
+        # Blocks, then the system block.
+        return 2 + (buffer[start + 1] + 1) * BLOCK_SIZE
+    raise ProtocolError(f"Unexpected packet header {header}")
+
+
+# ---- Request encoders ----
+
+def _check_uid(uid):
+    if len(uid) != UID_SIZE:
+        raise ValueError(f"UID must be {UID_SIZE} bytes, got {len(uid)}")
+
+
+def _check_addresses(addresses):
+    if not 1 <= len(addresses) <= MAX_ADDRESSES:
+        raise ValueError(f"Expected 1 to {MAX_ADDRESSES} addresses, got {len(addresses)}")
+
+
+def _check_blocks(blocks, count):
+    if len(blocks) != count:
+        raise ValueError(f"Expected {count} blocks, got {len(blocks)}")
+    for block in blocks:
+        if len(block) != BLOCK_SIZE:
+            raise ValueError(f"Blocks must be {BLOCK_SIZE} bytes, got {len(block)}")
+
+
+def encode_read_single_block(uid, addr):
+    _check_uid(uid)
+    return bytes((MESSAGE_READ_SINGLE_BLOCK_HEADER,)) + bytes(uid) + bytes((addr,))
+
+
+def encode_write_single_block(uid, addr, data):
+    _check_uid(uid)
+    _check_blocks((data,), 1)
+    return bytes((MESSAGE_WRITE_SINGLE_BLOCK_HEADER,)) + bytes(uid) + bytes((addr,)) + bytes(data)
+
+
+def encode_read_multiple_blocks(uid, addresses):
+    _check_uid(uid)
+    _check_addresses(addresses)
+    return bytes((MESSAGE_READ_MULTIPLE_BLOCKS_HEADER,)) + bytes(uid) + bytes((len(addresses),)) + bytes(addresses)
+
+
+def encode_write_multiple_blocks(uid, addresses, blocks):
+    _check_uid(uid)
+    _check_addresses(addresses)
+    _check_blocks(blocks, len(addresses))
+    return (bytes((MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER,)) + bytes(uid) + bytes((len(addresses),))
+            + bytes(addresses) + b''.join(bytes(block) for block in blocks))
+
+
+def encode_write_and_verify(uid, addresses, blocks, verify=True):
+    """Write blocks back to back, then read them back in a single pass (unless
+    verify is False). The driver only reports mismatching blocks."""
+    _check_uid(uid)
+    _check_addresses(addresses)
+    _check_blocks(blocks, len(addresses))
+    flags = 0 if verify else WRITE_FLAG_NO_VERIFY
+    return (bytes((MESSAGE_WRITE_AND_VERIFY_HEADER,)) + bytes(uid) + bytes((flags, len(addresses)))
+            + bytes(addresses) + b''.join(bytes(block) for block in blocks))
+
+
+def encode_read_multiple_tags(uids, addresses):
+    """Read the same blocks from every chip in uids, within a polling round
+    if they are all in the field. The driver sends a response per chip."""
+    if not 1 <= len(uids) <= MAX_MULTIPLE_TAGS_UIDS:
+        raise ValueError(f"Expected 1 to {MAX_MULTIPLE_TAGS_UIDS} UIDs, got {len(uids)}")
+    if len(set(bytes(uid) for uid in uids)) != len(uids):
+        raise ValueError("UIDs must be unique")
+    for uid in uids:
+        _check_uid(uid)
+    _check_addresses(addresses)
+    return (bytes((MESSAGE_READ_MULTIPLE_TAGS_HEADER, len(uids), len(addresses)))
+            + b''.join(bytes(uid) for uid in uids) + bytes(addresses))
+
+
+def encode_session(uid):
+    """Open a session with the chip: once it is found, RF stays on and the
+    chip selected so that its next commands run without polling again."""
+    _check_uid(uid)
+    return bytes((MESSAGE_SESSION_HEADER,)) + bytes(uid)
+
+
+def encode_dump(uid):
+    """Read every block of the chip and its system block. The driver finds
+    the number of blocks from the UID, and rejects unknown chips."""
+    _check_uid(uid)
+    return bytes((MESSAGE_DUMP_HEADER,)) + bytes(uid)
+
+
+def range_addresses(start, count, stride=1):
+    """Addresses of the blocks of a range command."""
+    if not 1 <= count <= MAX_ADDRESSES or stride < 1 or not 0 <= start <= start + (count - 1) * stride <= 0xFF:
+        raise ValueError(f"Invalid range, start {start}, count {count}, stride {stride}")
+    return range(start, start + count * stride, stride)
+
+
+def encode_read_range(uid, start, count, stride=1):
+    """Read count blocks from start, every stride blocks, with a request
+    of the same size whatever the number of blocks."""
+    _check_uid(uid)
+    range_addresses(start, count, stride)
+    return bytes((MESSAGE_READ_RANGE_HEADER,)) + bytes(uid) + bytes((start, count, stride))
+
+
+def encode_write_range(uid, start, count, data, stride=1):
+    """Write data to count blocks from start, every stride blocks, e.g. to
+    erase them. The driver reads them back like with 'W'."""
+    _check_uid(uid)
+    _check_blocks((data,), 1)
+    range_addresses(start, count, stride)
+    return bytes((MESSAGE_WRITE_RANGE_HEADER,)) + bytes(uid) + bytes((start, count, stride)) + bytes(data)
+
+
+def response_count(request):
+    """Number of responses the driver sends for an encoded command."""
+    if request[0] == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+        return request[1]
+    return 1
+
+
+def response_size(request):
+    """Largest size of the responses the driver sends for an encoded command,
+    timestamp prefixes included."""
+    header = request[0]
+    if header in (MESSAGE_READ_SINGLE_BLOCK_HEADER, MESSAGE_WRITE_SINGLE_BLOCK_HEADER):
+        size = SINGLE_BLOCK_FRAME_SIZE
+    elif header == MESSAGE_SESSION_HEADER:
+        size = UID_FRAME_SIZE
+    elif header in (MESSAGE_READ_MULTIPLE_BLOCKS_HEADER, MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER):
+        size = 2 + request[1 + UID_SIZE] * BLOCK_SIZE
+    elif header in (MESSAGE_READ_RANGE_HEADER, MESSAGE_WRITE_RANGE_HEADER):
+        size = 2 + request[2 + UID_SIZE] * BLOCK_SIZE
+    elif header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+        size = 2 + request[2 + UID_SIZE] * (1 + BLOCK_SIZE)
+    elif header == MESSAGE_DUMP_HEADER:
+        # The number of blocks depends on the chip.
+        size = 2 + (MAX_ADDRESSES + 1) * BLOCK_SIZE
+    elif header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+        size = 2 + UID_SIZE + request[2] * BLOCK_SIZE
+    else:
+        raise ValueError(f"Unexpected request header {header}")
+    return response_count(request) * (TIMESTAMP_PREFIX_SIZE + size)
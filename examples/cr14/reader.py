@@ -0,0 +1,299 @@
+import os
+import select
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .protocol import (
+    DEFAULT_DEVICE,
+    COMMAND_QUEUE_SIZE,
+    CIRCULAR_BUFFER_SIZE,
+    MESSAGE_POLL_ONCE_HEADER,
+    MESSAGE_POLL_REPEAT_MODE_HEADER,
+    MESSAGE_INVENTORY_MODE_HEADER,
+    MESSAGE_PRESENCE_MODE_HEADER,
+    MESSAGE_TIMESTAMPS_ON_HEADER,
+    MESSAGE_TIMESTAMPS_OFF_HEADER,
+    MESSAGE_IDLE_HEADER,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER,
+    MESSAGE_SESSION_RELEASE_HEADER,
+    ProtocolError,
+    encode_read_single_block,
+    encode_write_single_block,
+    encode_read_multiple_blocks,
+    encode_write_multiple_blocks,
+    encode_write_and_verify,
+    encode_read_multiple_tags,
+    encode_session,
+    encode_dump,
+    encode_read_range,
+    encode_write_range,
+    range_addresses,
+    response_count,
+    response_size,
+)
+from .decoder import (
+    DEFAULT_BUFFER_SIZE,
+    RESPONSE_TYPES,
+    Decoder,
+    ReadSingleResult,
+    WriteSingleResult,
+    ReadMultipleResult,
+    WriteMultipleResult,
+    SessionOpened,
+    TagDump,
+    WriteVerifyResult,
+)
+from .models import TagMemory, check_dump, check_request
+
+
+class Reader:
+    """Client for /dev/rfidN.
+
+    Frames are read in large chunks into a preallocated buffer and decoded in
+    place, so a full 'R' response usually costs a single read() syscall.
+    UIDs reported while waiting for a command response are not dropped but
+    queued, and returned by read_uid().
+
+    The driver queues commands, so several of them can be sent at once with
+    execute() instead of waiting for each response in turn.
+    """
+
+    def __init__(self, path=DEFAULT_DEVICE, flags=os.O_RDWR, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.decoder = Decoder(buffer_size)
+        self._events = deque()
+        self._fd = os.open(path, flags)
+
+    def fileno(self):
+        return self._fd
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # ---- Low level I/O ----
+
+    def _write(self, message):
+        # The driver consumes at most one message per write() call.
+        view = memoryview(message)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def _fill(self):
+        count = os.readv(self._fd, [self.decoder.get_buffer()])
+        if count == 0:
+            raise EOFError("Device was closed")
+        self.decoder.commit(count)
+        self._events.extend(self.decoder.events())
+
+    def read_event(self):
+        """Return the next command response event. UIDs received meanwhile
+        are queued in decoder.uids."""
+        while not self._events:
+            self._fill()
+        return self._events.popleft()
+
+    def _read_response(self, event_type):
+        event = self.read_event()
+        if type(event) is not event_type:
+            raise ProtocolError(f"Unexpected response {event}, expected {event_type.__name__}")
+        return event
+
+    def send(self, request):
+        """Queue a command built with the protocol.encode_* functions without
+        waiting for its response, which read_event() will return. Blocks while
+        the driver's queue is full."""
+        self._write(request)
+
+    def _read_responses(self, request):
+        event_type = RESPONSE_TYPES[request[0]]
+        if request[0] == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            return [self._read_response(event_type) for _ in range(response_count(request))]
+        return self._read_response(event_type)
+
+    def execute(self, requests):
+        """Send several commands and return their response events, in the
+        same order (a list of events for read multiple tags commands).
+        Commands for the same tag run within a polling round."""
+        # write() blocks while the driver's command queue is full, and the
+        # driver drops responses which do not fit in its read buffer: read
+        # responses before sending more commands than the queue holds, or
+        # commands whose responses could overflow half the buffer (the other
+        # half is left to UID and presence messages).
+        responses = []
+        pending = deque()
+        pending_size = 0
+        for request in requests:
+            size = response_size(request)
+            while pending and (len(pending) >= COMMAND_QUEUE_SIZE - 1
+                               or pending_size + size > CIRCULAR_BUFFER_SIZE // 2):
+                done = pending.popleft()
+                responses.append(self._read_responses(done))
+                pending_size -= response_size(done)
+            self.send(request)
+            pending.append(request)
+            pending_size += size
+        responses.extend(self._read_responses(request) for request in pending)
+        return responses
+
+    # ---- Modes ----
+
+    def idle(self):
+        self._write(bytes((MESSAGE_IDLE_HEADER,)))
+
+    def poll_once(self):
+        self._write(bytes((MESSAGE_POLL_ONCE_HEADER,)))
+
+    def poll_repeat(self):
+        self._write(bytes((MESSAGE_POLL_REPEAT_MODE_HEADER,)))
+
+    def timestamps(self, enabled=True):
+        """Ask the driver to timestamp UIDs, presence events and responses
+        (see the timestamp field of the events)."""
+        self._write(bytes((MESSAGE_TIMESTAMPS_ON_HEADER if enabled else MESSAGE_TIMESTAMPS_OFF_HEADER,)))
+
+    def read_uid_event(self, timeout=None):
+        """Wait for the next UID message and return it as a UidSeen, or None
+        if there was none within timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.decoder.uids:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([self._fd], [], [], remaining)[0]:
+                    return None
+            self._fill()
+        return self.decoder.uids.popleft()
+
+    def read_uid(self):
+        """Wait for the next UID message and return the UID (little endian)."""
+        return self.read_uid_event().uid
+
+    def uids(self):
+        """Iterate over UIDs as they are reported by the driver."""
+        while True:
+            yield self.read_uid()
+
+    def inventory(self):
+        self._write(bytes((MESSAGE_INVENTORY_MODE_HEADER,)))
+
+    def read_round(self):
+        """Wait for the next inventory message and return it as an
+        InventoryRound."""
+        while not self.decoder.rounds:
+            self._fill()
+        return self.decoder.rounds.popleft()
+
+    def rounds(self):
+        """Iterate over inventory rounds as they are reported by the driver."""
+        while True:
+            yield self.read_round()
+
+    def presence(self):
+        self._write(bytes((MESSAGE_PRESENCE_MODE_HEADER,)))
+
+    def read_presence(self):
+        """Wait for the next TagArrived or TagDeparted event."""
+        while not self.decoder.presence:
+            self._fill()
+        return self.decoder.presence.popleft()
+
+    def presence_events(self):
+        """Iterate over TagArrived and TagDeparted events."""
+        while True:
+            yield self.read_presence()
+
+    # ---- Commands ----
+
+    def read_block(self, uid, addr):
+        check_request(uid, (addr,))
+        self._write(encode_read_single_block(uid, addr))
+        return self._read_response(ReadSingleResult).data
+
+    def write_block(self, uid, addr, data):
+        """Write a block and return the data read back by the driver."""
+        check_request(uid, (addr,))
+        self._write(encode_write_single_block(uid, addr, data))
+        return self._read_response(WriteSingleResult).data
+
+    def _blocks(self, event, count):
+        if len(event.blocks) != count:
+            raise ProtocolError(f"Unexpected block count, got {len(event.blocks)}, expected {count}")
+        return list(event.blocks)
+
+    def read_blocks(self, uid, addresses):
+        check_request(uid, addresses)
+        self._write(encode_read_multiple_blocks(uid, addresses))
+        return self._blocks(self._read_response(ReadMultipleResult), len(addresses))
+
+    def write_blocks(self, uid, addresses, blocks):
+        """Write blocks and return the data read back by the driver."""
+        check_request(uid, addresses)
+        self._write(encode_write_multiple_blocks(uid, addresses, blocks))
+        return self._blocks(self._read_response(WriteMultipleResult), len(addresses))
+
+    def write_and_verify(self, uid, addresses, blocks, verify=True):
+        """Write blocks back to back and read them back in a single pass, or
+        not at all if verify is False. Return a dict of the data read back by
+        address, for blocks which do not hold the written data."""
+        check_request(uid, addresses)
+        self._write(encode_write_and_verify(uid, addresses, blocks, verify))
+        return self._read_response(WriteVerifyResult).mismatches
+
+    def read_range(self, uid, start, count, stride=1):
+        """Read count blocks from start, every stride blocks."""
+        check_request(uid, range_addresses(start, count, stride))
+        self._write(encode_read_range(uid, start, count, stride))
+        return self._blocks(self._read_response(ReadMultipleResult), count)
+
+    def write_range(self, uid, start, count, data, stride=1):
+        """Write data to count blocks from start, every stride blocks, and
+        return the data read back by the driver."""
+        check_request(uid, range_addresses(start, count, stride))
+        self._write(encode_write_range(uid, start, count, data, stride))
+        return self._blocks(self._read_response(WriteMultipleResult), count)
+
+    def read_tags(self, uids, addresses):
+        """Read the same blocks from several chips, in a single polling round
+        when they are all in the field. Return a dict of blocks by UID."""
+        for uid in uids:
+            check_request(uid, addresses)
+        request = encode_read_multiple_tags(uids, addresses)
+        self._write(request)
+        return {event.uid: self._blocks(event, len(addresses)) for event in self._read_responses(request)}
+
+    def dump(self, uid):
+        """Read every block of the chip and its system block with a single
+        command. Return a TagMemory."""
+        model = check_dump(uid)
+        self._write(encode_dump(uid))
+        event = self._read_response(TagDump)
+        memory = TagMemory(model)
+        memory.load(event.blocks, event.system_block)
+        return memory
+
+    def open_session(self, uid):
+        """Wait for the chip and keep it selected with RF on, so that the next
+        commands for it run without polling again. The driver closes the
+        session after session_ms without any command."""
+        self._write(encode_session(uid))
+        self._read_response(SessionOpened)
+
+    def release_session(self):
+        self._write(bytes((MESSAGE_SESSION_RELEASE_HEADER,)))
+
+    @contextmanager
+    def session(self, uid):
+        """Open a session with the chip for the duration of a with block."""
+        self.open_session(uid)
+        try:
+            yield self
+        finally:
+            self.release_session()
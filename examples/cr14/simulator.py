@@ -0,0 +1,600 @@
+# Userspace simulator of a CR14 and its driver.
+#
+# It speaks the /dev/rfidN byte protocol on a pseudo-terminal, so the slave
+# path can be used instead of /dev/rfid0 by any client (Reader, AsyncReader
+# or the example scripts). Polling rounds follow cr14_do_poll: anticollision
+# with slot markers when several tags are in the field, the durations of the
+# frame exchanges the driver waits for and the same adaptive polling interval.
+
+import argparse
+import os
+import pty
+import random
+import selectors
+import threading
+import time
+import tty
+from collections import deque
+
+from .protocol import (
+    UID_SIZE,
+    COMMAND_QUEUE_SIZE,
+    CIRCULAR_BUFFER_SIZE,
+    BLOCK_SIZE,
+    MESSAGE_UID_HEADER,
+    MESSAGE_POLL_ONCE_HEADER,
+    MESSAGE_POLL_REPEAT_MODE_HEADER,
+    MESSAGE_INVENTORY_MODE_HEADER,
+    MESSAGE_PRESENCE_MODE_HEADER,
+    MESSAGE_ARRIVED_HEADER,
+    MESSAGE_DEPARTED_HEADER,
+    MESSAGE_TIMESTAMPS_ON_HEADER,
+    MESSAGE_TIMESTAMPS_OFF_HEADER,
+    MESSAGE_TIMESTAMPED_HEADER,
+    MESSAGE_IDLE_HEADER,
+    MESSAGE_READ_SINGLE_BLOCK_HEADER,
+    MESSAGE_WRITE_SINGLE_BLOCK_HEADER,
+    MESSAGE_READ_MULTIPLE_BLOCKS_HEADER,
+    MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER,
+    MESSAGE_READ_MULTIPLE_TAGS_HEADER,
+    MESSAGE_SESSION_HEADER,
+    MESSAGE_SESSION_RELEASE_HEADER,
+    MESSAGE_DUMP_HEADER,
+    MESSAGE_READ_RANGE_HEADER,
+    MESSAGE_WRITE_RANGE_HEADER,
+    MESSAGE_WRITE_AND_VERIFY_HEADER,
+    WRITE_FLAG_NO_VERIFY,
+    MAX_MULTIPLE_TAGS_UIDS,
+    INVENTORY_MAX_UIDS,
+    format_uid,
+)
+from .models import COUNTER_BLOCKS, MODELS_BY_NAME, MANUFACTURER_ST, SYSTEM_BLOCK, UID_MSB, TagMemory, identify
+
+SRI512 = MODELS_BY_NAME['SRI512']
+
+# Same values as cr14.c
+POLL_MIN_MS_DEFAULT = 50
+POLL_MAX_MS_DEFAULT = 500
+POLL_BACKOFF_ROUNDS_DEFAULT = 10
+ABSENCE_MS_DEFAULT = 200
+SESSION_MS_DEFAULT = 500
+PRESENCE_MAX_TAGS = 64
+
+# Durations of frame exchanges, in microseconds, see cr14_exchange_timings in
+# cr14.c (the driver polls for their completion).
+INITIATE_US = 750
+SLOT_MARKER_US = 16000
+SELECT_US = 750
+GET_UID_US = 1200
+COMPLETION_US = 650
+READ_BLOCK_US = 750
+WRITE_BLOCK_US = 800
+# EEPROM programming time after a write, waited by the driver.
+EEPROM_PROGRAMMING_US = 5000
+COUNTER_PROGRAMMING_US = 7000
+
+
+def random_uid(model=SRI512, rng=random):
+    """Return a random UID (little endian) for the given chip model."""
+    serial = bytes(rng.randrange(256) for _ in range(5))
+    # Remaining bits of the model byte belong to the serial number, except the
+    # values which are the 8 bits id of another model.
+    spare_bits = 8 - model.id_bits
+    while True:
+        model_byte = (model.model_id << spare_bits) | rng.randrange(1 << spare_bits)
+        uid = (bytes((UID_MSB, MANUFACTURER_ST, model_byte)) + serial)[::-1]
+        if identify(uid) is model:
+            return uid
+
+
+class SimulatedTag:
+    """A tag in the field between enter and leave (seconds since the start of
+    the simulator, leave=None meaning forever). Its memory follows the rules
+    of its chip model."""
+
+    def __init__(self, uid=None, enter=0.0, leave=None, model=SRI512, rng=random):
+        self.uid = bytes(uid) if uid is not None else random_uid(model, rng)
+        if len(self.uid) != UID_SIZE:
+            raise ValueError(f"UID must be {UID_SIZE} bytes, got {len(self.uid)}")
+        self.enter = enter
+        self.leave = leave
+        self.memory = TagMemory(model)
+
+    def in_field(self, now):
+        return self.enter <= now and (self.leave is None or now < self.leave)
+
+
+class Simulator:
+    """Simulated /dev/rfidN device.
+
+        with Simulator(tags=[SimulatedTag()]) as simulator:
+            with Reader(simulator.path) as reader:
+                ...
+
+    A read-only client expects poll repeat mode, which a pty cannot detect:
+    pass poll_repeat=True in that case. time_scale multiplies every delay
+    (0 runs rounds as fast as possible). The polling policy parameters are
+    the ones of the driver (see cr14.c).
+    """
+
+    def __init__(self, tags=(), poll_repeat=False, time_scale=1.0, seed=None,
+                 poll_min_ms=POLL_MIN_MS_DEFAULT, poll_max_ms=POLL_MAX_MS_DEFAULT,
+                 poll_backoff_rounds=POLL_BACKOFF_ROUNDS_DEFAULT, absence_ms=ABSENCE_MS_DEFAULT,
+                 session_ms=SESSION_MS_DEFAULT):
+        self.tags = list(tags)
+        self.time_scale = time_scale
+        self.poll_min_ms = poll_min_ms
+        self.poll_max_ms = poll_max_ms
+        self.poll_backoff_rounds = poll_backoff_rounds
+        self.poll_interval_ms = poll_min_ms
+        self.absence_ms = absence_ms
+        self.session_ms = session_ms
+        self._present = {}      # uid => last seen
+        self._round_start = 0.0
+        self._empty_rounds = 0
+        self._chips_found = 0
+        self._slot_markers = 0
+        self._collided_slots = 0
+        self._inventory_uids = []
+        self._inventory_seq = 0
+        self._timestamps = False
+        self._mode_seq = 0
+        self._running_mode_seq = 0
+        self._in_session = False
+        self._session_release = False
+        self.dropped_frames = 0
+        self.rounds = 0
+        self._rng = random.Random(seed)
+        self._mode = MESSAGE_POLL_REPEAT_MODE_HEADER if poll_repeat else MESSAGE_IDLE_HEADER
+        # Pending commands: (header, uids, addresses, blocks, uids done, flags)
+        self._commands = deque()
+        self._write_buffer = bytearray()
+        self._out = bytearray()
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._start = time.monotonic()
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.path = os.ttyname(self._slave)
+
+    def now(self):
+        return time.monotonic() - self._start
+
+    # ---- Tag population ----
+
+    def add_tag(self, tag):
+        with self._lock:
+            self.tags.append(tag)
+        return tag
+
+    def remove_tag(self, uid):
+        """Make the tag leave the field now."""
+        now = self.now()
+        with self._lock:
+            for tag in self.tags:
+                if tag.uid == uid and tag.in_field(now):
+                    tag.leave = now
+
+    def _tags_in_field(self):
+        now = self.now()
+        with self._lock:
+            return [tag for tag in self.tags if tag.in_field(now)]
+
+    # ---- Lifecycle ----
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="cr14-simulator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def run(self):
+        self._running = True
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._master, selectors.EVENT_READ)
+            while self._running:
+                events = selectors.EVENT_READ
+                if self._out:
+                    events |= selectors.EVENT_WRITE
+                selector.modify(self._master, events)
+                timeout = 0.05
+                if self._polling():
+                    timeout = min(timeout, max(0.0, self._next_poll - self.now()))
+                for _, mask in selector.select(timeout):
+                    if mask & selectors.EVENT_READ:
+                        self._receive()
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush()
+                if self._polling() and self.now() >= self._next_poll:
+                    self._do_poll()
+                    self._update_polling_interval()
+                    # Accept commands that were waiting for room in the queue.
+                    while self._parse_message():
+                        pass
+                    self._next_poll = self.now() + self.time_scale * self.poll_interval_ms / 1000
+
+    def _polling(self):
+        return self._mode != MESSAGE_IDLE_HEADER or bool(self._commands)
+
+    # ---- Client => driver ----
+
+    def _receive(self):
+        try:
+            data = os.read(self._master, 4096)
+        except BlockingIOError:
+            return
+        self._write_buffer.extend(data)
+        while self._parse_message():
+            pass
+
+    def _parse_message(self):
+        # Same framing as cr14_write.
+        buffer = self._write_buffer
+        if not buffer:
+            return False
+        header = buffer[0]
+        if header in (MESSAGE_TIMESTAMPS_ON_HEADER, MESSAGE_TIMESTAMPS_OFF_HEADER):
+            del buffer[:1]
+            self._timestamps = header == MESSAGE_TIMESTAMPS_ON_HEADER
+            return True
+        if header == MESSAGE_SESSION_RELEASE_HEADER:
+            del buffer[:1]
+            self._session_release = True
+            return True
+        if header in (MESSAGE_IDLE_HEADER, MESSAGE_POLL_ONCE_HEADER, MESSAGE_POLL_REPEAT_MODE_HEADER,
+                      MESSAGE_INVENTORY_MODE_HEADER, MESSAGE_PRESENCE_MODE_HEADER):
+            del buffer[:1]
+            self._mode = header
+            self._mode_seq += 1
+            # The table is emptied when entering or leaving presence mode, see
+            # cr14_clear_presence.
+            timestamp = time.monotonic_ns()
+            for uid in self._present:
+                self._emit(bytes((MESSAGE_DEPARTED_HEADER,)) + uid, timestamp)
+            self._present.clear()
+            if header == MESSAGE_IDLE_HEADER:
+                # Discard pending commands.
+                self._commands.clear()
+            self._next_poll = 0.0
+            return True
+        if len(self._commands) >= COMMAND_QUEUE_SIZE - 1:
+            # Queue is full: the driver would block the writer.
+            return False
+        if header == MESSAGE_READ_SINGLE_BLOCK_HEADER:
+            packet_len = 10
+        elif header == MESSAGE_WRITE_SINGLE_BLOCK_HEADER:
+            packet_len = 14
+        elif header == MESSAGE_READ_MULTIPLE_BLOCKS_HEADER:
+            packet_len = 10 + buffer[9] if len(buffer) >= 10 else 10
+        elif header == MESSAGE_WRITE_MULTIPLE_BLOCKS_HEADER:
+            packet_len = 10 + buffer[9] * 5 if len(buffer) >= 10 else 10
+        elif header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+            packet_len = 11 + buffer[10] * 5 if len(buffer) >= 11 else 11
+        elif header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            if len(buffer) < 3:
+                return False
+            if not 1 <= buffer[1] <= MAX_MULTIPLE_TAGS_UIDS:
+                # The driver fails the write with EINVAL.
+                del buffer[:3]
+                return True
+            packet_len = 3 + buffer[1] * UID_SIZE + buffer[2]
+        elif header in (MESSAGE_SESSION_HEADER, MESSAGE_DUMP_HEADER):
+            packet_len = 1 + UID_SIZE
+        elif header == MESSAGE_READ_RANGE_HEADER:
+            packet_len = 12
+        elif header == MESSAGE_WRITE_RANGE_HEADER:
+            packet_len = 16
+        else:
+            # Unknown header, skip it.
+            del buffer[:1]
+            return True
+        if len(buffer) < packet_len:
+            return False
+        packet = bytes(buffer[:packet_len])
+        del buffer[:packet_len]
+        uids = (packet[1:9],)
+        if header == MESSAGE_READ_SINGLE_BLOCK_HEADER:
+            self._commands.append((header, uids, [packet[9]], [], set(), 0))
+        elif header == MESSAGE_WRITE_SINGLE_BLOCK_HEADER:
+            self._commands.append((header, uids, [packet[9]], [packet[10:14]], set(), 0))
+        elif header == MESSAGE_READ_MULTIPLE_BLOCKS_HEADER:
+            self._commands.append((header, uids, list(packet[10:]), [], set(), 0))
+        elif header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            end = 3 + packet[1] * UID_SIZE
+            uids = tuple(packet[ix:ix + UID_SIZE] for ix in range(3, end, UID_SIZE))
+            if len(set(uids)) != len(uids):
+                # Duplicate uids: the driver fails the write with EINVAL.
+                return True
+            self._commands.append((header, uids, list(packet[end:]), [], set(), 0))
+        elif header == MESSAGE_SESSION_HEADER:
+            self._session_release = False
+            self._commands.append((header, uids, [], [], set(), 0))
+        elif header == MESSAGE_DUMP_HEADER:
+            model = identify(packet[1:9])
+            if model is None:
+                # Unknown chip: the driver fails the write with EINVAL.
+                return True
+            addresses = list(range(model.blocks_count)) + [SYSTEM_BLOCK]
+            self._commands.append((header, uids, addresses, [], set(), 0))
+        elif header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+            flags, count = packet[9:11]
+            data = packet[11 + count:]
+            blocks = [data[ix * BLOCK_SIZE:(ix + 1) * BLOCK_SIZE] for ix in range(count)]
+            self._commands.append((header, uids, list(packet[11:11 + count]), blocks, set(), flags))
+        elif header in (MESSAGE_READ_RANGE_HEADER, MESSAGE_WRITE_RANGE_HEADER):
+            start, count, stride = packet[9:12]
+            if count == 0 or stride == 0 or start + (count - 1) * stride > 0xFF:
+                # The driver fails the write with EINVAL.
+                return True
+            addresses = list(range(start, start + count * stride, stride))
+            blocks = [packet[12:16]] * count if header == MESSAGE_WRITE_RANGE_HEADER else []
+            self._commands.append((header, uids, addresses, blocks, set(), 0))
+        else:
+            count = packet[9]
+            data = packet[10 + count:]
+            blocks = [data[ix * BLOCK_SIZE:(ix + 1) * BLOCK_SIZE] for ix in range(count)]
+            self._commands.append((header, uids, list(packet[10:10 + count]), blocks, set(), 0))
+        self._next_poll = 0.0
+        return True
+
+    # ---- Driver => client ----
+
+    def _emit(self, frame, timestamp=None):
+        # See cr14_write_timestamped_to_device
+        if self._timestamps and timestamp is not None:
+            frame = bytes((MESSAGE_TIMESTAMPED_HEADER,)) + timestamp.to_bytes(8, byteorder='little') + frame
+        if len(self._out) + len(frame) > CIRCULAR_BUFFER_SIZE:
+            # Not writing to device as circular buffer would overflow
+            self.dropped_frames += 1
+            return
+        self._out.extend(frame)
+        self._flush()
+
+    def _flush(self):
+        try:
+            written = os.write(self._master, self._out)
+        except BlockingIOError:
+            return
+        del self._out[:written]
+
+    # ---- Polling ----
+
+    def _elapse(self, usecs):
+        if self.time_scale:
+            time.sleep(usecs * self.time_scale / 1000000)
+
+    def _update_polling_interval(self):
+        # See cr14_update_polling_interval
+        if self._chips_found or self._present or self._mode == MESSAGE_POLL_ONCE_HEADER or self._commands:
+            self._empty_rounds = 0
+            interval_ms = self.poll_min_ms
+        elif self._empty_rounds < self.poll_backoff_rounds:
+            self._empty_rounds += 1
+            interval_ms = self.poll_min_ms
+        else:
+            interval_ms = max(self.poll_interval_ms, self.poll_min_ms) * 2
+        self.poll_interval_ms = min(max(interval_ms, self.poll_min_ms), self.poll_max_ms)
+
+    def _do_poll(self):
+        # See cr14_do_poll
+        self.rounds += 1
+        self._chips_found = 0
+        self._slot_markers = 0
+        self._collided_slots = 0
+        self._inventory_uids = []
+        timestamp = time.monotonic_ns()
+        self._round_start = self.now()
+        mode = self._mode
+        self._running_mode_seq = self._mode_seq
+        self._anticollision()
+        if mode == MESSAGE_PRESENCE_MODE_HEADER:
+            # See cr14_process_departures
+            # Tags found in this round stay present even when time_scale makes
+            # absence_ms shorter than a round.
+            absence = self.absence_ms * self.time_scale / 1000
+            for uid, last_seen in list(self._present.items()):
+                if last_seen < self._round_start and self._round_start - last_seen >= absence:
+                    self._emit(bytes((MESSAGE_DEPARTED_HEADER,)) + uid, timestamp)
+                    del self._present[uid]
+        elif mode == MESSAGE_INVENTORY_MODE_HEADER:
+            # See cr14_write_inventory
+            self._emit(bytes((MESSAGE_INVENTORY_MODE_HEADER,))
+                       + (self._inventory_seq & 0xFFFFFFFF).to_bytes(4, byteorder='little')
+                       + timestamp.to_bytes(8, byteorder='little')
+                       + bytes((min(self._slot_markers, 255), min(self._collided_slots, 255),
+                                len(self._inventory_uids)))
+                       + b''.join(self._inventory_uids))
+            self._inventory_seq += 1
+
+    def _anticollision(self):
+        self._elapse(INITIATE_US)
+        remaining = self._tags_in_field()
+        if len(remaining) == 1:
+            self._process_tag(remaining[0])
+            return
+        while remaining:
+            self._elapse(SLOT_MARKER_US)
+            self._slot_markers += 1
+            slots = {}
+            for tag in remaining:
+                slots.setdefault(self._rng.randrange(16), []).append(tag)
+            remaining = []
+            for slot in sorted(slots):
+                if len(slots[slot]) == 1:
+                    self._process_tag(slots[slot][0])
+                else:
+                    self._collided_slots += 1
+                    remaining.extend(slots[slot])
+
+    def _process_tag(self, tag):
+        # See cr14_get_uid_and_process_mode
+        self._elapse(SELECT_US + GET_UID_US)
+        timestamp = time.monotonic_ns()
+        self._chips_found += 1
+        if self._mode in (MESSAGE_POLL_ONCE_HEADER, MESSAGE_POLL_REPEAT_MODE_HEADER):
+            self._emit(bytes((MESSAGE_UID_HEADER,)) + tag.uid, timestamp)
+            if self._mode == MESSAGE_POLL_ONCE_HEADER:
+                self._mode = MESSAGE_IDLE_HEADER
+        elif self._mode == MESSAGE_PRESENCE_MODE_HEADER:
+            if tag.uid not in self._present and len(self._present) < PRESENCE_MAX_TAGS:
+                self._emit(bytes((MESSAGE_ARRIVED_HEADER,)) + tag.uid, timestamp)
+            if tag.uid in self._present or len(self._present) < PRESENCE_MAX_TAGS:
+                self._present[tag.uid] = self._round_start
+        elif self._mode == MESSAGE_INVENTORY_MODE_HEADER:
+            if tag.uid not in self._inventory_uids and len(self._inventory_uids) < INVENTORY_MAX_UIDS:
+                self._inventory_uids.append(tag.uid)
+        if self._process_commands(tag) and self._in_session:
+            self._run_session(tag)
+        self._in_session = False
+        self._elapse(COMPLETION_US)
+
+    def _process_commands(self, tag):
+        # Run queued commands for this chip, in order. Return False if one
+        # failed.
+        while self._commands:
+            _, uids, _, _, done, _ = command = self._commands[0]
+            if tag.uid not in uids or tag.uid in done:
+                break
+            response = self._process_command(tag, command)
+            if response is None:
+                return False
+            # See cr14_complete_command: a command discarded by an idle message
+            # received meanwhile gets no response.
+            self._receive()
+            if not self._commands or self._commands[0] is not command:
+                return True
+            self._emit(response, time.monotonic_ns())
+            done.add(tag.uid)
+            if len(done) < len(uids):
+                # Multiple tags command waiting for other chips.
+                break
+            self._commands.popleft()
+        return True
+
+    def _run_session(self, tag):
+        # See cr14_run_session
+        while self._wait_session():
+            _, uids, _, _, done, _ = self._commands[0]
+            if tag.uid not in uids or tag.uid in done:
+                # Next command targets another chip.
+                break
+            if not self._process_commands(tag):
+                break
+
+    def _wait_session(self):
+        # See cr14_wait_session: wait for a command, a release message, a new
+        # mode or the timeout.
+        deadline = self.now() + self.time_scale * self.session_ms / 1000
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._master, selectors.EVENT_READ)
+            while (self._running and not self._commands and not self._session_release
+                   and self._mode_seq == self._running_mode_seq):
+                remaining = deadline - self.now()
+                if remaining <= 0:
+                    break
+                if selector.select(remaining):
+                    self._receive()
+                self._flush()
+        return self._running and bool(self._commands) and self._mode_seq == self._running_mode_seq
+
+    def _process_command(self, tag, command):
+        # See cr14_process_command. Return the response, or None if the
+        # command did not complete.
+        header, _, addresses, blocks, _, flags = command
+        if header == MESSAGE_SESSION_HEADER:
+            self._in_session = True
+            return bytes((header,)) + tag.uid
+        for addr, data in zip(addresses, blocks):
+            self._elapse(WRITE_BLOCK_US)
+            self._elapse(COUNTER_PROGRAMMING_US if addr in COUNTER_BLOCKS else EEPROM_PROGRAMMING_US)
+            if not tag.in_field(self.now()):
+                # Tag left during the EEPROM cycle.
+                tag.memory.write_block(addr, data, torn=True)
+                return None
+            tag.memory.write_block(addr, data)
+        if header == MESSAGE_WRITE_AND_VERIFY_HEADER:
+            return self._verify(tag, addresses, blocks, flags)
+        read_data = []
+        for addr in addresses:
+            self._elapse(READ_BLOCK_US)
+            data = tag.memory.read_block(addr)
+            if data is None or not tag.in_field(self.now()):
+                # Chip did not reply, try again on next poll.
+                return None
+            read_data.append(data)
+        if header in (MESSAGE_READ_SINGLE_BLOCK_HEADER, MESSAGE_WRITE_SINGLE_BLOCK_HEADER):
+            return bytes((header,)) + read_data[0]
+        if header == MESSAGE_READ_MULTIPLE_TAGS_HEADER:
+            return bytes((header,)) + tag.uid + bytes((len(read_data),)) + b''.join(read_data)
+        if header == MESSAGE_DUMP_HEADER:
+            return bytes((header, len(read_data) - 1)) + b''.join(read_data)
+        return bytes((header, len(read_data))) + b''.join(read_data)
+
+    def _verify(self, tag, addresses, blocks, flags):
+        # Single read pass of a write and verify command, only mismatching
+        # blocks are reported.
+        mismatches = b''
+        if not flags & WRITE_FLAG_NO_VERIFY:
+            for addr, written in zip(addresses, blocks):
+                self._elapse(READ_BLOCK_US)
+                data = tag.memory.read_block(addr)
+                if data is None or not tag.in_field(self.now()):
+                    return None
+                if data != written:
+                    mismatches += bytes((addr,)) + data
+        return bytes((MESSAGE_WRITE_AND_VERIFY_HEADER, len(mismatches) // (1 + BLOCK_SIZE))) + mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate a CR14 reader on a pseudo-terminal.")
+    parser.add_argument("--tags", type=int, default=1, help="number of tags in the field")
+    parser.add_argument("--model", choices=sorted(MODELS_BY_NAME), default='SRI512', help="chip model of the tags")
+    parser.add_argument("--dwell", type=float, default=None,
+                        help="seconds each tag stays in the field (tags then arrive one after the other)")
+    parser.add_argument("--read-only", action="store_true",
+                        help="start in poll repeat mode, as the driver does for read-only clients")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="multiplier applied to every delay")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    model = MODELS_BY_NAME[args.model]
+    tags = []
+    for ix in range(args.tags):
+        if args.dwell is None:
+            tags.append(SimulatedTag(model=model, rng=rng))
+        else:
+            tags.append(SimulatedTag(enter=ix * args.dwell, leave=(ix + 1) * args.dwell, model=model, rng=rng))
+    simulator = Simulator(tags, poll_repeat=args.read_only, time_scale=args.time_scale, seed=args.seed)
+    for tag in tags:
+        print(f"Tag {format_uid(tag.uid)}")
+    print(f"Simulated device: {simulator.path}")
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        pass
+    simulator.close()
+
+
+if __name__ == "__main__":
+    main()
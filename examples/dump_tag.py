@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import cr14
+
+# Example code demonstrating the dump command.
+# Reads every block of the chip and its system block with a single command,
+# the driver finding the number of blocks from the chip model.
+
+with cr14.Reader() as reader:
+    print("Waiting for a chip")
+    try:
+        reader.poll_once()
+        uid = reader.read_uid()
+        print(f"UID: {cr14.format_uid(uid)}")
+        model = cr14.identify(uid)
+        if model is None:
+            print("Unknown chip model, cannot dump it")
+        else:
+            print(f"Model: {model.name}")
+            memory = reader.dump(uid)
+            for x in range(model.blocks_count):
+                data = memory.read_block(x)
+                data_str = ":".join("{:02x}".format(c) for c in reversed(data))
+                print(f"{x} {data_str}")
+            data_str = ":".join("{:02x}".format(c) for c in reversed(memory.system_block))
+            print(f"255 {data_str}")
+    except cr14.ProtocolError as err:
+        print(err)
+    except KeyboardInterrupt:
+        pass
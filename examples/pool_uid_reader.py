@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+
+import cr14
+
+# Example code demonstrating how to use several readers at once.
+# Print UIDs detected by any reader (/dev/rfid0, /dev/rfid1...), with the
+# device that detected them.
+
+with cr14.ReaderPool() as pool:
+    try:
+        pool.poll_repeat()
+        for reader, event in pool.events():
+            print(f"{pool.paths[reader]}: {cr14.format_uid(event.uid)}")
+    except cr14.ProtocolError as err:
+        print(err)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+import asyncio
+import select
+
+import pytest
+
+from cr14 import AsyncReader
+from cr14.decoder import ReadMultipleResult, ReadSingleResult, ReadTagResult
+from cr14.models import MODELS_BY_NAME
+from cr14.protocol import encode_read_multiple_blocks, encode_read_multiple_tags, encode_read_single_block
+from cr14.simulator import SimulatedTag, Simulator
+
+TIME_SCALE = 0.1
+
+
+@pytest.fixture
+def tags():
+    tags = [SimulatedTag(model=MODELS_BY_NAME['SRIX4K']), SimulatedTag()]
+    for index, tag in enumerate(tags):
+        for addr in range(7, 15):
+            tag.memory.write_block(addr, bytes((index, addr)) * 2)
+    return tags
+
+
+@pytest.fixture
+def simulator(tags):
+    with Simulator(tags, time_scale=TIME_SCALE) as simulator:
+        yield simulator
+
+
+def run(simulator, test):
+    async def main():
+        async with AsyncReader(simulator.path) as reader:
+            await test(reader)
+
+    asyncio.run(main())
+
+
+def test_commands(tags, simulator):
+    tag, other = tags
+
+    async def test(reader):
+        assert await reader.read_block(tag.uid, 7) == tag.memory.read_block(7)
+        assert await reader.write_block(tag.uid, 20, b'abcd') == b'abcd'
+        assert await reader.write_blocks(tag.uid, [21, 22], [b'efgh', b'ijkl']) == [b'efgh', b'ijkl']
+        assert await reader.read_blocks(tag.uid, [20, 21, 22]) == [b'abcd', b'efgh', b'ijkl']
+        assert await reader.read_range(tag.uid, 20, 2, stride=2) == [b'abcd', b'ijkl']
+        assert await reader.write_and_verify(tag.uid, [23], [b'mnop']) == {}
+        assert (await reader.dump(tag.uid)).blocks == tag.memory.blocks
+        assert await reader.read_tags([other.uid, tag.uid], [8]) == {
+            tag.uid: [tag.memory.read_block(8)], other.uid: [other.memory.read_block(8)]}
+
+    run(simulator, test)
+
+
+def test_concurrent_commands(tags, simulator):
+    # Responses are matched to commands in the order they were sent.
+    async def test(reader):
+        calls = [reader.read_block(tag.uid, addr) for addr in range(7, 15) for tag in tags]
+        expected = [tag.memory.read_block(addr) for addr in range(7, 15) for tag in tags]
+        assert await asyncio.gather(*calls) == expected
+
+    run(simulator, test)
+
+
+def test_execute(tags, simulator):
+    tag, other = tags
+
+    async def test(reader):
+        events = await reader.execute([
+            encode_read_single_block(other.uid, 9),
+            encode_read_multiple_tags([tag.uid, other.uid], [10]),
+            encode_read_multiple_blocks(tag.uid, [11, 12]),
+        ])
+        assert events[0] == ReadSingleResult(other.memory.read_block(9))
+        assert [type(event) for event in events[1]] == [ReadTagResult] * 2
+        assert events[2] == ReadMultipleResult((tag.memory.read_block(11), tag.memory.read_block(12)))
+
+    run(simulator, test)
+
+
+def test_idle_late_response(tags, simulator):
+    # The response of a command sent before idle() may still be in the device
+    # when it is called: it must not be matched to the next command.
+    tag, other = tags
+
+    async def test(reader):
+        task = asyncio.ensure_future(reader.read_block(tag.uid, 7))
+        await asyncio.sleep(0)
+        # Block the event loop until the response is written, without reading it.
+        assert select.select([reader.fileno()], [], [], 1)[0]
+        await reader.idle()
+        assert await reader.read_block(other.uid, 7) == other.memory.read_block(7)
+        assert task.result() == tag.memory.read_block(7)
+
+    run(simulator, test)
+
+
+def test_idle_cancels_pending(tags, simulator):
+    tag, other = tags
+
+    async def test(reader):
+        tasks = [asyncio.ensure_future(reader.read_blocks(tag.uid, list(range(7, 127)))) for _ in range(4)]
+        await asyncio.sleep(0)
+        await reader.idle()
+        assert await reader.read_block(other.uid, 8) == other.memory.read_block(8)
+        await asyncio.wait(tasks)
+        assert any(task.cancelled() for task in tasks)
+        for task in tasks:
+            assert task.cancelled() or len(task.result()) == 120
+
+    run(simulator, test)
@@ -0,0 +1,100 @@
+import pytest
+
+from cr14.decoder import (
+    Decoder,
+    InventoryRound,
+    ReadMultipleResult,
+    ReadSingleResult,
+    TagArrived,
+    UidSeen,
+    WriteVerifyResult,
+)
+from cr14.protocol import MAX_FRAME_SIZE, ProtocolError
+
+UID1 = bytes(range(1, 9))
+UID2 = bytes(range(11, 19))
+
+
+def timestamped(timestamp, frame):
+    return b'E' + timestamp.to_bytes(8, byteorder='little') + frame
+
+
+def inventory(seq, timestamp, uids):
+    return (b'I' + seq.to_bytes(4, byteorder='little') + timestamp.to_bytes(8, byteorder='little')
+            + bytes((3, 1, len(uids))) + b''.join(uids))
+
+
+# Interleaved UID messages, responses and timestamped frames, as sent by a
+# driver polling while it runs commands.
+STREAM = [
+    (b'u' + UID1, UidSeen(UID1)),
+    (b'r' + b'abcd', ReadSingleResult(b'abcd')),
+    (timestamped(42, b'u' + UID2), UidSeen(UID2, 42)),
+    (b'R\x03' + b'1111' + b'2222' + b'3333', ReadMultipleResult((b'1111', b'2222', b'3333'))),
+    (inventory(7, 1000, [UID1, UID2]), InventoryRound(7, 1000, 3, 1, (UID1, UID2))),
+    (timestamped(43, b'V\x01' + b'\x09' + b'wxyz'), WriteVerifyResult({9: b'wxyz'}, 43)),
+    (b'a' + UID1, TagArrived(UID1)),
+    (timestamped(44, b'r' + b'efgh'), ReadSingleResult(b'efgh', 44)),
+]
+DATA = b''.join(frame for frame, _ in STREAM)
+EVENTS = [event for _, event in STREAM]
+RESPONSES = [event for event in EVENTS if type(event) in (ReadSingleResult, ReadMultipleResult, WriteVerifyResult)]
+
+
+def test_frames_inline():
+    decoder = Decoder(route_uids=False)
+    assert decoder.feed(DATA) == EVENTS
+    assert decoder.pending() == 0
+
+
+def test_frames_routed():
+    decoder = Decoder()
+    assert decoder.feed(DATA) == RESPONSES
+    assert list(decoder.uids) == [UidSeen(UID1), UidSeen(UID2, 42)]
+    assert list(decoder.rounds) == [InventoryRound(7, 1000, 3, 1, (UID1, UID2))]
+    assert list(decoder.presence) == [TagArrived(UID1)]
+
+
+def test_frames_byte_by_byte():
+    decoder = Decoder(route_uids=False)
+    events = []
+    for ix in range(len(DATA)):
+        events.extend(decoder.feed(DATA[ix:ix + 1]))
+    assert events == EVENTS
+    assert decoder.pending() == 0
+
+
+def test_frames_split_at_every_offset():
+    for split in range(len(DATA) + 1):
+        decoder = Decoder(route_uids=False)
+        events = decoder.feed(DATA[:split])
+        events.extend(decoder.feed(DATA[split:]))
+        assert events == EVENTS, split
+
+
+def test_frames_across_buffer_compaction():
+    # Smallest buffer, fed in chunks which do not align with frames, so that
+    # partial frames are moved back to the start of the buffer.
+    decoder = Decoder(2 * MAX_FRAME_SIZE, route_uids=False)
+    data = DATA * 50
+    events = []
+    for ix in range(0, len(data), 97):
+        buffer = decoder.get_buffer()
+        chunk = data[ix:ix + 97]
+        buffer[:len(chunk)] = chunk
+        decoder.commit(len(chunk))
+        events.extend(decoder.events())
+    assert events == EVENTS * 50
+
+
+def test_unknown_header():
+    decoder = Decoder()
+    with pytest.raises(ProtocolError):
+        decoder.feed(b'z')
+    # The offending byte is dropped and decoding resumes.
+    assert decoder.feed(b'r' + b'abcd') == [ReadSingleResult(b'abcd')]
+
+
+def test_buffer_size():
+    with pytest.raises(ValueError):
+        Decoder(MAX_FRAME_SIZE)
@@ -0,0 +1,26 @@
+import random
+
+import pytest
+
+from cr14.models import MODELS, identify
+from cr14.simulator import random_uid
+
+
+@pytest.mark.parametrize('model', MODELS, ids=lambda model: model.name)
+def test_identify_every_model(model):
+    rng = random.Random(0)
+    for _ in range(64):
+        assert identify(random_uid(model, rng)) is model
+
+
+def test_identify_st25tb_before_sri():
+    # 0x1B starts with 0b000110, the id of the SRI512.
+    uid = bytes((0, 0, 0, 0, 0, 0x1B, 0x02, 0xD0))
+    assert identify(uid).name == 'ST25TB512-AC'
+    uid = bytes((0, 0, 0, 0, 0, 0x18, 0x02, 0xD0))
+    assert identify(uid).name == 'SRI512'
+
+
+def test_identify_unknown():
+    assert identify(bytes((0, 0, 0, 0, 0, 0x1B, 0x04, 0xD0))) is None
+    assert identify(bytes(7)) is None
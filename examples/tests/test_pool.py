@@ -0,0 +1,84 @@
+import select
+import time
+
+import pytest
+
+from cr14 import ReaderPool
+from cr14.decoder import ReadTagResult
+from cr14.protocol import encode_read_multiple_tags, encode_read_single_block
+from cr14.simulator import SimulatedTag, Simulator
+
+TIME_SCALE = 0.1
+
+
+@pytest.fixture
+def tags():
+    tags = [SimulatedTag() for _ in range(3)]
+    for index, tag in enumerate(tags):
+        tag.memory.write_block(8, bytes((index,)) * 4)
+    return tags
+
+
+@pytest.fixture
+def pool(tags):
+    # The first reader sees the first two tags, the second one the last tag.
+    with Simulator(tags[:2], time_scale=TIME_SCALE) as first, Simulator(tags[2:], time_scale=TIME_SCALE) as second:
+        with ReaderPool([first.path, second.path]) as pool:
+            yield pool
+
+
+def locate(pool, tags):
+    pool.poll_repeat()
+    while None in [pool.locate(tag.uid) for tag in tags]:
+        pool.read_event()
+    pool.idle()
+
+
+def test_commands(tags, pool):
+    locate(pool, tags)
+    first, second, third = tags
+    assert pool.read_block(third.uid, 8) == third.memory.read_block(8)
+    assert pool.write_block(first.uid, 9, b'abcd') == b'abcd'
+    assert pool.write_blocks(second.uid, [9, 10], [b'efgh', b'ijkl']) == [b'efgh', b'ijkl']
+    assert pool.read_blocks(second.uid, [9, 10]) == [b'efgh', b'ijkl']
+
+
+def test_read_tags_split(tags, pool):
+    locate(pool, tags)
+    first, second, third = tags
+    assert [pool.locate(tag.uid) for tag in tags] == [0, 0, 1]
+    events = pool.execute([encode_read_multiple_tags([third.uid, first.uid, second.uid], [8])])[0]
+    # Merged in the order of the request's UIDs, whichever reader answered.
+    assert [type(event) for event in events] == [ReadTagResult] * 3
+    assert [event.uid for event in events] == [third.uid, first.uid, second.uid]
+    assert [event.blocks for event in events] == [(tag.memory.read_block(8),) for tag in (third, first, second)]
+    assert pool.read_tags([first.uid, third.uid], [8]) == {
+        first.uid: [first.memory.read_block(8)], third.uid: [third.memory.read_block(8)]}
+
+
+def test_idle_late_response(tags, pool):
+    # The response of a command sent before idle() may still be in the device
+    # when it is called: it must not be matched to the next command.
+    locate(pool, tags)
+    first, second, _ = tags
+    assert pool.send(encode_read_single_block(first.uid, 8)) == 0
+    # Wait until the response is written, without reading it.
+    assert select.select([pool.fileno()], [], [], 1)[0]
+    pool.idle()
+    assert pool.read_block(second.uid, 8) == second.memory.read_block(8)
+
+
+def test_events_in_timestamp_order(pool):
+    pool.timestamps()
+    for mode in (pool.poll_repeat, pool.inventory):
+        mode()
+        last = 0
+        count = 0
+        end = time.monotonic() + 0.5
+        while time.monotonic() < end:
+            _, event = pool.read_event()
+            assert event.timestamp >= last
+            last = event.timestamp
+            count += 1
+        pool.idle()
+        assert count > 10
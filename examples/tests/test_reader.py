@@ -0,0 +1,105 @@
+import pytest
+
+from cr14 import Reader
+from cr14.decoder import ReadMultipleResult, WriteVerifyResult
+from cr14.models import MODELS_BY_NAME
+from cr14.protocol import (
+    CIRCULAR_BUFFER_SIZE,
+    COMMAND_QUEUE_SIZE,
+    encode_read_multiple_blocks,
+    encode_write_and_verify,
+    response_size,
+)
+from cr14.simulator import SimulatedTag, Simulator
+
+TIME_SCALE = 0.1
+
+
+@pytest.fixture
+def tag():
+    return SimulatedTag(model=MODELS_BY_NAME['SRIX4K'])
+
+
+@pytest.fixture
+def simulator(tag):
+    with Simulator([tag], time_scale=TIME_SCALE) as simulator:
+        yield simulator
+
+
+@pytest.fixture
+def reader(simulator):
+    with Reader(simulator.path) as reader:
+        yield reader
+
+
+def test_single_block(tag, reader):
+    tag.memory.write_block(7, b'abcd')
+    assert reader.read_block(tag.uid, 7) == b'abcd'
+    assert reader.write_block(tag.uid, 8, b'efgh') == b'efgh'
+    assert tag.memory.read_block(8) == b'efgh'
+
+
+def test_multiple_blocks(tag, reader):
+    blocks = [bytes((addr,)) * 4 for addr in range(7, 27)]
+    assert reader.write_blocks(tag.uid, list(range(7, 27)), blocks) == blocks
+    assert reader.read_blocks(tag.uid, list(range(7, 27))) == blocks
+    assert reader.read_range(tag.uid, 7, 10, stride=2) == blocks[::2]
+    assert reader.write_range(tag.uid, 30, 3, b'wxyz') == [b'wxyz'] * 3
+    assert tag.memory.read_block(32) == b'wxyz'
+
+
+def test_write_and_verify(tag, reader):
+    assert reader.write_and_verify(tag.uid, [7, 8], [b'abcd', b'efgh']) == {}
+    assert tag.memory.read_block(8) == b'efgh'
+
+
+def test_dump(tag, reader):
+    tag.memory.write_block(100, b'abcd')
+    memory = reader.dump(tag.uid)
+    assert memory.blocks == tag.memory.blocks
+    assert memory.system_block == tag.memory.system_block
+
+
+def test_read_tags(tag, simulator, reader):
+    other = SimulatedTag()
+    simulator.add_tag(other)
+    tag.memory.write_block(9, b'1111')
+    other.memory.write_block(9, b'2222')
+    assert reader.read_tags([tag.uid, other.uid], [9]) == {tag.uid: [b'1111'], other.uid: [b'2222']}
+
+
+def test_execute_bounded(tag, simulator, reader, monkeypatch):
+    # Many large responses: execute() must neither fill the driver's command
+    # queue nor send commands whose responses could overflow its buffer.
+    addresses = list(range(7, 127))
+    requests = [encode_read_multiple_blocks(tag.uid, addresses)] * 20
+    requests += [encode_write_and_verify(tag.uid, addresses, [b'abcd'] * len(addresses))] * 5
+    in_flight = []
+    send = reader.send
+    read_responses = reader._read_responses
+
+    def checked_send(request):
+        in_flight.append(request)
+        assert len(in_flight) <= COMMAND_QUEUE_SIZE - 1
+        assert sum(map(response_size, in_flight)) <= CIRCULAR_BUFFER_SIZE // 2
+        send(request)
+
+    def checked_read_responses(request):
+        assert in_flight.pop(0) is request
+        return read_responses(request)
+
+    monkeypatch.setattr(reader, 'send', checked_send)
+    monkeypatch.setattr(reader, '_read_responses', checked_read_responses)
+    responses = reader.execute(requests)
+    assert [type(event) for event in responses] == [ReadMultipleResult] * 20 + [WriteVerifyResult] * 5
+    assert all(len(event.blocks) == len(addresses) for event in responses[:20])
+    assert all(event.mismatches == {} for event in responses[20:])
+    assert simulator.dropped_frames == 0
+
+
+def test_read_uid_event_timeout(tag, simulator, reader):
+    simulator.remove_tag(tag.uid)
+    reader.poll_repeat()
+    assert reader.read_uid_event(timeout=0.2) is None
+    other = simulator.add_tag(SimulatedTag())
+    assert reader.read_uid_event(timeout=1).uid == other.uid